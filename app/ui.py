@@ -20,8 +20,9 @@ from metrics.aggregations import (
     load_worker_burden_distribution,
     load_service_category_distribution,
     load_monthly_activity_heatmap,
+    load_ingest_status,
 )
-from jobs.ingest_job import run_ingest
+from jobs.ingest_job import run_ingest_once
 from app.visualizations import (
     create_volunteer_ranking_chart,
     create_comparison_chart,
@@ -64,13 +65,30 @@ def main() -> None:
                     type="primary",
                     use_container_width=True):
             with st.spinner("正在刷新数据..."):
-                run_ingest()
-            st.success("✅ 刷新完成")
+                # 其他会话或定时任务正在刷新时，等待并共用其结果
+                result = run_ingest_once()
+            if result.attached:
+                st.info("ℹ️ 已有刷新正在进行，已等待其完成")
+            elif result.skipped:
+                st.info("ℹ️ 表格没有变化，无需刷新")
+            else:
+                st.success("✅ 刷新完成")
     
     # 显示数据截止日期
     from datetime import date
     current_date = date.today()
     st.info(f"📅 数据显示截止日期：{current_date.strftime('%Y年%m月%d日')}")
+
+    # 后台定时同步状态（只读一行状态表）
+    ingest_status = load_ingest_status()
+    if ingest_status and ingest_status["last_success_at"] is not None:
+        caption = (f"🕒 最近一次同步：{ingest_status['last_success_at'].strftime('%Y-%m-%d %H:%M')}"
+                   f"（耗时 {ingest_status['last_duration_seconds']:.1f} 秒）")
+        if ingest_status["next_run_at"] is not None:
+            caption += f" ｜ 下次同步：{ingest_status['next_run_at'].strftime('%H:%M')}"
+        if ingest_status["consecutive_failures"]:
+            caption += f" ｜ ⚠️ 最近 {ingest_status['consecutive_failures']} 次同步失败"
+        st.caption(caption)
     
     st.divider()  # 添加分隔线
 
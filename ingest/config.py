@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+import os
+import threading
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import yaml
+
+
+CONFIG_PATH = Path("configs/config.yaml")
+
+_config_cache: Tuple[Optional[float], Optional[dict]] = (None, None)
+_config_lock = threading.Lock()
+
+
+def load_config() -> dict:
+    """Parse config.yaml, re-reading it only when the file's mtime changes.
+
+    The returned dict is shared between callers; treat it as read-only.
+    """
+    global _config_cache
+    mtime = os.path.getmtime(CONFIG_PATH)
+    with _config_lock:
+        cached_mtime, cached = _config_cache
+        if cached is None or cached_mtime != mtime:
+            with open(CONFIG_PATH, "r", encoding="utf-8") as f:
+                cached = yaml.safe_load(f)
+            _config_cache = (mtime, cached)
+        return cached
+
+
+def source_configs(cfg: dict) -> List[dict]:
+    """One config per roster tab to ingest.
+
+    Entries of the optional ``sources`` list override ``spreadsheet_id``,
+    ``sheet_name`` and (optionally) ``columns`` of the top-level config;
+    without ``sources`` the top-level tab is the only source.
+    """
+    sources = cfg.get("sources") or []
+    if not sources:
+        return [cfg]
+    primary = (cfg["spreadsheet_id"], cfg["sheet_name"])
+    merged, seen = [], set()
+    for src in sources:
+        src = {**cfg, **src}
+        key = (src["spreadsheet_id"], src["sheet_name"])
+        if key in seen:
+            raise ValueError(f"duplicate source {key[0]}:{key[1]}")
+        seen.add(key)
+        # fact_id only carries the row number, so facts of every tab other
+        # than the top-level one are scoped by their source to stay unique
+        # (the top-level tab keeps the ids it always had).
+        src["fact_id_scope"] = None if key == primary else f"{key[0]}:{key[1]}"
+        merged.append(src)
+    return merged
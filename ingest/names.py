@@ -0,0 +1,159 @@
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import re
+import threading
+import unicodedata
+from collections import defaultdict
+from typing import Dict, Iterable, List, Mapping, Optional, Sequence, Tuple, Union
+
+from ingest.config import load_config
+
+
+# Bump when normalize_name changes so stored volunteer_ids are re-derived
+NAME_RULES_VERSION = 1
+
+_WHITESPACE_RUN = re.compile(r"\s+")
+
+
+def normalize_name(name: object) -> str:
+    """NFKC-fold a cell (full-width letters/digits/spaces become ASCII),
+    trim it and collapse inner whitespace runs to one space."""
+    if name is None:
+        return ""
+    return _WHITESPACE_RUN.sub(" ", unicodedata.normalize("NFKC", str(name))).strip()
+
+
+def match_key(name: object) -> str:
+    """What two spellings of one name have in common: normalized, case-folded
+    and without spaces ("Zhang San" and "zhangsan" share a key)."""
+    return normalize_name(name).casefold().replace(" ", "")
+
+
+class AliasIndex:
+    """Hash index from every alias spelling to its canonical volunteer_id.
+
+    ``aliases`` is the ``volunteer_aliases`` mapping of config.yaml:
+    canonical name -> alias or list of aliases. Lookups are one dict probe
+    on ``match_key``; names without an alias resolve to their normalized
+    form (spelling variants are only merged once listed, see
+    ``suggest_duplicates``).
+    """
+
+    def __init__(self, aliases: Optional[Mapping[str, Union[str, Sequence[str], None]]] = None) -> None:
+        self._by_key: Dict[str, str] = {}
+        self.aliases: Dict[str, str] = {}
+        for canonical, names in (aliases or {}).items():
+            volunteer_id = normalize_name(canonical)
+            if not volunteer_id:
+                raise ValueError("volunteer_aliases: empty canonical name")
+            if isinstance(names, str) or names is None:
+                names = [names] if names else []
+            for alias in [canonical, *names]:
+                key = match_key(alias)
+                if not key:
+                    continue
+                existing = self._by_key.setdefault(key, volunteer_id)
+                if existing != volunteer_id:
+                    raise ValueError(f"volunteer_aliases: {alias!r} maps to both {existing!r} and {volunteer_id!r}")
+                if normalize_name(alias) != volunteer_id:
+                    self.aliases[normalize_name(alias)] = volunteer_id
+
+    def resolve(self, name: object) -> str:
+        normalized = normalize_name(name)
+        return self._by_key.get(match_key(normalized), normalized)
+
+    def fingerprint(self) -> str:
+        """Changes whenever a name may resolve differently."""
+        payload = json.dumps([NAME_RULES_VERSION, sorted(self._by_key.items())], ensure_ascii=False)
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+_index_cache: Tuple[Optional[str], Optional[AliasIndex]] = (None, None)
+_index_lock = threading.Lock()
+
+
+def alias_index(cfg: Optional[dict] = None) -> AliasIndex:
+    """The AliasIndex of ``cfg`` (default config.yaml), rebuilt only when
+    ``volunteer_aliases`` changes."""
+    global _index_cache
+    aliases = (cfg or load_config()).get("volunteer_aliases") or {}
+    cache_key = json.dumps(aliases, ensure_ascii=False, sort_keys=True)
+    with _index_lock:
+        cached_key, cached = _index_cache
+        if cached is None or cached_key != cache_key:
+            cached = AliasIndex(aliases)
+            _index_cache = (cache_key, cached)
+        return cached
+
+
+def _grams(key: str, n: int) -> set:
+    padded = f"^{key}$"
+    return {padded[i:i + n] for i in range(max(1, len(padded) - n + 1))}
+
+
+def suggest_duplicates(names: Iterable[str], index: Optional[AliasIndex] = None, n: int = 2,
+                       min_similarity: float = 0.6, max_postings: int = 500) -> List[Tuple[str, str, float]]:
+    """Likely duplicate volunteer names, most similar first.
+
+    An inverted index from character n-grams (of ``match_key``) to names
+    yields candidate pairs sharing a gram; each is scored with the Dice
+    coefficient of their gram sets. Grams shared by more than
+    ``max_postings`` names (e.g. a common surname) only score pairs, they
+    do not generate them. Pairs that already resolve to one volunteer are
+    skipped.
+    """
+    index = index or AliasIndex()
+    names = sorted({normalize_name(name) for name in names} - {""})
+    grams = [_grams(match_key(name), n) for name in names]
+    postings: Dict[str, List[int]] = defaultdict(list)
+    for i, gs in enumerate(grams):
+        for g in gs:
+            postings[g].append(i)
+
+    candidates = set()
+    for members in postings.values():
+        if len(members) > max_postings:
+            continue
+        for a in range(len(members)):
+            for b in range(a + 1, len(members)):
+                candidates.add((members[a], members[b]))
+
+    suggestions = []
+    for a, b in candidates:
+        if index.resolve(names[a]) == index.resolve(names[b]):
+            continue
+        score = 2 * len(grams[a] & grams[b]) / (len(grams[a]) + len(grams[b]))
+        if score >= min_similarity:
+            suggestions.append((names[a], names[b], round(score, 3)))
+    suggestions.sort(key=lambda s: (-s[2], s[0], s[1]))
+    return suggestions
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    from storage.duckdb_store import DuckDBConfig, DuckDBStore
+
+    parser = argparse.ArgumentParser(description="Propose likely duplicate volunteer names for volunteer_aliases")
+    parser.add_argument("--min-similarity", type=float, default=0.6)
+    args = parser.parse_args(argv)
+    cfg = load_config()
+    store = DuckDBStore(DuckDBConfig(cfg["storage"]["duckdb_path"]))
+    counts = dict(store.con.execute(
+        "SELECT volunteer_id, COUNT(*) FROM service_fact GROUP BY volunteer_id"
+    ).fetchall())
+    store.close()
+    suggestions = suggest_duplicates(counts, alias_index(cfg), min_similarity=args.min_similarity)
+    if not suggestions:
+        print("no likely duplicates")
+        return
+    # Paste the confirmed ones into volunteer_aliases (the more frequent name is the canonical one)
+    for a, b, score in suggestions:
+        canonical, alias = (a, b) if counts.get(a, 0) >= counts.get(b, 0) else (b, a)
+        print(f'# {score:.2f}: {canonical} ({counts.get(canonical, 0)}) ~ {alias} ({counts.get(alias, 0)})')
+        print(f'"{canonical}": ["{alias}"]')
+
+
+if __name__ == "__main__":
+    main()
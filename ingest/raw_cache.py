@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, List, Optional
+
+
+@dataclass
+class RawSnapshot:
+    """The last raw sheet response persisted under data/."""
+    fingerprint: str
+    fetched_at: str
+    first_row: int
+    values: List[List[Any]]
+
+
+def payload_fingerprint(values: List[List[Any]], columns: dict, names: str = "") -> str:
+    """SHA1 over the fetched cells plus the config that interprets them.
+
+    Including ``columns`` and ``names`` (``AliasIndex.fingerprint``) means a
+    change to the role windows or volunteer aliases in config.yaml is never
+    mistaken for an unchanged sheet; the load then re-derives the unchanged
+    rows too (see ``jobs.ingest_job._sync_config``).
+    """
+    h = hashlib.sha1()
+    h.update(json.dumps(columns, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+    h.update(names.encode("utf-8"))
+    h.update(json.dumps(values, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8"))
+    return h.hexdigest()
+
+
+class RawResponseCache:
+    """Last fetch per (spreadsheet, sheet): cells in ``<name>.json`` and the
+    fingerprint in a small ``<name>.meta.json`` so the freshness check never
+    has to decode the whole payload.
+    """
+
+    def __init__(self, cache_dir: str = "data/raw") -> None:
+        self.cache_dir = Path(cache_dir)
+
+    def path_for(self, spreadsheet_id: str, sheet_name: str) -> Path:
+        return self.cache_dir / f"{spreadsheet_id}_{sheet_name}.json"
+
+    def _meta_path(self, spreadsheet_id: str, sheet_name: str) -> Path:
+        return self.path_for(spreadsheet_id, sheet_name).with_suffix(".meta.json")
+
+    @staticmethod
+    def _read_json(path: Path) -> Optional[dict]:
+        if not path.exists():
+            return None
+        try:
+            with path.open("r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            # A corrupt cache only costs one full ingest
+            return None
+
+    @staticmethod
+    def _write_json(path: Path, payload: Any) -> None:
+        # Write-then-rename so a crash never leaves a half-written file
+        tmp = path.with_name(path.name + ".tmp")
+        with tmp.open("w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, default=str)
+        os.replace(tmp, path)
+
+    def is_unchanged(self, spreadsheet_id: str, sheet_name: str, fingerprint: str, first_row: int = 1) -> bool:
+        """True if the last persisted fetch covered the same rows with the same payload."""
+        meta = self._read_json(self._meta_path(spreadsheet_id, sheet_name))
+        return bool(meta) and meta.get("first_row") == first_row and meta.get("fingerprint") == fingerprint
+
+    def load(self, spreadsheet_id: str, sheet_name: str) -> Optional[RawSnapshot]:
+        meta = self._read_json(self._meta_path(spreadsheet_id, sheet_name))
+        values = self._read_json(self.path_for(spreadsheet_id, sheet_name))
+        if not meta or values is None:
+            return None
+        return RawSnapshot(meta["fingerprint"], meta["fetched_at"], meta["first_row"], values)
+
+    def invalidate(self, spreadsheet_id: str, sheet_name: str) -> None:
+        """Forget the last fetch so the next ingest of this sheet always loads.
+
+        Used after a pushed row edit: the cached payload no longer matches
+        DuckDB, so an identical re-fetch must not be skipped.
+        """
+        self._meta_path(spreadsheet_id, sheet_name).unlink(missing_ok=True)
+
+    def save(self, spreadsheet_id: str, sheet_name: str, fingerprint: str,
+             values: List[List[Any]], first_row: int = 1) -> None:
+        path = self.path_for(spreadsheet_id, sheet_name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._write_json(path, values)
+        # Meta last: it is what marks the snapshot as complete
+        self._write_json(
+            self._meta_path(spreadsheet_id, sheet_name),
+            {
+                "fingerprint": fingerprint,
+                "fetched_at": datetime.now(timezone.utc).isoformat(),
+                "first_row": first_row,
+            },
+        )
@@ -1,25 +1,30 @@
 from __future__ import annotations
 
-from typing import List
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
 from pathlib import Path
 
-import yaml
+import httplib2
 from google.oauth2 import service_account
+from google_auth_httplib2 import AuthorizedHttp, Request as AuthRequest
 from googleapiclient.discovery import build
 
+from ingest.config import load_config
+from ingest.rate_limit import TokenBucket
+from ingest.tracing import current_span, in_context, span
+from ingest.transform import column_index_to_letter, used_column_indices
+
 
 # Scopes for Google Sheets read access
 SCOPES = ["https://www.googleapis.com/auth/spreadsheets.readonly"]
 
-
-def load_config() -> dict:
-    with open("configs/config.yaml", "r", encoding="utf-8") as f:
-        return yaml.safe_load(f)
+SERVICE_ACCOUNT_PATH = Path("configs/service_account.json")
 
 
 def get_credentials():
     """Get credentials from service account JSON file."""
-    service_account_path = Path("configs/service_account.json")
+    service_account_path = SERVICE_ACCOUNT_PATH
     
     if not service_account_path.exists():
         raise FileNotFoundError(
@@ -36,22 +41,263 @@ def get_credentials():
     return credentials
 
 
+class _CountingHttp(AuthorizedHttp):
+    """AuthorizedHttp that adds each response's size to the open span."""
+
+    def request(self, *args, **kwargs):
+        response, content = super().request(*args, **kwargs)
+        current_span().add_bytes(len(content or b""))
+        return response, content
+
+
+class SheetsClient:
+    """Sheets API client meant to live for the whole process.
+
+    Credentials are parsed and the service is built from the bundled static
+    discovery document once. Each thread gets its own keep-alive
+    ``AuthorizedHttp`` (httplib2 connections are not thread-safe); all of
+    them share the credentials, which google-auth refreshes only when the
+    access token has expired.
+
+    Every request first takes a token from ``limiter`` (if given) so that
+    concurrent fetches stay under the Sheets read quota.
+    """
+
+    def __init__(self, credentials=None, timeout: int = 60, limiter: Optional[TokenBucket] = None) -> None:
+        self.credentials = credentials or get_credentials()
+        self.timeout = timeout
+        self.limiter = limiter
+        self._local = threading.local()
+        self.service = build(
+            "sheets",
+            "v4",
+            http=self._http(),
+            static_discovery=True,
+            cache_discovery=False,
+        )
+
+    def _http(self) -> AuthorizedHttp:
+        http = getattr(self._local, "http", None)
+        if http is None:
+            http = _CountingHttp(self.credentials, http=httplib2.Http(timeout=self.timeout))
+            self._local.http = http
+        return http
+
+    def _execute(self, request) -> dict:
+        if self.limiter is not None:
+            with span("sheets.rate_limit"):
+                self.limiter.acquire()
+        if not self.credentials.valid:
+            # Refresh up front (AuthorizedHttp would do it inside the
+            # request) so token time is reported apart from the fetch
+            with span("sheets.auth"):
+                self.credentials.refresh(AuthRequest(self._http().http))
+        with span("sheets.request"):
+            return request.execute(http=self._http())
+
+    def get_values(self, spreadsheet_id: str, range_a1: str) -> List[List[str]]:
+        request = self.service.spreadsheets().values().get(spreadsheetId=spreadsheet_id, range=range_a1)
+        return self._execute(request).get("values", [])
+
+    def row_count(self, spreadsheet_id: str, sheet_name: str) -> int:
+        """Grid row count of a tab (including empty rows at the bottom)."""
+        request = self.service.spreadsheets().get(
+            spreadsheetId=spreadsheet_id,
+            fields="sheets.properties(title,gridProperties.rowCount)",
+        )
+        for sheet in self._execute(request).get("sheets", []):
+            props = sheet.get("properties", {})
+            if props.get("title") == sheet_name:
+                return int(props.get("gridProperties", {}).get("rowCount", 0))
+        raise ValueError(f"sheet {sheet_name!r} not found in spreadsheet {spreadsheet_id}")
+
+    def batch_get(self, spreadsheet_id: str, ranges: List[str], **options) -> List[List[List[str]]]:
+        """values().batchGet; returns the ``values`` of each range in order."""
+        request = self.service.spreadsheets().values().batchGet(
+            spreadsheetId=spreadsheet_id, ranges=ranges, **options
+        )
+        result = self._execute(request)
+        return [vr.get("values", []) for vr in result.get("valueRanges", [])]
+
+
+_client: Optional[SheetsClient] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> SheetsClient:
+    """The process-wide SheetsClient, created on first use."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            per_minute = load_config().get("ingest", {}).get("read_requests_per_minute", 60)
+            with span("sheets.client"):
+                _client = SheetsClient(limiter=TokenBucket.per_minute(per_minute, burst=10))
+        return _client
+
+
+def _read_values(range_a1: str) -> List[List[str]]:
+    cfg = load_config()
+    return get_client().get_values(cfg["spreadsheet_id"], range_a1)
+
+
 def read_range_a_to_u() -> List[List[str]]:
     """Read data from Google Sheets using service account authentication."""
     cfg = load_config()
-    spreadsheet_id = cfg["spreadsheet_id"]
+    return _read_values(sheet_range(cfg["sheet_name"], "A:U"))
+
+
+def sheet_range(sheet_name: str, cells: str) -> str:
+    """A1 range on ``sheet_name``, quoting the name so spaces, quotes and
+    names like ``Q1`` are not misread."""
+    quoted = sheet_name.replace("'", "''")
+    return f"'{quoted}'!{cells}"
+
+
+def _column_runs(indices: List[int]) -> List[Tuple[int, int]]:
+    """Group sorted column indices into contiguous (first, last) runs."""
+    runs: List[Tuple[int, int]] = []
+    for idx in indices:
+        if runs and idx == runs[-1][1] + 1:
+            runs[-1] = (runs[-1][0], idx)
+        else:
+            runs.append((idx, idx))
+    return runs
+
+
+def projected_ranges(cfg: dict, start_row: int = 1, end_row: Optional[int] = None) -> List[Tuple[str, int]]:
+    """Minimal A1 ranges covering the configured columns, e.g. A:A and Q:U.
+
+    ``end_row`` bounds the ranges (A10:A20) instead of running to the end of
+    the sheet. Returns (range_a1, first_column_index) pairs.
+    """
     sheet_name = cfg["sheet_name"]
-    range_a1 = f"{sheet_name}!A:U"
+    top = "" if start_row == 1 and end_row is None else str(start_row)
+    bottom = "" if end_row is None else str(end_row)
+    ranges = []
+    for first, last in _column_runs(used_column_indices(cfg)):
+        a1 = sheet_range(sheet_name, f"{column_index_to_letter(first)}{top}:{column_index_to_letter(last)}{bottom}")
+        ranges.append((a1, first))
+    return ranges
 
-    # Get service account credentials
-    creds = get_credentials()
-    
-    # Build the Sheets service
-    service = build("sheets", "v4", credentials=creds)
-    sheet = service.spreadsheets()
-    
-    # Get the data
-    result = sheet.values().get(spreadsheetId=spreadsheet_id, range=range_a1).execute()
-    values = result.get("values", [])
-    
-    return values
\ No newline at end of file
+
+def stitch_ranges(value_ranges: List[List[List[str]]], offsets: List[int]) -> List[List[str]]:
+    """Rebuild row-shaped values from per-range column blocks.
+
+    Cells outside the fetched ranges are left empty and trailing empty cells
+    are trimmed, matching what ``values().get`` returns for a full row.
+    """
+    n_rows = max((len(v) for v in value_ranges), default=0)
+    rows: List[List[str]] = [[] for _ in range(n_rows)]
+    for values, offset in zip(value_ranges, offsets):
+        for i, cells in enumerate(values):
+            if not cells:
+                continue
+            row = rows[i]
+            end = offset + len(cells)
+            if len(row) < end:
+                row.extend([""] * (end - len(row)))
+            row[offset:end] = cells
+    for row in rows:
+        while row and row[-1] in ("", None):
+            row.pop()
+    return rows
+
+
+_BATCH_GET_OPTIONS = dict(
+    majorDimension="ROWS",
+    # Dates arrive as serial numbers so the transform can convert the
+    # whole column at once; text cells (names) are unaffected.
+    valueRenderOption="UNFORMATTED_VALUE",
+    dateTimeRenderOption="SERIAL_NUMBER",
+)
+
+
+def _read_projected(cfg: dict, start_row: int, end_row: Optional[int] = None) -> List[List[str]]:
+    ranges = projected_ranges(cfg, start_row, end_row)
+    with span("sheets.fetch") as s:
+        value_ranges = get_client().batch_get(cfg["spreadsheet_id"], [a1 for a1, _ in ranges], **_BATCH_GET_OPTIONS)
+        rows = stitch_ranges(value_ranges, [offset for _, offset in ranges])
+        s.rows_out = len(rows)
+    return rows
+
+
+def read_rows(start_row: int = 1, cfg: Optional[dict] = None) -> List[List[str]]:
+    """Read only the configured date/role columns from ``start_row`` on.
+
+    Uses a single ``values().batchGet`` over the minimal set of column ranges
+    and stitches the result back into the row shape ``rows_to_facts``
+    expects; the first returned row corresponds to ``start_row``. ``cfg``
+    selects the source (see ``ingest.config.source_configs``) and defaults to config.yaml.
+    """
+    if start_row < 1:
+        raise ValueError("start_row must be >= 1")
+    return _read_projected(cfg or load_config(), start_row)
+
+
+def read_sources(sources: Sequence[dict], start_rows: Optional[Sequence[int]] = None,
+                 max_workers: int = 4) -> List[List[List[str]]]:
+    """Fetch several sources concurrently; returns the rows of each, in order.
+
+    Tabs of the same spreadsheet share one batchGet; different spreadsheets
+    are fetched in parallel on at most ``max_workers`` threads, all drawing
+    from the client's rate limiter.
+    """
+    start_rows = list(start_rows) if start_rows is not None else [1] * len(sources)
+    if len(start_rows) != len(sources):
+        raise ValueError("start_rows must match sources")
+    if any(r < 1 for r in start_rows):
+        raise ValueError("start_row must be >= 1")
+    groups: Dict[str, List[int]] = {}
+    for i, src in enumerate(sources):
+        groups.setdefault(src["spreadsheet_id"], []).append(i)
+
+    def fetch(spreadsheet_id: str, members: List[int]) -> List[List[List[str]]]:
+        per_source = [projected_ranges(sources[i], start_rows[i]) for i in members]
+        with span("sheets.fetch") as s:
+            value_ranges = get_client().batch_get(
+                spreadsheet_id, [a1 for ranges in per_source for a1, _ in ranges], **_BATCH_GET_OPTIONS
+            )
+            out, pos = [], 0
+            for ranges in per_source:
+                out.append(stitch_ranges(value_ranges[pos:pos + len(ranges)], [offset for _, offset in ranges]))
+                pos += len(ranges)
+            s.rows_out = sum(len(rows) for rows in out)
+        return out
+
+    results: List[List[List[str]]] = [[] for _ in sources]
+    if not groups:
+        return results
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(groups)))) as pool:
+        futures = {sid: pool.submit(in_context(fetch), sid, members) for sid, members in groups.items()}
+        for sid, members in groups.items():
+            for i, rows in zip(members, futures[sid].result()):
+                results[i] = rows
+    return results
+
+
+def iter_row_blocks(block_size: int = 5000, start_row: int = 1,
+                    cfg: Optional[dict] = None) -> Iterator[Tuple[int, List[List[str]]]]:
+    """Yield ``(first_row, rows)`` blocks of at most ``block_size`` sheet rows.
+
+    Each block is one bounded batchGet (e.g. A1:A5000 and Q1:U5000). The next
+    block is fetched on a background thread while the caller processes the
+    current one, so at most two blocks are held in memory.
+    """
+    if block_size < 1:
+        raise ValueError("block_size must be >= 1")
+    cfg = cfg or load_config()
+    last_row = get_client().row_count(cfg["spreadsheet_id"], cfg["sheet_name"])
+    starts = list(range(start_row, last_row + 1, block_size))
+    if not starts:
+        return
+
+    def fetch(first: int) -> List[List[str]]:
+        return _read_projected(cfg, first, min(first + block_size - 1, last_row))
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        pending = pool.submit(in_context(fetch), starts[0])
+        for i, first in enumerate(starts):
+            rows = pending.result()
+            if i + 1 < len(starts):
+                pending = pool.submit(in_context(fetch), starts[i + 1])
+            yield first, rows
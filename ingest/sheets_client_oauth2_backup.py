@@ -3,19 +3,15 @@ from __future__ import annotations
 from typing import List
 from pathlib import Path
 
-import yaml
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 from googleapiclient.discovery import build
 
-
-SCOPES = ["https://www.googleapis.com/auth/drive.readonly"]
+from ingest.config import load_config
 
 
-def load_config() -> dict:
-    with open("configs/config.yaml", "r", encoding="utf-8") as f:
-        return yaml.safe_load(f)
+SCOPES = ["https://www.googleapis.com/auth/drive.readonly"]
 
 
 def get_credentials() -> Credentials:
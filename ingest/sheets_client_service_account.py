@@ -3,20 +3,16 @@ from __future__ import annotations
 from typing import List
 from pathlib import Path
 
-import yaml
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
 
+from ingest.config import load_config
+
 
 # Scopes for Google Sheets read access
 SCOPES = ["https://www.googleapis.com/auth/spreadsheets.readonly"]
 
 
-def load_config() -> dict:
-    with open("configs/config.yaml", "r", encoding="utf-8") as f:
-        return yaml.safe_load(f)
-
-
 def get_service_account_credentials():
     """Get credentials from service account JSON file."""
     service_account_path = Path("configs/service_account.json")
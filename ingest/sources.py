@@ -0,0 +1,261 @@
+from __future__ import annotations
+
+import itertools
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple, Type
+
+import pyarrow as pa
+
+from ingest import sheets_client
+from ingest.tracing import in_context, span
+
+
+SHEETS_EPOCH = datetime(1899, 12, 30)
+
+# Rows per chunk for readers that do not batch on their own
+_CHUNK_ROWS = 5000
+
+
+def _to_serial(value: date) -> float:
+    """Google Sheets serial number of a date/datetime (UNFORMATTED_VALUE)."""
+    if isinstance(value, datetime):
+        delta = value.replace(tzinfo=None) - SHEETS_EPOCH
+        serial = delta.days + (delta.seconds + delta.microseconds / 1e6) / 86400
+    else:
+        serial = (value - SHEETS_EPOCH.date()).days
+    return int(serial) if serial == int(serial) else serial
+
+
+def _sheet_row(cells: Sequence[Any]) -> List[Any]:
+    """Shape one file row like a batchGet row: dates as serials, empty cells
+    as "", trailing empty cells trimmed."""
+    row = ["" if c is None else _to_serial(c) if isinstance(c, date) else c for c in cells]
+    while row and row[-1] == "":
+        row.pop()
+    return row
+
+
+class RowSource(ABC):
+    """Where the rows of one roster tab come from.
+
+    ``cfg`` is a source config from ``ingest.config.source_configs``; its
+    ``spreadsheet_id`` / ``sheet_name`` identify the tab in DuckDB whatever
+    the transport, so a file export of a tab yields the same facts as the
+    tab itself. Rows are returned in batchGet shape, the first one being
+    sheet row ``start_row``.
+    """
+
+    def __init__(self, cfg: dict) -> None:
+        self.cfg = cfg
+
+    @abstractmethod
+    def iter_row_blocks(self, block_size: int = 5000, start_row: int = 1) -> Iterator[Tuple[int, List[List[Any]]]]:
+        """Yield ``(first_row, rows)`` blocks of at most ``block_size`` rows."""
+
+    def read_rows(self, start_row: int = 1) -> List[List[Any]]:
+        rows: List[List[Any]] = []
+        for _, block in self.iter_row_blocks(_CHUNK_ROWS, start_row):
+            rows.extend(block)
+        return rows
+
+
+class SheetsSource(RowSource):
+    """The Google Sheets tab itself (projected batchGet)."""
+
+    def read_rows(self, start_row: int = 1) -> List[List[Any]]:
+        return sheets_client.read_rows(start_row, cfg=self.cfg)
+
+    def iter_row_blocks(self, block_size: int = 5000, start_row: int = 1) -> Iterator[Tuple[int, List[List[Any]]]]:
+        return sheets_client.iter_row_blocks(block_size, start_row, cfg=self.cfg)
+
+
+class FileSource(RowSource):
+    """A local export of a tab, read in chunks.
+
+    ``first_row`` (config) is the sheet row number of the file's first data
+    row: 1 when the header row is part of the data (CSV/XLSX exports), 2 when
+    it became the column names (Parquet/Arrow written from a DataFrame).
+    """
+
+    default_first_row = 1
+
+    def __init__(self, cfg: dict) -> None:
+        super().__init__(cfg)
+        self.path = Path(cfg["path"])
+        self.first_row = int(cfg.get("first_row", self.default_first_row))
+        if self.first_row < 1:
+            raise ValueError("first_row must be >= 1")
+
+    @abstractmethod
+    def _iter_chunks(self) -> Iterator[Sequence[Sequence[Any]]]:
+        """Raw rows of the file, in chunks."""
+
+    def iter_row_blocks(self, block_size: int = 5000, start_row: int = 1) -> Iterator[Tuple[int, List[List[Any]]]]:
+        if block_size < 1:
+            raise ValueError("block_size must be >= 1")
+        if start_row < 1:
+            raise ValueError("start_row must be >= 1")
+        # Sheet rows above the file's first row are empty
+        padding = [[]] * max(0, self.first_row - start_row)
+        row_number = min(start_row, self.first_row)
+        block: List[List[Any]] = []
+        block_first = row_number
+        for chunk in itertools.chain([padding], self._iter_chunks()):
+            for cells in chunk:
+                if row_number >= start_row:
+                    if not block:
+                        block_first = row_number
+                    block.append(_sheet_row(cells))
+                    if len(block) == block_size:
+                        yield block_first, block
+                        block = []
+                row_number += 1
+        if block:
+            yield block_first, block
+
+
+def _batch_rows(batch: pa.RecordBatch) -> List[Tuple[Any, ...]]:
+    """The rows of one record batch as tuples of Python values (a copy)."""
+    return list(zip(*(column.to_pylist() for column in batch.columns)))
+
+
+class CsvSource(FileSource):
+    """CSV export, streamed with pyarrow; every cell is kept as text."""
+
+    def _iter_chunks(self) -> Iterator[Sequence[Sequence[Any]]]:
+        from pyarrow import csv
+
+        with open(self.path, "rb") as f:
+            # Names and types are not known up front; pin every column (up to
+            # 1024) to string so "2024/01/07" or "007" are not reinterpreted.
+            reader = csv.open_csv(
+                f,
+                read_options=csv.ReadOptions(autogenerate_column_names=True, block_size=1 << 22),
+                convert_options=csv.ConvertOptions(
+                    column_types={f"f{i}": pa.string() for i in range(1024)},
+                    strings_can_be_null=False,
+                    quoted_strings_can_be_null=False,
+                ),
+            )
+            for batch in reader:
+                yield _batch_rows(batch)
+
+
+class XlsxSource(FileSource):
+    """XLSX export, read row by row in openpyxl's read-only mode."""
+
+    def _iter_chunks(self) -> Iterator[Sequence[Sequence[Any]]]:
+        try:
+            from openpyxl import load_workbook
+        except ImportError as e:
+            raise ImportError("reading .xlsx sources requires openpyxl (pip install openpyxl)") from e
+
+        wb = load_workbook(self.path, read_only=True, data_only=True)
+        try:
+            ws = wb[self.cfg["worksheet"]] if self.cfg.get("worksheet") else wb.active
+            rows = ws.iter_rows(values_only=True)
+            while True:
+                chunk = list(itertools.islice(rows, _CHUNK_ROWS))
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            wb.close()
+
+
+class ParquetSource(FileSource):
+    """Parquet snapshot, one record batch at a time."""
+
+    default_first_row = 2
+
+    def _iter_chunks(self) -> Iterator[Sequence[Sequence[Any]]]:
+        import pyarrow.parquet as pq
+
+        with pq.ParquetFile(self.path, memory_map=True) as f:
+            for batch in f.iter_batches(batch_size=_CHUNK_ROWS):
+                yield _batch_rows(batch)
+
+
+class ArrowSource(FileSource):
+    """Arrow IPC snapshot (file or stream format), memory-mapped and read one
+    record batch at a time; each batch is converted to Python rows, so only
+    the current batch is held in memory."""
+
+    default_first_row = 2
+
+    def _iter_chunks(self) -> Iterator[Sequence[Sequence[Any]]]:
+        with pa.memory_map(str(self.path), "r") as source:
+            try:
+                reader = pa.ipc.open_file(source)
+                batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+            except pa.ArrowInvalid:
+                source.seek(0)
+                batches = pa.ipc.open_stream(source)
+            for batch in batches:
+                yield _batch_rows(batch)
+
+
+SOURCE_ADAPTERS: Dict[str, Type[RowSource]] = {
+    "sheets": SheetsSource,
+    "csv": CsvSource,
+    "xlsx": XlsxSource,
+    "parquet": ParquetSource,
+    "arrow": ArrowSource,
+}
+
+_SUFFIX_TYPES = {".csv": "csv", ".xlsx": "xlsx", ".parquet": "parquet", ".arrow": "arrow", ".feather": "arrow"}
+
+
+def source_type(cfg: dict) -> str:
+    """``type`` of a source config; inferred from ``path`` when omitted."""
+    kind = cfg.get("type")
+    if kind is None:
+        kind = _SUFFIX_TYPES.get(Path(cfg["path"]).suffix.lower()) if cfg.get("path") else "sheets"
+    if kind not in SOURCE_ADAPTERS:
+        raise ValueError(f"unknown source type {kind!r}; expected one of {'|'.join(SOURCE_ADAPTERS)}")
+    return kind
+
+
+def open_source(cfg: dict) -> RowSource:
+    return SOURCE_ADAPTERS[source_type(cfg)](cfg)
+
+
+def _read_file(cfg: dict, start_row: int) -> List[List[Any]]:
+    source = open_source(cfg)
+    with span("source.read_file") as s:
+        rows = source.read_rows(start_row)
+        s.rows_out = len(rows)
+        s.bytes = source.path.stat().st_size
+    return rows
+
+
+def fetch_sources(sources: Sequence[dict], start_rows: Optional[Sequence[int]] = None,
+                  max_workers: int = 4) -> List[List[List[Any]]]:
+    """Read several sources concurrently; returns the rows of each, in order.
+
+    Sheets tabs go through ``sheets_client.read_sources`` (one batchGet per
+    spreadsheet, rate limited); file sources are read on the same bounded
+    pool of ``max_workers`` threads.
+    """
+    start_rows = list(start_rows) if start_rows is not None else [1] * len(sources)
+    if len(start_rows) != len(sources):
+        raise ValueError("start_rows must match sources")
+    kinds = [source_type(src) for src in sources]
+    sheets = [i for i, kind in enumerate(kinds) if kind == "sheets"]
+    files = [i for i, kind in enumerate(kinds) if kind != "sheets"]
+
+    results: List[List[List[Any]]] = [[] for _ in sources]
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        pending = {i: pool.submit(in_context(_read_file), sources[i], start_rows[i]) for i in files}
+        if sheets:
+            fetched = sheets_client.read_sources(
+                [sources[i] for i in sheets], [start_rows[i] for i in sheets], max_workers=max_workers
+            )
+            for i, rows in zip(sheets, fetched):
+                results[i] = rows
+        for i, future in pending.items():
+            results[i] = future.result()
+    return results
@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+import contextvars
+import functools
+import inspect
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+
+@dataclass
+class Span:
+    """One timed stage. ``path`` is the chain of enclosing span names."""
+    name: str
+    path: str
+    depth: int
+    start: float
+    wall: float = 0.0
+    cpu: float = 0.0
+    rows_in: Optional[int] = None
+    rows_out: Optional[int] = None
+    bytes: Optional[int] = None
+
+    def add_bytes(self, n: int) -> None:
+        self.bytes = (self.bytes or 0) + n
+
+
+class _NoSpan:
+    """Stand-in when no trace is active: attribute writes are dropped."""
+    rows_in = rows_out = bytes = None
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        pass
+
+    def add_bytes(self, n: int) -> None:
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+@dataclass
+class Trace:
+    """The spans of one run, appended from any thread."""
+    job: str
+    run_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    started_at: datetime = field(default_factory=lambda: datetime.now(timezone.utc).replace(tzinfo=None))
+    spans: List[Span] = field(default_factory=list)
+    _origin: float = field(default_factory=time.perf_counter, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def _add(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def stages(self) -> List[Dict[str, Any]]:
+        """Spans summed per path, in the order the paths first started."""
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start)
+        stages: Dict[str, Dict[str, Any]] = {}
+        for s in spans:
+            stage = stages.setdefault(s.path, {
+                "stage": s.path, "depth": s.depth, "calls": 0, "wall_s": 0.0, "cpu_s": 0.0,
+                "rows_in": None, "rows_out": None, "bytes": None,
+            })
+            stage["calls"] += 1
+            stage["wall_s"] += s.wall
+            stage["cpu_s"] += s.cpu
+            for key in ("rows_in", "rows_out", "bytes"):
+                value = getattr(s, key)
+                if value is not None:
+                    stage[key] = (stage[key] or 0) + value
+        for stage in stages.values():
+            stage["wall_s"] = round(stage["wall_s"], 6)
+            stage["cpu_s"] = round(stage["cpu_s"], 6)
+        return list(stages.values())
+
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("ingest_trace", default=None)
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("ingest_span", default=None)
+
+
+@contextmanager
+def trace(job: str) -> Iterator[Trace]:
+    """Collect the spans opened in this context (and in tasks submitted via
+    ``in_context``) into a new Trace."""
+    run = Trace(job)
+    trace_token = _current_trace.set(run)
+    span_token = _current_span.set(None)
+    try:
+        yield run
+    finally:
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+
+
+@contextmanager
+def span(name: str, rows_in: Optional[int] = None) -> Iterator[Any]:
+    """Time a stage: wall and thread CPU time, plus optional row/byte counts
+    set on the yielded span. Costs next to nothing outside a trace."""
+    run = _current_trace.get()
+    if run is None:
+        yield _NO_SPAN
+        return
+    parent = _current_span.get()
+    s = Span(
+        name=name,
+        path=f"{parent.path}/{name}" if parent else name,
+        depth=parent.depth + 1 if parent else 0,
+        start=time.perf_counter() - run._origin,
+        rows_in=rows_in,
+    )
+    token = _current_span.set(s)
+    wall0, cpu0 = time.perf_counter(), time.thread_time()
+    try:
+        yield s
+    finally:
+        s.wall = time.perf_counter() - wall0
+        s.cpu = time.thread_time() - cpu0
+        _current_span.reset(token)
+        run._add(s)
+
+
+def traced(name: str, rows_arg: Optional[str] = None) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """Decorator form of ``span``; ``rows_arg`` names the argument whose
+    ``len()`` is reported as rows in."""
+    def decorate(fn: Callable[..., Any]) -> Callable[..., Any]:
+        signature = inspect.signature(fn) if rows_arg else None
+
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if _current_trace.get() is None:
+                return fn(*args, **kwargs)
+            rows_in = None
+            if signature is not None:
+                value = signature.bind(*args, **kwargs).arguments.get(rows_arg)
+                rows_in = len(value) if hasattr(value, "__len__") else None
+            with span(name, rows_in=rows_in):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def current_run_id() -> Optional[str]:
+    """``run_id`` of the active trace, if any."""
+    run = _current_trace.get()
+    return run.run_id if run else None
+
+
+def current_span() -> Any:
+    """The innermost open span (a no-op stand-in outside a trace)."""
+    return _current_span.get() or _NO_SPAN
+
+
+def in_context(fn: Callable[..., Any]) -> Callable[..., Any]:
+    """Bind ``fn`` to the caller's context so spans opened on a pool thread
+    nest under the caller's span (executors do not copy contextvars).
+
+    Call it once per submitted task: a context can only be entered by one
+    thread at a time.
+    """
+    ctx = contextvars.copy_context()
+    return lambda *args, **kwargs: ctx.run(fn, *args, **kwargs)
+
+
+def format_report(stages: List[Dict[str, Any]]) -> str:
+    """Fixed-width breakdown of ``Trace.stages()`` for the console."""
+    def num(value: Optional[int]) -> str:
+        return "-" if value is None else f"{value:,}"
+
+    lines = [f"{'stage':<44}{'calls':>7}{'wall s':>10}{'cpu s':>10}{'rows in':>11}{'rows out':>11}{'bytes':>13}"]
+    for st in stages:
+        label = "  " * st["depth"] + st["stage"].rsplit("/", 1)[-1]
+        lines.append(
+            f"{label:<44}{st['calls']:>7}{st['wall_s']:>10.3f}{st['cpu_s']:>10.3f}"
+            f"{num(st['rows_in']):>11}{num(st['rows_out']):>11}{num(st['bytes']):>13}"
+        )
+    return "\n".join(lines)
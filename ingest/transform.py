@@ -1,14 +1,21 @@
 from __future__ import annotations
 
 import hashlib
+import json
 from dataclasses import dataclass
-from typing import Dict, List, Tuple, Optional
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple, Optional, Sequence
 
+import numpy as np
 import pandas as pd
-import yaml
+import pyarrow as pa
+import pyarrow.compute as pc
 from dateutil import parser
 from datetime import datetime, timezone
 
+from ingest.config import load_config
+from ingest.names import alias_index, normalize_name
+from ingest.tracing import span
+
 
 @dataclass
 class RoleColumn:
@@ -18,15 +25,44 @@ class RoleColumn:
     valid_until_row: Optional[int] = None
 
 
-def load_config() -> dict:
-    with open("configs/config.yaml", "r", encoding="utf-8") as f:
-        return yaml.safe_load(f)
+def column_letter_to_index(letter: str) -> int:
+    """Convert an A1 column letter ("A", "U", "AA", ...) to a 0-based index."""
+    index = 0
+    for ch in letter.strip().upper():
+        if not "A" <= ch <= "Z":
+            raise ValueError(f"invalid column letter: {letter!r}")
+        index = index * 26 + (ord(ch) - ord("A") + 1)
+    if index == 0:
+        raise ValueError(f"invalid column letter: {letter!r}")
+    return index - 1
+
+
+def column_index_to_letter(index: int) -> str:
+    """Inverse of column_letter_to_index."""
+    if index < 0:
+        raise ValueError("column index must be >= 0")
+    letters = ""
+    index += 1
+    while index:
+        index, rem = divmod(index - 1, 26)
+        letters = chr(ord("A") + rem) + letters
+    return letters
+
+
+def used_column_indices(cfg: dict) -> List[int]:
+    """Sorted 0-based indices of the date and role columns in the config."""
+    keys = [cfg["columns"]["date"]] + [r["key"] for r in cfg["columns"]["roles"]]
+    return sorted({column_letter_to_index(k) for k in keys})
 
 
-def normalize_name(name: str) -> str:
-    if name is None:
-        return ""
-    return str(name).strip().replace("\u3000", " ")
+def project_row(cells: Sequence[object], cfg: dict) -> List[object]:
+    """Blank the cells outside the date/role columns, as a projected read
+    (``sheets_client.read_rows``) returns them, so checksums match."""
+    used = set(used_column_indices(cfg))
+    row = [c if i in used and c is not None else "" for i, c in enumerate(cells)]
+    while row and row[-1] == "":
+        row.pop()
+    return row
 
 
 def parse_date(cell: str) -> pd.Timestamp | None:
@@ -39,91 +75,355 @@ def parse_date(cell: str) -> pd.Timestamp | None:
         return None
 
 
+# Google Sheets serial dates count days from 1899-12-30.
+SHEETS_EPOCH = pd.Timestamp("1899-12-30")
+_MAX_SERIAL = pd.Timedelta.max.days
+
+# Unambiguous text layouts that are parsed in bulk before falling back to
+# dateutil; they yield the same date dateutil would.
+_BULK_DATE_FORMATS = ("ISO8601", "%Y/%m/%d")
+
+
+def parse_dates(cells: Sequence[object]) -> pd.Series:
+    """Vectorized parse_date over a whole column.
+
+    Serial numbers (``dateTimeRenderOption=SERIAL_NUMBER``) are converted in
+    one operation, common text layouts in bulk, and only the remaining text
+    cells go through ``parse_date``. Unparseable cells become NaT.
+    """
+    raw = pd.Series(list(cells), dtype=object)
+    out = pd.Series(pd.NaT, index=raw.index, dtype="datetime64[ns]")
+    if raw.empty:
+        return out
+
+    kinds = raw.map(type)
+    is_serial = kinds.isin([int, float])
+    if is_serial.any():
+        serial = pd.to_numeric(raw[is_serial], errors="coerce")
+        serial = serial.where(serial.between(0, _MAX_SERIAL))
+        out[is_serial] = (SHEETS_EPOCH + pd.to_timedelta(serial, unit="D")).dt.floor("D")
+
+    pending = ~is_serial & raw.notna() & (raw.astype(str).str.strip() != "")
+    for fmt in _BULK_DATE_FORMATS:
+        if not pending.any():
+            break
+        parsed = pd.to_datetime(raw[pending].astype(str).str.strip(), format=fmt, errors="coerce")
+        parsed = parsed.dt.floor("D")
+        hit = parsed.notna()
+        out[parsed.index[hit]] = parsed[hit]
+        pending[parsed.index[hit]] = False
+
+    # Slow path: whatever text is left, one cell at a time.
+    for i in raw.index[pending]:
+        parsed_one = parse_date(raw[i])
+        if parsed_one is not None and pd.Timestamp.min <= parsed_one <= pd.Timestamp.max:
+            out[i] = parsed_one
+    return out
+
+
 def compute_checksum(cells: List[str]) -> str:
-    text = "|".join([str(c or "").strip() for c in cells])
+    # Same text as str(c or "").strip() per cell; str cells skip the str() call
+    text = "|".join([c.strip() if type(c) is str else str(c or "").strip() for c in cells])
     return hashlib.sha1(text.encode("utf-8")).hexdigest()
 
 
-def rows_to_facts(values: List[List[str]]) -> pd.DataFrame:
-    cfg = load_config()
-    date_col_letter = cfg["columns"]["date"]
+FACT_COLUMNS = [
+    "fact_id",
+    "volunteer_id",
+    "service_type_id",
+    "service_date",
+    "source_row_id",
+    "ingested_at",
+]
+
+
+def _padded_frame(values: List[List[str]], width: int) -> pd.DataFrame:
+    """Load ragged sheet rows into one rectangular frame (missing cells -> None)."""
+    frame = pd.DataFrame.from_records(values) if values else pd.DataFrame()
+    return frame.reindex(columns=range(width))
+
+
+def _normalize_names(cells: np.ndarray, resolve: Callable[[object], str]) -> np.ndarray:
+    """Volunteer ids of a column (``resolve`` is ``AliasIndex.resolve``),
+    computed once per distinct cell value."""
+    codes, uniques = pd.factorize(cells, use_na_sentinel=True)
+    if any(type(u) is not str for u in uniques):
+        # factorize would merge 1, 1.0 and True, whose str() differ
+        return np.array([resolve(c) for c in cells], dtype=object)
+    normalized = np.array([resolve(u) for u in uniques] + [""], dtype=object)
+    # code -1 (missing cell) picks the trailing "" entry
+    return normalized[codes]
+
+
+def _dated_rows(values: List[List[str]], row_numbers: Optional[Sequence[int]],
+                date_idx: int, spreadsheet_id: str, sheet_name: str) -> pd.DataFrame:
+    """Positions, row numbers, dates, checksums and source_row_ids of dated rows."""
+    if row_numbers is None:
+        numbers = np.arange(1, len(values) + 1, dtype=np.int64)
+    else:
+        numbers = np.asarray(row_numbers, dtype=np.int64)
+    with span("transform.parse_dates", rows_in=len(values)) as s:
+        dates = parse_dates([row[date_idx] if len(row) > date_idx else None for row in values])
+        positions = np.flatnonzero(dates.notna().to_numpy())
+        s.rows_out = len(positions)
+
+    dated = pd.DataFrame(
+        {
+            "pos": positions,
+            "row_index": numbers[positions],
+            "service_date": dates.to_numpy()[positions],
+        }
+    )
+    # Checksums cover every available cell of the row, so they stay per-row.
+    with span("transform.checksum", rows_in=len(positions)):
+        dated["row_checksum"] = [compute_checksum(values[i]) for i in positions]
+    dated["source_row_id"] = (
+        f"{spreadsheet_id}:{sheet_name}:" + dated["row_index"].astype(str) + ":" + dated["row_checksum"]
+    )
+    return dated
+
+
+def rows_to_source_rows(values: List[List[str]], row_numbers: Optional[Sequence[int]] = None,
+                        cfg: Optional[dict] = None) -> pd.DataFrame:
+    """One record per dated sheet row with its A1 row index, checksum and date.
+
+    ``row_numbers`` gives the A1 row number of each entry in ``values`` when
+    they are not a contiguous slice starting at row 1. ``cfg`` is the source
+    config (see ``ingest.config.source_configs``) and defaults to config.yaml.
+    """
+    cfg = cfg or load_config()
+    date_idx = column_letter_to_index(cfg["columns"]["date"])
+    dated = _dated_rows(values, row_numbers, date_idx, cfg["spreadsheet_id"], cfg["sheet_name"])
+    dated["spreadsheet_id"] = cfg["spreadsheet_id"]
+    dated["sheet_name"] = cfg["sheet_name"]
+    return dated[["source_row_id", "spreadsheet_id", "sheet_name", "row_index", "row_checksum", "service_date"]]
+
+
+def rows_to_facts(values: List[List[str]], row_numbers: Optional[Sequence[int]] = None,
+                  cfg: Optional[dict] = None) -> pd.DataFrame:
+    """Melt the role columns of dated rows into one fact per (row, role).
+
+    Columnar: the ragged rows are padded into a frame once, role windows are
+    applied as boolean masks and ids are built with vectorized string ops.
+    """
+    cfg = cfg or load_config()
+    date_idx = column_letter_to_index(cfg["columns"]["date"])
+    dated = _dated_rows(values, row_numbers, date_idx, cfg["spreadsheet_id"], cfg["sheet_name"])
+    return _melt_facts(values, dated, cfg)
+
+
+def _melt_facts(values: List[List[str]], dated: pd.DataFrame, cfg: dict) -> pd.DataFrame:
+    with span("transform.melt", rows_in=len(dated)) as s:
+        facts = _melt_dated_rows(values, dated, cfg)
+        s.rows_out = len(facts)
+    return facts
+
+
+def _take_strings(uniques: np.ndarray, codes: np.ndarray) -> pa.Array:
+    return pa.array([str(u) for u in uniques], pa.string()).take(pa.array(codes))
+
+
+def _fact_ids(day: np.ndarray, service_type: np.ndarray, service_types: np.ndarray,
+              volunteer: np.ndarray, volunteers: np.ndarray, row_number: np.ndarray,
+              scope: Optional[str]) -> np.ndarray:
+    """``{date} 00:00:00:{service_type}:{volunteer}:{row}[:{scope}]`` per fact.
+
+    Joined in Arrow; each distinct date and name is formatted only once.
+    """
+    day_codes, days = pd.factorize(day)
+    parts = [
+        pa.array(np.datetime_as_string(days, unit="D") + " 00:00:00").take(pa.array(day_codes)),
+        _take_strings(service_types, service_type),
+        _take_strings(volunteers, volunteer),
+        pc.cast(pa.array(row_number), pa.string()),
+    ]
+    if scope:
+        parts.append(pa.scalar(str(scope)))
+    return pc.binary_join_element_wise(*parts, ":").to_numpy(zero_copy_only=False)
+
+
+def _melt_dated_rows(values: List[List[str]], dated: pd.DataFrame, cfg: dict) -> pd.DataFrame:
     role_defs = [RoleColumn(**r) for r in cfg["columns"]["roles"]]
-    sheet_name = cfg["sheet_name"]
-    spreadsheet_id = cfg["spreadsheet_id"]
-
-    letter_to_index = {chr(ord('A') + i): i for i in range(26)}
-    date_idx = letter_to_index[date_col_letter]
-    role_indices = [(letter_to_index[r.key], r) for r in role_defs]
-
-    facts: List[Dict[str, str]] = []
-    ingested_at = pd.Timestamp(datetime.now(timezone.utc))
-
-    for i, row in enumerate(values):
-        # A1-based row number for spreadsheets
-        row_number = i + 1
-        if i == 0:
-            # likely header row; still compute row_number for rules
-            pass
-        # Check if row has enough columns for date
-        if len(row) <= date_idx:
-            continue
-        service_date = parse_date(row[date_idx])
-        if service_date is None:
-            continue
-        # Compute checksum for all available columns
-        checksum = compute_checksum(row)
-        source_row_id = f"{spreadsheet_id}:{sheet_name}:{i+1}:{checksum}"
-
-        # 按列分组处理，避免同一列的多个服务类型冲突
-        processed_columns = set()
-        
-        for idx, role in role_indices:
-            # 如果这一列已经处理过，跳过
-            if idx in processed_columns:
-                continue
-                
-            name_cell = row[idx] if idx < len(row) else ""
-            name = normalize_name(name_cell)
-            if not name:
-                continue
-            # row-based validity window
-            if role.valid_from_row is not None and row_number < role.valid_from_row:
-                continue
-            if role.valid_until_row is not None and row_number > role.valid_until_row:
-                continue
-            
-            # 标记这一列已处理
-            processed_columns.add(idx)
-            
-            volunteer_id = name  # simple key; could be hashed or alias-resolved later
-            fact_id = f"{service_date}:{role.service_type}:{volunteer_id}:{row_number}"
-            facts.append(
-                {
-                    "fact_id": fact_id,
-                    "volunteer_id": volunteer_id,
-                    "service_type_id": role.service_type,
-                    "service_date": service_date,
-                    "source_row_id": source_row_id,
-                    "ingested_at": ingested_at,
-                }
-            )
-
-    if not facts:
-        return pd.DataFrame(
-            columns=[
-                "fact_id",
-                "volunteer_id",
-                "service_type_id",
-                "service_date",
-                "source_row_id",
-                "ingested_at",
-            ]
-        )
-    df = pd.DataFrame(facts)
+    role_indices = [(column_letter_to_index(r.key), r) for r in role_defs]
+    ingested_at = pd.Timestamp(datetime.now(timezone.utc)).as_unit("ns")
+
+    if dated.empty or not role_indices:
+        return pd.DataFrame(columns=FACT_COLUMNS)
+
+    pos = dated["pos"].to_numpy()
+    row_index = dated["row_index"].to_numpy()
+    role_cols = sorted({idx for idx, _ in role_indices})
+    grid = _padded_frame(values, max(role_cols) + 1)
+    # One volunteer-id matrix (dated rows x role columns)
+    resolve = alias_index(cfg).resolve
+    names = np.column_stack([_normalize_names(grid[idx].to_numpy()[pos], resolve) for idx in role_cols])
+    col_of = {idx: j for j, idx in enumerate(role_cols)}
+
+    # 按列分组处理，避免同一列的多个服务类型冲突：一列在一行里只归属第一个匹配的角色
+    claimed = np.zeros(names.shape, dtype=bool)
+    hit_rows, hit_roles = [], []
+    for order, (idx, role) in enumerate(role_indices):
+        j = col_of[idx]
+        mask = (names[:, j] != "") & ~claimed[:, j]
+        # row-based validity window
+        if role.valid_from_row is not None:
+            mask &= row_index >= role.valid_from_row
+        if role.valid_until_row is not None:
+            mask &= row_index <= role.valid_until_row
+        claimed[:, j] |= mask
+        hits = np.flatnonzero(mask)
+        hit_rows.append(hits)
+        hit_roles.append(np.full(len(hits), order))
+
+    rows = np.concatenate(hit_rows)
+    if not len(rows):
+        return pd.DataFrame(columns=FACT_COLUMNS)
+    roles = np.concatenate(hit_roles)
+    # Row-major order (row, then role) keeps the index identical to the
+    # row-by-row implementation.
+    perm = np.lexsort((roles, rows))
+    rows, roles = rows[perm], roles[perm]
+
+    role_cols_of = np.array([col_of[idx] for idx, _ in role_indices])
+    volunteer_id = names[rows, role_cols_of[roles]]
+    service_type_id = np.array([r.service_type for _, r in role_indices], dtype=object)[roles]
+    service_date = dated["service_date"].to_numpy()[rows]
+    day = service_date.astype("datetime64[D]")
+    # Sorted codes: shared by fact_id and the de-duplication order below
+    volunteer, volunteers = pd.factorize(volunteer_id, sort=True)
+    service_type, service_types = pd.factorize(service_type_id, sort=True)
+    df = pd.DataFrame(
+        {
+            "fact_id": _fact_ids(day, service_type, service_types, volunteer, volunteers,
+                                 row_index[rows], cfg.get("fact_id_scope")),
+            "volunteer_id": volunteer_id,
+            "service_type_id": service_type_id,
+            "service_date": service_date,
+            "source_row_id": dated["source_row_id"].to_numpy()[rows],
+            "ingested_at": ingested_at,
+        }
+    )
+
     # 去重：同一 service_date / volunteer_id / service_type_id 保留一条
-    df = df.sort_values(["service_date", "volunteer_id", "service_type_id", "source_row_id"]).drop_duplicates(
-        subset=["service_date", "volunteer_id", "service_type_id"], keep="first"
+    # Sort by (date, volunteer, service type, source_row_id) on hashed,
+    # order-preserving integer codes, then keep the first row of each key run.
+    day = day.astype(np.int64)
+    source_rank = pd.factorize(dated["source_row_id"].to_numpy(), sort=True)[0][rows]
+    order = np.lexsort((source_rank, service_type, volunteer, day))
+    day, volunteer, service_type = day[order], volunteer[order], service_type[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (day[1:] != day[:-1]) | (volunteer[1:] != volunteer[:-1]) | (service_type[1:] != service_type[:-1])
+    return df.iloc[order[first]]
+
+
+@dataclass
+class FactBatch:
+    """Transform output for one block of sheet rows."""
+    first_row: int
+    row_count: int
+    source_rows: pd.DataFrame
+    facts: pd.DataFrame
+    staging: pd.DataFrame
+
+
+def rows_to_batch(values: List[List[str]], first_row: int = 1, cfg: Optional[dict] = None) -> FactBatch:
+    """Source rows, facts and staged cells of consecutive rows from ``first_row``.
+
+    Dates are parsed and checksums computed once per row and shared by the
+    three outputs.
+    """
+    cfg = cfg or load_config()
+    date_idx = column_letter_to_index(cfg["columns"]["date"])
+    row_numbers = range(first_row, first_row + len(values))
+    dated = _dated_rows(values, row_numbers, date_idx, cfg["spreadsheet_id"], cfg["sheet_name"])
+    source_rows = dated.assign(spreadsheet_id=cfg["spreadsheet_id"], sheet_name=cfg["sheet_name"])
+    return FactBatch(
+        first_row=first_row,
+        row_count=len(values),
+        source_rows=source_rows[["source_row_id", "spreadsheet_id", "sheet_name", "row_index",
+                                 "row_checksum", "service_date"]],
+        facts=_melt_facts(values, dated, cfg),
+        staging=rows_to_staging(values, row_numbers=row_numbers, cfg=cfg,
+                                checksums=dict(zip(dated["pos"].tolist(), dated["row_checksum"]))),
     )
-    return df
 
 
+def iter_fact_batches(blocks: Iterable[Tuple[int, List[List[str]]]],
+                      cfg: Optional[dict] = None) -> Iterator[FactBatch]:
+    """Transform ``(first_row, rows)`` blocks lazily, one batch per block.
+
+    Facts are only de-duplicated within a block; duplicates spanning blocks
+    are left for the store to resolve once the stream is loaded.
+    """
+    cfg = cfg or load_config()
+    for first_row, rows in blocks:
+        yield rows_to_batch(rows, first_row, cfg)
+
+
+STAGING_COLUMNS = ["spreadsheet_id", "sheet_name", "row_index", "cells", "row_checksum"]
+
+
+def _staging_cell(cell: object) -> object:
+    # JSON keeps numbers (date serials) apart from text; anything else is
+    # staged as the str() the Python transform would see.
+    if cell is None or type(cell) in (str, int, float):
+        return cell
+    return str(cell)
+
+
+def rows_to_staging(values: List[List[str]], row_numbers: Optional[Sequence[int]] = None,
+                    cfg: Optional[dict] = None, checksums: Optional[Dict[int, str]] = None) -> pd.DataFrame:
+    """Raw cell grid for the staging table: one JSON array per non-empty row.
+
+    The checksum is computed here (not in SQL) so source_row_ids derived from
+    staging are identical to the ones ``rows_to_source_rows`` produces;
+    ``checksums`` (position in ``values`` -> checksum) reuses known ones.
+    """
+    cfg = cfg or load_config()
+    if row_numbers is None:
+        row_numbers = range(1, len(values) + 1)
+    known = checksums or {}
+    with span("transform.staging", rows_in=len(values)) as s:
+        records = [
+            (n, json.dumps([_staging_cell(c) for c in row], ensure_ascii=False),
+             known[i] if i in known else compute_checksum(row))
+            for i, (n, row) in enumerate(zip(row_numbers, values))
+            if row
+        ]
+        s.rows_out = len(records)
+    df = pd.DataFrame(records, columns=["row_index", "cells", "row_checksum"])
+    df.insert(0, "sheet_name", cfg["sheet_name"])
+    df.insert(0, "spreadsheet_id", cfg["spreadsheet_id"])
+    return df[STAGING_COLUMNS]
+
+
+def derivation_fingerprint(cfg: dict) -> str:
+    """Changes whenever the cells of a source may derive different facts
+    (date and role columns, role row windows, ``fact_id_scope``)."""
+    payload = json.dumps([cfg["columns"], cfg.get("fact_id_scope")], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def staging_spec(cfg: dict) -> dict:
+    """What the SQL transform needs to derive facts of one source from staging."""
+    return {
+        "spreadsheet_id": cfg["spreadsheet_id"],
+        "sheet_name": cfg["sheet_name"],
+        "date_index": column_letter_to_index(cfg["columns"]["date"]),
+        "fact_id_scope": cfg.get("fact_id_scope"),
+        "resolve_name": alias_index(cfg).resolve,
+        "parse_dates": parse_dates,
+        "roles": pd.DataFrame(
+            [
+                {
+                    "role_order": order,
+                    "column_index": column_letter_to_index(r["key"]),
+                    "service_type": r["service_type"],
+                    "valid_from_row": r.get("valid_from_row"),
+                    "valid_until_row": r.get("valid_until_row"),
+                }
+                for order, r in enumerate(cfg["columns"]["roles"])
+            ],
+            columns=["role_order", "column_index", "service_type", "valid_from_row", "valid_until_row"],
+        ).astype({"valid_from_row": "Int64", "valid_until_row": "Int64"}),
+    }
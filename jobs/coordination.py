@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import fcntl
+import json
+import os
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, is_dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import IO, Any, Callable, Iterator, Optional, TypeVar
+
+
+T = TypeVar("T")
+
+# How often a blocked caller re-checks the lock
+_POLL_SECONDS = 0.2
+
+
+class IngestFailed(RuntimeError):
+    """The run a caller attached to raised; carries the leader's error text."""
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class SingleFlight:
+    """At most one ingest at a time across threads, sessions and processes.
+
+    ``lock_path`` is held with ``flock`` for the whole run (the kernel drops
+    it if the process dies, so a crashed run never wedges later ones) and
+    ``status_path`` records the current/last run. A caller that finds a run
+    in flight waits for it and gets its result instead of starting another.
+    """
+
+    def __init__(self, lock_path: str = "data/ingest.lock", status_path: str = "data/ingest_status.json") -> None:
+        self.lock_path = Path(lock_path)
+        self.status_path = Path(status_path)
+
+    def status(self) -> Optional[dict]:
+        """The shared status record: ``state`` is running, done or failed."""
+        try:
+            with self.status_path.open("r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_status(self, **status: Any) -> None:
+        # Write-then-rename so readers never see a half-written record
+        tmp = self.status_path.with_name(self.status_path.name + ".tmp")
+        with tmp.open("w", encoding="utf-8") as f:
+            json.dump(status, f, ensure_ascii=False, default=str)
+        os.replace(tmp, self.status_path)
+
+    def _open_lock(self) -> IO[str]:
+        self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+        # Each open() is its own lock owner, so threads of one process
+        # (Streamlit sessions) exclude each other as well
+        return self.lock_path.open("a")
+
+    @staticmethod
+    def _lock(f: IO[str], operation: int, deadline: Optional[float]) -> bool:
+        """flock ``f``; blocks until ``deadline`` (monotonic), False on timeout."""
+        while True:
+            try:
+                fcntl.flock(f, operation | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                if deadline is not None and time.monotonic() >= deadline:
+                    return False
+                time.sleep(_POLL_SECONDS)
+
+    @contextmanager
+    def exclusive(self, timeout: Optional[float] = None) -> Iterator[None]:
+        """Hold the lock without attaching, for writers that must run
+        themselves (single-row pushes, rebuilds)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._open_lock() as f:
+            if not self._lock(f, fcntl.LOCK_EX, deadline):
+                raise TimeoutError(f"ingest lock {self.lock_path} still held after {timeout}s")
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _lead(self, fn: Callable[[], T]) -> T:
+        started_at = _now().isoformat()
+        self._write_status(state="running", pid=os.getpid(), started_at=started_at)
+        try:
+            result = fn()
+        except BaseException as e:
+            self._write_status(state="failed", pid=os.getpid(), started_at=started_at,
+                               finished_at=_now().isoformat(), error=f"{type(e).__name__}: {e}")
+            raise
+        self._write_status(state="done", pid=os.getpid(), started_at=started_at, finished_at=_now().isoformat(),
+                           result=asdict(result) if is_dataclass(result) else result)
+        return result
+
+    def run(self, fn: Callable[[], T], decode: Callable[[Any], T], timeout: Optional[float] = None) -> T:
+        """Run ``fn`` unless a run is already in flight; then wait and return
+        ``decode`` of that run's recorded result (raise ``IngestFailed`` if it
+        failed).
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        since = _now()
+        while True:
+            with self._open_lock() as f:
+                if self._lock(f, fcntl.LOCK_EX, time.monotonic()):
+                    try:
+                        return self._lead(fn)
+                    finally:
+                        fcntl.flock(f, fcntl.LOCK_UN)
+                # Shared, so the callers waiting on one run do not queue up behind each other
+                if not self._lock(f, fcntl.LOCK_SH, deadline):
+                    raise TimeoutError(f"ingest still running after {timeout}s")
+                fcntl.flock(f, fcntl.LOCK_UN)
+            status = self.status() or {}
+            finished_at = status.get("finished_at")
+            if finished_at and datetime.fromisoformat(finished_at) >= since:
+                if status["state"] == "failed":
+                    raise IngestFailed(status.get("error", "ingest failed"))
+                return decode(status["result"])
+            # The holder died without a verdict or was an exclusive() writer: try to lead
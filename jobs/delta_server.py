@@ -0,0 +1,168 @@
+"""Push endpoint for single-row edits.
+
+An Apps Script ``onEdit`` trigger posts each edited row instead of waiting
+for the next pull of the whole sheet:
+
+    POST /rows
+    X-Ingest-Token: <ingest.delta_server.token or $DELTA_INGEST_TOKEN>
+    {"sheet_name": "总表", "row": 42, "values": [45300, "", ...]}
+
+``spreadsheet_id`` defaults to the top-level one in config.yaml, ``values``
+is the full row from column A (``[]`` retracts the row) and a JSON list
+posts several rows at once. Send dates as serial numbers (what the pull
+reads) or as text; a JSON-serialized Apps Script Date is UTC and may land
+on the previous day.
+
+The token may only be omitted when listening on a loopback address.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hmac
+import ipaddress
+import json
+import os
+from dataclasses import asdict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Any, List, Optional, Tuple
+
+from ingest.config import load_config
+from jobs.ingest_job import ingest_row
+
+
+# A full roster row is well under 1 KiB; anything larger is not an edit
+MAX_BODY_BYTES = 1 << 20
+
+
+class _BadRequest(ValueError):
+    pass
+
+
+def _parse_edits(payload: Any, default_spreadsheet_id: str) -> List[Tuple[str, str, int, list]]:
+    edits = payload if isinstance(payload, list) else [payload]
+    parsed = []
+    for edit in edits:
+        if not isinstance(edit, dict):
+            raise _BadRequest("each edit must be a JSON object")
+        row, values = edit.get("row"), edit.get("values", [])
+        if not isinstance(row, int) or isinstance(row, bool) or row < 1:
+            raise _BadRequest("row must be an integer >= 1")
+        if not isinstance(values, list):
+            raise _BadRequest("values must be a list")
+        if not isinstance(edit.get("sheet_name"), str):
+            raise _BadRequest("sheet_name is required")
+        parsed.append((edit.get("spreadsheet_id") or default_spreadsheet_id, edit["sheet_name"], row, values))
+    return parsed
+
+
+def _is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def _content_length(header: Optional[str]) -> int:
+    if header is None:
+        raise _BadRequest("Content-Length is required")
+    header = header.strip()
+    if not (header.isascii() and header.isdigit()):
+        raise _BadRequest("invalid Content-Length")
+    return int(header)
+
+
+class DeltaHandler(BaseHTTPRequestHandler):
+    # Set by serve(); None disables the token check (loopback only)
+    token: Optional[str] = None
+    # The server is single-threaded: drop clients that stall mid-request
+    timeout = 30
+
+    def _reply(self, status: int, body: Any) -> None:
+        data = json.dumps(body, ensure_ascii=False, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:
+        if self.path == "/healthz":
+            self._reply(200, {"ok": True})
+        else:
+            self._reply(404, {"error": "not found"})
+
+    def do_POST(self) -> None:
+        if self.path != "/rows":
+            self._reply(404, {"error": "not found"})
+            return
+        if self.token is not None and not hmac.compare_digest(
+            self.headers.get("X-Ingest-Token", "").encode("utf-8"), self.token.encode("utf-8")
+        ):
+            self._reply(401, {"error": "invalid token"})
+            return
+        try:
+            length = _content_length(self.headers.get("Content-Length"))
+        except _BadRequest as e:
+            self._reply(400, {"error": str(e)})
+            return
+        if length > MAX_BODY_BYTES:
+            self._reply(413, {"error": "body too large"})
+            return
+        try:
+            payload = json.loads(self.rfile.read(length) or b"null")
+            edits = _parse_edits(payload, load_config()["spreadsheet_id"])
+        except (ValueError, _BadRequest) as e:
+            self._reply(400, {"error": str(e)})
+            return
+        results = []
+        for spreadsheet_id, sheet_name, row, values in edits:
+            try:
+                results.append(asdict(ingest_row(spreadsheet_id, sheet_name, row, values)))
+            except KeyError as e:
+                self._reply(404, {"error": e.args[0], "applied": results})
+                return
+            except Exception as e:
+                self.log_error("row %s:%s:%d failed: %r", spreadsheet_id, sheet_name, row, e)
+                self._reply(500, {"error": str(e), "applied": results})
+                return
+        self._reply(200, {"applied": results})
+
+
+def serve(host: str = "127.0.0.1", port: int = 8081, token: Optional[str] = None) -> None:
+    """Serve until interrupted.
+
+    Single-threaded on purpose: pushes are applied one at a time in arrival
+    order, so two quick edits of the same row cannot race. Refuses to listen
+    on a non-loopback ``host`` without a ``token``.
+    """
+    if not token and not _is_loopback(host):
+        raise ValueError(f"refusing to serve on {host} without a token "
+                         "(set ingest.delta_server.token or $DELTA_INGEST_TOKEN)")
+    DeltaHandler.token = token or None
+    server = HTTPServer((host, port), DeltaHandler)
+    print(f"Listening for row edits on http://{host}:{port}/rows")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    cfg = load_config().get("ingest", {}).get("delta_server", {})
+    parser = argparse.ArgumentParser(description="Accept single-row edits pushed by the roster sheet")
+    parser.add_argument("--host", default=cfg.get("host", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(cfg.get("port", 8081)))
+    args = parser.parse_args(argv)
+    try:
+        serve(args.host, args.port, token=os.environ.get("DELTA_INGEST_TOKEN") or cfg.get("token"))
+    except ValueError as e:
+        parser.error(str(e))
+
+
+if __name__ == "__main__":
+    main()
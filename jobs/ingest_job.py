@@ -1,30 +1,607 @@
 from __future__ import annotations
 
-import yaml
+import argparse
+import json
+import logging
+import random
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
+from typing import Any, Callable, List, Optional, Sequence, Tuple
 
 import pandas as pd
 
-from ingest.sheets_client import read_range_a_to_u
-from ingest.transform import rows_to_facts
-from storage.duckdb_store import DuckDBStore, DuckDBConfig
+from ingest import tracing
+from ingest.raw_cache import RawResponseCache, payload_fingerprint
+from ingest.config import load_config, source_configs
+from ingest.names import AliasIndex, alias_index
+from ingest.sources import fetch_sources, open_source
+from ingest.transform import (
+    derivation_fingerprint,
+    iter_fact_batches,
+    project_row,
+    rows_to_batch,
+    rows_to_facts,
+    rows_to_source_rows,
+    rows_to_staging,
+    staging_spec,
+)
+from jobs.coordination import SingleFlight
+from storage.duckdb_store import (
+    SHADOW_FACT_TABLE,
+    SHADOW_RAW_ROW_TABLE,
+    SHADOW_SOURCE_ROW_TABLE,
+    DuckDBStore,
+    DuckDBConfig,
+)
 
 
-def _load_config() -> dict:
-    with open("configs/config.yaml", "r", encoding="utf-8") as f:
-        return yaml.safe_load(f)
+INGEST_MODES = ("full", "incremental", "tail", "stream")
 
+logger = logging.getLogger(__name__)
 
-def run_ingest() -> None:
-    values = read_range_a_to_u()
-    facts = rows_to_facts(values)
-    cfg = _load_config()
-    store = DuckDBStore(DuckDBConfig(cfg["storage"]["duckdb_path"]))
-    store.upsert_date_dim(pd.to_datetime(facts["service_date"]))
-    store.insert_facts(facts)
 
+@dataclass
+class IngestResult:
+    mode: str
+    rows_fetched: int = 0
+    rows_changed: int = 0
+    rows_removed: int = 0
+    facts_written: int = 0
+    skipped: bool = False
+    # True when the caller waited for a run started elsewhere and got its result
+    attached: bool = False
+    # Per-stage timings of the run (see ingest.tracing.Trace.stages)
+    profile: Optional[List[dict]] = field(default=None, repr=False)
+
+
+def _run_full(store: DuckDBStore, fetched: List[Tuple[dict, List[List[str]]]]) -> IngestResult:
+    """Rewrite every fact of the fetched sources as a new snapshot.
+
+    Facts, row checksums and staged cells are built in shadow tables and
+    swapped in together once validated, so facts of rows deleted from the
+    sheet disappear and readers see either the old snapshot or the new one.
+    """
+    result = IngestResult(mode="full")
+    expected_rows = {}
+    with store.transaction():
+        store.begin_fact_snapshot([(src["spreadsheet_id"], src["sheet_name"]) for src, _ in fetched])
+        for src, values in fetched:
+            batch = rows_to_batch(values, cfg=src)
+            store.upsert_date_dim(pd.to_datetime(batch.facts["service_date"]))
+            store.insert_facts(batch.facts, table=SHADOW_FACT_TABLE)
+            store.append_source_rows(batch.source_rows, table=SHADOW_SOURCE_ROW_TABLE)
+            store.stage_raw_rows(src["spreadsheet_id"], src["sheet_name"], batch.staging,
+                                 table=SHADOW_RAW_ROW_TABLE)
+            expected_rows[(src["spreadsheet_id"], src["sheet_name"])] = len(batch.source_rows)
+            result.rows_fetched += len(values)
+            result.facts_written += len(batch.facts)
+        # Each source is de-duplicated on its own; resolve duplicates across
+        # sources (including the ones kept from sources not loaded now)
+        store.dedupe_facts(table=SHADOW_FACT_TABLE)
+        store.swap_fact_snapshot(expected_rows)
+    return result
+
+
+def _run_stream(store: DuckDBStore, sources: List[dict], block_size: int) -> IngestResult:
+    """Full load in row blocks: fetch, transform and append one block at a time.
+
+    Peak memory is bounded by ``block_size`` rows instead of the whole sheet;
+    the next block is fetched while the current one is transformed. Facts,
+    row checksums and staged cells go to shadow tables that replace the live
+    ones at the end (see ``_run_full``), so readers never see a half-loaded
+    stream and a failed one leaves the previous load intact.
+    """
+    result = IngestResult(mode="stream")
+    expected_rows = {}
+    store.begin_fact_snapshot([(src["spreadsheet_id"], src["sheet_name"]) for src in sources])
+    try:
+        for src in sources:
+            key = (src["spreadsheet_id"], src["sheet_name"])
+            expected_rows[key] = 0
+            for batch in iter_fact_batches(open_source(src).iter_row_blocks(block_size), cfg=src):
+                # One transaction per block: its facts, row checksums and staged cells land together
+                with tracing.span("load.block", rows_in=batch.row_count) as span, store.transaction():
+                    if not batch.facts.empty:
+                        store.upsert_date_dim(pd.to_datetime(batch.facts["service_date"]))
+                    store.insert_facts(batch.facts, table=SHADOW_FACT_TABLE)
+                    store.append_source_rows(batch.source_rows, table=SHADOW_SOURCE_ROW_TABLE)
+                    store.stage_raw_rows(src["spreadsheet_id"], src["sheet_name"], batch.staging,
+                                         min_row_index=batch.first_row, table=SHADOW_RAW_ROW_TABLE)
+                    span.rows_out = len(batch.facts)
+                expected_rows[key] += len(batch.source_rows)
+                result.rows_fetched += batch.row_count
+                result.facts_written += len(batch.facts)
+        with store.transaction():
+            # Blocks are de-duplicated individually; resolve duplicates across blocks
+            store.dedupe_facts(table=SHADOW_FACT_TABLE)
+            store.swap_fact_snapshot(expected_rows)
+    except BaseException:
+        store.drop_fact_snapshot()
+        raise
+    return result
+
+
+def _merge_rows(store: DuckDBStore, fetched: List[Tuple[dict, int, List[List[str]]]],
+                mode: str = "incremental") -> IngestResult:
+    """Re-derive facts only for rows whose checksum differs from the last run.
+
+    Each ``(source, first_row, values)`` entry holds a tab from ``first_row``
+    to the end; rows above it are left untouched. The deltas of all sources
+    are applied in one transaction.
+    """
+    diffs = []
+    stale_ids: List[str] = []
+    for src, first_row, values in fetched:
+        row_numbers = list(range(first_row, first_row + len(values)))
+        current = rows_to_source_rows(values, row_numbers=row_numbers, cfg=src)
+        previous = store.load_source_rows(src["spreadsheet_id"], src["sheet_name"], min_row_index=first_row)
+        previous_ids = set(previous["source_row_id"])
+        # source_row_id embeds the row index and checksum, so an edited row shows
+        # up as one stale id plus one new id.
+        stale_ids.extend(sorted(previous_ids - set(current["source_row_id"])))
+        is_new = ~current["source_row_id"].isin(previous_ids)
+        diffs.append((src, row_numbers, values, current, previous, is_new))
+
+    # Facts are de-duplicated per (date, volunteer, service type) across rows
+    # (and sources), so unchanged rows sharing a date with a touched row are
+    # re-derived too; a duplicate they lost to a now-stale row must come back.
+    touched_dates = store.load_fact_dates(stale_ids)
+    for _, _, _, current, _, is_new in diffs:
+        touched_dates |= set(current.loc[is_new, "service_date"])
+
+    result = IngestResult(mode=mode)
+    new_rows, facts = [], []
+    for src, row_numbers, values, current, previous, is_new in diffs:
+        rederive = is_new | current["service_date"].isin(touched_dates)
+        rows_by_number = dict(zip(row_numbers, values))
+        rederive_numbers = current.loc[rederive, "row_index"].tolist()
+        facts.append(rows_to_facts([rows_by_number[n] for n in rederive_numbers],
+                                   row_numbers=rederive_numbers, cfg=src))
+        new_rows.append(current[is_new])
+        result.rows_fetched += len(values)
+        result.rows_changed += int(is_new.sum())
+        result.rows_removed += len(set(previous["row_index"]) - set(current["row_index"]))
+
+    facts = [f for f in facts if not f.empty]
+    new_rows = [r for r in new_rows if not r.empty]
+    facts_df = pd.concat(facts, ignore_index=True) if facts else pd.DataFrame()
+    new_rows_df = pd.concat(new_rows, ignore_index=True) if new_rows else pd.DataFrame()
+    with store.transaction():
+        if not facts_df.empty:
+            store.upsert_date_dim(pd.to_datetime(facts_df["service_date"]))
+        store.apply_row_delta(stale_ids, new_rows_df, facts_df)
+        for src, row_numbers, values, _, _, _ in diffs:
+            store.stage_raw_rows(src["spreadsheet_id"], src["sheet_name"],
+                                 rows_to_staging(values, row_numbers=row_numbers, cfg=src),
+                                 min_row_index=row_numbers[0] if row_numbers else 1)
+    result.facts_written = len(facts_df)
+    return result
+
+
+def _tail_start_row(store: DuckDBStore, src: dict) -> int:
+    last_row = store.max_source_row_index(src["spreadsheet_id"], src["sheet_name"])
+    if last_row is None:
+        return 1
+    overlap = int(src.get("ingest", {}).get("tail_overlap_rows", 20))
+    return max(1, last_row - overlap)
+
+
+def _derivation_key(src: dict) -> str:
+    return f"derivation:{src['spreadsheet_id']}:{src['sheet_name']}"
+
+
+def _record_config(store: DuckDBStore, index: AliasIndex, sources: List[dict]) -> None:
+    store.set_meta("name_index", index.fingerprint())
+    for src in sources:
+        store.set_meta(_derivation_key(src), derivation_fingerprint(src))
+    store.sync_volunteers(index.aliases)
+
+
+def _sync_config(store: DuckDBStore, cfg: dict, sources: List[dict]) -> None:
+    """Re-derive every fact from staging when ``volunteer_aliases`` (or the
+    name rules) or the ``columns`` of a loaded source changed since the last
+    load: rows whose checksum did not change are not re-read otherwise. Then
+    mirror aliases and volunteer ids into their tables.
+
+    Nothing is re-derived on the first load, which already used this config.
+    """
+    index = alias_index(cfg)
+    recorded = [(store.get_meta("name_index"), index.fingerprint())]
+    recorded += [(store.get_meta(_derivation_key(src)), derivation_fingerprint(src)) for src in sources]
+    if any(old is not None and old != new for old, new in recorded):
+        # Configured tabs plus whatever this run loaded (e.g. a --file source)
+        specs = {(s["spreadsheet_id"], s["sheet_name"]): s for s in source_configs(cfg) + sources}
+        try:
+            with tracing.span("config.rebuild"):
+                store.rebuild_facts_from_staging([staging_spec(s) for s in specs.values()])
+        except ValueError:
+            # A configured tab was never ingested; retry once it has staged rows
+            store.sync_volunteers(index.aliases)
+            return
+    _record_config(store, index, sources)
+
+
+def _publish(store: DuckDBStore, cfg: dict) -> None:
+    """Bring the touched partitions of the Parquet lake up to the new data
+    version if ``storage.lake_dir`` is set. The rollup the dashboard queries
+    read is refreshed in the transaction that changes the facts."""
+    lake_dir = cfg["storage"].get("lake_dir")
+    if lake_dir:
+        store.export_lake(lake_dir)
+
+
+def export_lake() -> int:
+    """Export the Parquet lake (``storage.lake_dir``) without ingesting, e.g.
+    after deleting it. Returns the number of partitions written."""
+    cfg = load_config()
+    lake_dir = cfg["storage"].get("lake_dir")
+    if not lake_dir:
+        raise ValueError("storage.lake_dir is not set in config.yaml")
+    with _single_flight(cfg).exclusive(timeout=_lock_timeout(cfg)):
+        store = DuckDBStore(DuckDBConfig(cfg["storage"]["duckdb_path"]))
+        return store.export_lake(lake_dir)
+
+
+def run_ingest(mode: Optional[str] = None, force: bool = False,
+               sources: Optional[List[dict]] = None) -> IngestResult:
+    """Fetch every configured source and load them into DuckDB.
+
+    ``sources`` replaces the ``sources`` list of config.yaml (e.g. a local
+    export to backfill from; see ``ingest.sources``). Sources are fetched
+    concurrently (see ``fetch_sources``), transformed independently and
+    loaded in one transaction. Unless ``force`` is set, a fetch in which
+    every source's payload fingerprint matches its last persisted raw
+    response returns immediately with ``skipped=True`` and no DuckDB writes. ``stream`` mode never holds the whole payload,
+    so it bypasses the raw cache.
+    """
+    cfg = load_config()
+    ingest_cfg = cfg.get("ingest", {})
+    mode = mode or ingest_cfg.get("mode", "full")
+    if mode not in INGEST_MODES:
+        raise ValueError(f"mode must be one of {'|'.join(INGEST_MODES)}")
+    sources = source_configs({**cfg, "sources": sources} if sources else cfg)
+    cache = RawResponseCache(ingest_cfg.get("raw_cache_dir", "data/raw"))
+
+    if mode == "stream":
+        store = DuckDBStore(DuckDBConfig(cfg["storage"]["duckdb_path"]))
+        result = _run_stream(store, sources, int(ingest_cfg.get("block_size", 5000)))
+        _sync_config(store, cfg, sources)
+        _publish(store, cfg)
+        return result
+
+    store: Optional[DuckDBStore] = None
+    first_rows = [1] * len(sources)
+    if mode == "tail":
+        # Only the last ingested rows (plus an overlap window for late edits)
+        # and anything appended below them are fetched.
+        store = DuckDBStore(DuckDBConfig(cfg["storage"]["duckdb_path"]))
+        first_rows = [_tail_start_row(store, src) for src in sources]
+    with tracing.span("fetch") as span:
+        fetched = fetch_sources(sources, first_rows, max_workers=int(ingest_cfg.get("max_workers", 4)))
+        span.rows_out = sum(len(v) for v in fetched)
+
+    with tracing.span("fingerprint", rows_in=sum(len(v) for v in fetched)):
+        names = alias_index(cfg).fingerprint()
+        fingerprints = [payload_fingerprint(values, src["columns"], names) for src, values in zip(sources, fetched)]
+        unchanged = [
+            cache.is_unchanged(src["spreadsheet_id"], src["sheet_name"], fingerprint, first_row)
+            for src, first_row, fingerprint in zip(sources, first_rows, fingerprints)
+        ]
+    if not force and all(unchanged):
+        return IngestResult(mode=mode, rows_fetched=sum(len(v) for v in fetched), skipped=True)
+
+    # Unchanged sources are loaded too: facts are de-duplicated across
+    # sources, so a duplicate they lost to a changed row may have to return.
+    if store is None:
+        store = DuckDBStore(DuckDBConfig(cfg["storage"]["duckdb_path"]))
+    with tracing.span("load", rows_in=sum(len(v) for v in fetched)) as span:
+        if mode == "full":
+            result = _run_full(store, list(zip(sources, fetched)))
+        else:
+            result = _merge_rows(store, list(zip(sources, first_rows, fetched)), mode=mode)
+        span.rows_out = result.facts_written
+    _sync_config(store, cfg, sources)
+    _publish(store, cfg)
+    # Only remember the payloads once they are safely loaded
+    with tracing.span("cache.save"):
+        for src, first_row, values, fingerprint in zip(sources, first_rows, fetched, fingerprints):
+            cache.save(src["spreadsheet_id"], src["sheet_name"], fingerprint, values, first_row)
+    return result
+
+
+def _single_flight(cfg: dict) -> SingleFlight:
+    ingest_cfg = cfg.get("ingest", {})
+    return SingleFlight(ingest_cfg.get("lock_file", "data/ingest.lock"),
+                        ingest_cfg.get("status_file", "data/ingest_status.json"))
 
-if __name__ == "__main__":
-    run_ingest()
 
+def _lock_timeout(cfg: dict) -> Optional[float]:
+    timeout = cfg.get("ingest", {}).get("lock_timeout_seconds", 900)
+    return None if timeout is None else float(timeout)
 
+
+def _append_run_log(path: str, run: dict) -> None:
+    log = Path(path)
+    log.parent.mkdir(parents=True, exist_ok=True)
+    with log.open("a", encoding="utf-8") as f:
+        f.write(json.dumps(run, ensure_ascii=False, default=str) + "\n")
+
+
+def _recorded_run(cfg: dict, job: str, fn: Callable[[], IngestResult]) -> IngestResult:
+    """Run ``fn`` under a trace, then record the outcome: the ingest_status
+    row of ``job``, an ingest_run row with the per-stage timings and a line
+    in the JSONL run log. The stages are also returned as ``result.profile``.
+    """
+    error: Optional[str] = None
+    result: Optional[IngestResult] = None
+    with tracing.trace(job) as run:
+        try:
+            with tracing.span(job):
+                result = fn()
+            result.profile = run.stages()
+            return result
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            finished_at = datetime.now(timezone.utc).replace(tzinfo=None)
+            record = {
+                "run_id": run.run_id,
+                "job": job,
+                "started_at": run.started_at,
+                "finished_at": finished_at,
+                "wall_seconds": (finished_at - run.started_at).total_seconds(),
+                "error": error,
+                "result": json.dumps({k: v for k, v in asdict(result).items() if k != "profile"})
+                          if result else None,
+                "stages": json.dumps(run.stages(), ensure_ascii=False),
+            }
+            # Never mask the run's own outcome
+            try:
+                store = DuckDBStore(DuckDBConfig(cfg["storage"]["duckdb_path"]))
+                store.record_ingest_run(job, run.started_at, finished_at,
+                                        skipped=bool(result and result.skipped), error=error)
+                store.record_run_trace(record)
+            except Exception:
+                logger.exception("could not record %s run", job)
+            try:
+                _append_run_log(cfg.get("ingest", {}).get("run_log", "data/ingest_runs.jsonl"),
+                                {**record, "result": json.loads(record["result"]) if record["result"] else None,
+                                 "stages": json.loads(record["stages"])})
+            except OSError:
+                logger.exception("could not append to the run log")
+
+
+def run_ingest_once(mode: Optional[str] = None, force: bool = False,
+                    sources: Optional[List[dict]] = None) -> IngestResult:
+    """``run_ingest`` unless one is already in flight (another session, app
+    worker or the scheduled job); then wait for it and return its result
+    with ``attached=True``. The leader records the run in ``ingest_status``.
+    """
+    cfg = load_config()
+    return _single_flight(cfg).run(
+        lambda: _recorded_run(cfg, "ingest", lambda: run_ingest(mode, force=force, sources=sources)),
+        decode=lambda recorded: IngestResult(**{**recorded, "attached": True}),
+        timeout=_lock_timeout(cfg),
+    )
+
+
+def ingest_status() -> Optional[dict]:
+    """The shared record of the current or last ingest (see ``SingleFlight.status``)."""
+    return _single_flight(load_config()).status()
+
+
+def _apply_row_edit(store: DuckDBStore, sources: List[dict], src: dict,
+                    row_index: int, cells: Sequence[Any]) -> IngestResult:
+    """Upsert or retract the facts of one pushed sheet row.
+
+    Like ``_merge_rows`` for a single row: other rows (of any source) on a
+    touched date are re-derived from the staged raw cells, so a duplicate
+    the edited row used to win comes back.
+    """
+    values = [list(cells)] if cells else []
+    current = rows_to_source_rows(values, row_numbers=[row_index] * len(values), cfg=src)
+    previous = store.load_source_rows(src["spreadsheet_id"], src["sheet_name"],
+                                      min_row_index=row_index, max_row_index=row_index)
+    previous_ids = set(previous["source_row_id"])
+    stale_ids = sorted(previous_ids - set(current["source_row_id"]))
+    is_new = ~current["source_row_id"].isin(previous_ids)
+    result = IngestResult(mode="row", rows_fetched=1, rows_changed=int(is_new.sum()),
+                          rows_removed=int(current.empty and not previous.empty))
+
+    facts = []
+    touched_dates = store.load_fact_dates(stale_ids) | set(current.loc[is_new, "service_date"])
+    if touched_dates:
+        facts.append(rows_to_facts(values, row_numbers=[row_index] * len(values), cfg=src))
+        for other in sources:
+            staged = store.load_staged_rows(staging_spec(other), touched_dates)
+            if other is src:
+                staged = staged[staged["row_index"] != row_index]
+            facts.append(rows_to_facts([json.loads(c) for c in staged["cells"]],
+                                       row_numbers=staged["row_index"].tolist(), cfg=other))
+    facts = [f for f in facts if not f.empty]
+    facts_df = pd.concat(facts, ignore_index=True) if facts else pd.DataFrame()
+
+    with store.transaction():
+        if not facts_df.empty:
+            store.upsert_date_dim(pd.to_datetime(facts_df["service_date"]))
+        if stale_ids or not facts_df.empty:
+            store.apply_row_delta(stale_ids, current[is_new], facts_df)
+        # Undated rows (e.g. the header) are staged too, so always re-stage
+        store.stage_raw_rows(src["spreadsheet_id"], src["sheet_name"],
+                             rows_to_staging(values, row_numbers=[row_index] * len(values), cfg=src),
+                             min_row_index=row_index, max_row_index=row_index)
+    result.facts_written = len(facts_df)
+    return result
+
+
+def ingest_row(spreadsheet_id: str, sheet_name: str, row_index: int, cells: Sequence[Any]) -> IngestResult:
+    """Apply one edited sheet row pushed by the sheet itself (see ``jobs.delta_server``).
+
+    ``cells`` is the full row from column A, as ``values().get`` would return
+    it (empty to retract the row). Only the configured date/role columns are
+    kept, so the row checksum matches the one a later pull computes.
+    """
+    if row_index < 1:
+        raise ValueError("row_index must be >= 1")
+    cfg = load_config()
+    sources = source_configs(cfg)
+    src = next((s for s in sources if (s["spreadsheet_id"], s["sheet_name"]) == (spreadsheet_id, sheet_name)), None)
+    if src is None:
+        raise KeyError(f"{spreadsheet_id}:{sheet_name} is not a configured source")
+    # Never write alongside a running ingest; a push waits for it instead
+    with _single_flight(cfg).exclusive(timeout=_lock_timeout(cfg)):
+        store = DuckDBStore(DuckDBConfig(cfg["storage"]["duckdb_path"]))
+        try:
+            result = _apply_row_edit(store, sources, src, row_index, project_row(cells, src))
+            _sync_config(store, cfg, sources)
+            _publish(store, cfg)
+        finally:
+            # Do not hold the database file between pushes; the app opens it too
+            store.close()
+    # The cached full payload no longer matches DuckDB
+    RawResponseCache(cfg.get("ingest", {}).get("raw_cache_dir", "data/raw")).invalidate(spreadsheet_id, sheet_name)
+    return result
+
+
+def rebuild_from_staging() -> IngestResult:
+    """Re-derive every fact from the raw staging table with the current config.
+
+    No Google API call is made, so a change to ``columns`` (e.g. a role's
+    row window) only costs one SQL transform inside DuckDB.
+    """
+    cfg = load_config()
+
+    def rebuild() -> IngestResult:
+        store = DuckDBStore(DuckDBConfig(cfg["storage"]["duckdb_path"]))
+        sources = source_configs(cfg)
+        written = store.rebuild_facts_from_staging([staging_spec(src) for src in sources])
+        _record_config(store, alias_index(cfg), sources)
+        _publish(store, cfg)
+        return IngestResult(mode="rebuild", facts_written=written)
+
+    with _single_flight(cfg).exclusive(timeout=_lock_timeout(cfg)):
+        return _recorded_run(cfg, "rebuild", rebuild)
+
+
+_DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_duration(text: Any) -> float:
+    """Seconds in "90", "30s", "10m", "1h" or "1d"."""
+    value = str(text).strip().lower()
+    unit = _DURATION_UNITS.get(value[-1:]) if value else None
+    try:
+        seconds = float(value[:-1]) * unit if unit else float(value)
+    except ValueError:
+        raise ValueError(f"invalid duration {text!r}; expected e.g. 30s, 10m or 1h") from None
+    if seconds < 0:
+        raise ValueError("duration must be >= 0")
+    return seconds
+
+
+def next_delay(every: float, failures: int, jitter: float = 0.0,
+               backoff_initial: float = 30.0, backoff_max: float = 3600.0) -> float:
+    """Seconds until the next scheduled run.
+
+    After a success: ``every``. After ``failures`` consecutive failures:
+    ``backoff_initial`` doubled per extra failure, capped at ``backoff_max``.
+    Up to ``jitter`` seconds are added so several schedulers (or app workers)
+    do not hit the Sheets quota in lockstep.
+    """
+    if failures:
+        delay = min(backoff_max, backoff_initial * 2 ** (failures - 1))
+    else:
+        delay = every
+    return delay + random.uniform(0, jitter)
+
+
+def run_schedule(every: float, mode: Optional[str] = None, jitter: float = 0.0,
+                 backoff_initial: float = 30.0, backoff_max: float = 3600.0,
+                 max_runs: Optional[int] = None) -> None:
+    """Ingest every ``every`` seconds until interrupted.
+
+    Each run goes through ``run_ingest_once``: an unchanged sheet is skipped
+    without DuckDB writes, and a run already started by the app is joined
+    rather than repeated. Failures are retried with exponential backoff.
+    """
+    cfg = load_config()
+    failures = 0
+    runs = 0
+    while max_runs is None or runs < max_runs:
+        try:
+            result = run_ingest_once(mode)
+            failures = 0
+            logger.info("%s", result)
+        except Exception:
+            failures += 1
+            logger.exception("ingest failed (%dx)", failures)
+        runs += 1
+        if max_runs is not None and runs >= max_runs:
+            break
+        delay = next_delay(every, failures, jitter, backoff_initial, backoff_max)
+        try:
+            with _single_flight(cfg).exclusive(timeout=_lock_timeout(cfg)):
+                store = DuckDBStore(DuckDBConfig(cfg["storage"]["duckdb_path"]))
+                store.set_next_ingest_run(
+                    "ingest", datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(seconds=delay)
+                )
+                store.close()
+        except Exception:
+            logger.exception("could not record next run")
+        time.sleep(delay)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Ingest the roster sheet into DuckDB")
+    parser.add_argument("--mode", choices=INGEST_MODES, help="override ingest.mode from config.yaml")
+    parser.add_argument("--force", action="store_true", help="load even if the sheet is unchanged")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="re-derive facts from the staged raw rows without fetching")
+    parser.add_argument("--file", metavar="PATH",
+                        help="load a local CSV/XLSX/Parquet/Arrow export of the sheet instead of fetching it")
+    parser.add_argument("--first-row", type=int,
+                        help="sheet row number of the file's first row (default: 1 for CSV/XLSX, 2 for Parquet/Arrow)")
+    parser.add_argument("--export-lake", action="store_true",
+                        help="write the Parquet lake (storage.lake_dir) from DuckDB without fetching")
+    parser.add_argument("--profile", action="store_true",
+                        help="print a per-stage timing breakdown of the run")
+    parser.add_argument("--every", metavar="INTERVAL", nargs="?", const="",
+                        help="keep running, ingesting every INTERVAL (e.g. 10m; default ingest.schedule.every)")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    if args.every is not None:
+        schedule = load_config().get("ingest", {}).get("schedule", {})
+        try:
+            run_schedule(
+                parse_duration(args.every or schedule.get("every", "10m")),
+                mode=args.mode,
+                jitter=parse_duration(schedule.get("jitter", "30s")),
+                backoff_initial=parse_duration(schedule.get("backoff_initial", "30s")),
+                backoff_max=parse_duration(schedule.get("backoff_max", "1h")),
+            )
+        except KeyboardInterrupt:
+            pass
+        return
+    if args.export_lake:
+        print(f"{export_lake()} partitions written")
+        return
+    if args.rebuild:
+        result = rebuild_from_staging()
+    else:
+        sources = None
+        if args.file:
+            source = {"path": args.file}
+            if args.first_row is not None:
+                source["first_row"] = args.first_row
+            sources = [source]
+        result = run_ingest_once(args.mode, force=args.force, sources=sources)
+    print(result)
+    if args.profile and result.profile:
+        print(tracing.format_report(result.profile))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,39 @@
 from __future__ import annotations
 
-import yaml
+import threading
 import pandas as pd
-from pathlib import Path
-from typing import Optional
+from typing import Dict, Optional, Tuple
 
+from ingest.config import load_config
 from storage.duckdb_store import DuckDBStore, DuckDBConfig
 
 
 def _load_config() -> dict:
-    cfg_path = Path("configs/config.yaml")
-    with cfg_path.open("r", encoding="utf-8") as f:
-        return yaml.safe_load(f)
+    return load_config()
+
+
+_stores: Dict[Tuple[str, bool, Optional[str]], DuckDBStore] = {}
+_stores_lock = threading.Lock()
 
 
 def _get_store() -> DuckDBStore:
-    cfg = _load_config()
-    db_path = cfg.get("storage", {}).get("duckdb_path", "data/ministry.duckdb")
-    return DuckDBStore(DuckDBConfig(db_path=db_path))
+    """配置中数据库的进程内共享 store：一个 DuckDB 句柄，Streamlit 每个脚本线程各用一个游标
+    （见 storage.connections）；storage.query_lake 时改为只读查询 Parquet 湖。
+    句柄在查询间空闲 storage.idle_close_seconds 秒后关闭，不妨碍其他进程的摄取写入"""
+    storage = _load_config().get("storage", {})
+    lake_dir = storage.get("lake_dir") if storage.get("query_lake") else None
+    key = (storage.get("duckdb_path", "data/ministry.duckdb"), bool(storage.get("read_only", False)), lake_dir)
+    store = _stores.get(key)
+    if store is None:
+        with _stores_lock:
+            store = _stores.get(key)
+            if store is None:
+                store = _stores[key] = DuckDBStore(DuckDBConfig(
+                    db_path=key[0], read_only=key[1], lake_dir=lake_dir,
+                    result_cache_mb=float(storage.get("result_cache_mb", 64)),
+                    idle_close_seconds=float(storage.get("idle_close_seconds", 5)),
+                ))
+    return store
 
 
 def load_aggregations(granularity: str = "month") -> Optional[pd.DataFrame]:
@@ -295,12 +311,7 @@ def get_available_ministries() -> list[str]:
     """获取所有可用的事工类型列表"""
     store = _get_store()
     try:
-        sql = """
-        SELECT DISTINCT service_type_id 
-        FROM service_fact 
-        ORDER BY service_type_id
-        """
-        df = store.con.execute(sql).df()
+        df = store.query_distinct_service_types()
         return df['service_type_id'].tolist()
     except Exception:
         return []
@@ -319,82 +330,7 @@ def load_volunteer_ministry_flow_data(start_date: Optional[str] = None,
     """
     store = _get_store()
     try:
-        # 构建日期过滤条件
-        date_filter = ""
-        if start_date:
-            date_filter += f" AND f.service_date >= '{start_date}'"
-        if end_date:
-            date_filter += f" AND f.service_date <= '{end_date}'"
-        
-        # 构建同工过滤条件
-        volunteer_filter = ""
-        if selected_volunteers:
-            volunteer_list = "', '".join(selected_volunteers)
-            volunteer_filter = f" AND f.volunteer_id IN ('{volunteer_list}')"
-        
-        sql = f"""
-        WITH monthly_services AS (
-            -- 统计每个同工每月在各事工的参与情况
-            SELECT 
-                f.volunteer_id,
-                f.volunteer_id as volunteer_name,  -- 直接使用volunteer_id作为显示名称
-                DATE_TRUNC('month', f.service_date) as year_month,
-                f.service_type_id as ministry,
-                COUNT(*) as service_count
-            FROM service_fact f
-            WHERE 1=1 {date_filter} {volunteer_filter}
-            GROUP BY f.volunteer_id, DATE_TRUNC('month', f.service_date), f.service_type_id
-        ),
-        main_ministry AS (
-            -- 确定每个同工每月的主事工（参与次数最多的）
-            SELECT 
-                volunteer_id,
-                volunteer_name,
-                year_month,
-                ministry,
-                service_count,
-                ROW_NUMBER() OVER (
-                    PARTITION BY volunteer_id, year_month 
-                    ORDER BY service_count DESC, ministry
-                ) as rn
-            FROM monthly_services
-        ),
-        volunteer_monthly AS (
-            -- 获取每个同工每月的主事工
-            SELECT 
-                volunteer_id,
-                volunteer_name,
-                year_month,
-                ministry as main_ministry
-            FROM main_ministry
-            WHERE rn = 1
-        ),
-        flow_transitions AS (
-            -- 计算相邻月份间的转换
-            SELECT 
-                curr.volunteer_name,
-                STRFTIME(curr.year_month, '%Y-%m') as from_month,
-                STRFTIME(next.year_month, '%Y-%m') as to_month,
-                curr.main_ministry as from_ministry,
-                next.main_ministry as to_ministry,
-                1 as flow_intensity
-            FROM volunteer_monthly curr
-            JOIN volunteer_monthly next 
-                ON curr.volunteer_id = next.volunteer_id
-                AND next.year_month = DATE_TRUNC('month', curr.year_month + INTERVAL '1 month')
-        )
-        SELECT 
-            volunteer_name,
-            from_month,
-            to_month,
-            from_ministry,
-            to_ministry,
-            flow_intensity
-        FROM flow_transitions
-        ORDER BY volunteer_name, from_month
-        """
-        
-        df = store.con.execute(sql).df()
+        df = store.query_volunteer_ministry_flow(start_date, end_date, selected_volunteers)
         
         # 应用配置过滤
         cfg = _load_config()
@@ -411,6 +347,22 @@ def load_volunteer_ministry_flow_data(start_date: Optional[str] = None,
         return None
 
 
+def load_ingest_status() -> Optional[dict]:
+    """最近一次同步状态（时间已换算为配置时区）"""
+    store = _get_store()
+    try:
+        status = store.query_ingest_status("ingest")
+    except Exception:
+        return None
+    if status is None:
+        return None
+    tz = _load_config().get("timezone", "UTC")
+    for key in ("last_started_at", "last_success_at", "next_run_at"):
+        value = status.get(key)
+        status[key] = None if pd.isna(value) else pd.Timestamp(value).tz_localize("UTC").tz_convert(tz)
+    return status
+
+
 def load_data_time_range() -> Optional[dict]:
     """获取数据的时间范围信息"""
     store = _get_store()
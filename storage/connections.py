@@ -0,0 +1,281 @@
+from __future__ import annotations
+
+import atexit
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+import duckdb
+
+
+# 文件锁被其他进程持有时，打开数据库最多重试这么多秒
+LOCK_WAIT_SECONDS = 10.0
+# 只读句柄升级为读写前，最多等待其他线程用完游标这么多秒
+UPGRADE_WAIT_SECONDS = 30.0
+
+
+class _ThreadCursor:
+    __slots__ = ("thread", "cursor", "statements", "pinned")
+
+    def __init__(self, thread: threading.Thread, cursor: duckdb.DuckDBPyConnection) -> None:
+        self.thread = thread
+        self.cursor = cursor
+        # 该游标上已解析的语句，语句名 -> (SQL 文本, 语句)（见 DuckDBStore._execute），随游标一起失效
+        self.statements: Dict[str, Tuple[str, duckdb.Statement]] = {}
+        # 在租约之外取用过：无法得知何时用完，线程结束前句柄不会被空闲关闭或升级重开
+        self.pinned = False
+
+
+class _Database:
+    """一个数据库文件在本进程内唯一的 DuckDB 句柄，以及各线程从它派生的游标。
+
+    DuckDB 连接不能跨线程并发使用，游标（``handle.cursor()``）共享同一个数据库实例
+    与缓冲池，因此每个线程各取一个；线程结束后其游标在下次派生时回收。
+
+    句柄在首次取游标时打开。``lease`` 标记当前线程正在使用句柄：有其他线程在用时，
+    句柄不会被关闭（空闲关闭、``close`` 或只读升级读写都会等它们用完）。
+    设置了 ``idle_timeout`` 时，最后一个租约结束后句柄空闲这么多秒即关闭，释放文件锁，
+    让其他进程（定时摄取、推送服务等）可以写入；下次使用时重新打开。
+    """
+
+    def __init__(self, path: str, read_only: bool, in_memory: bool = False,
+                 on_open: Optional[Callable[[duckdb.DuckDBPyConnection], None]] = None) -> None:
+        self.path = path
+        self.read_only = read_only
+        self.in_memory = in_memory
+        self.on_open = on_open
+        self.idle_timeout: Optional[float] = None
+        self.lock_wait = LOCK_WAIT_SECONDS
+        self.handle: Optional[duckdb.DuckDBPyConnection] = None
+        self._cursors: Dict[int, _ThreadCursor] = {}
+        self._leases: Dict[int, int] = {}
+        self._cond = threading.Condition()
+        self._close_when_idle = False
+        self._timer: Optional[threading.Timer] = None
+
+    def _connect(self) -> duckdb.DuckDBPyConnection:
+        if self.in_memory:
+            return duckdb.connect()
+        deadline = time.monotonic() + self.lock_wait
+        while True:
+            try:
+                return duckdb.connect(self.path, read_only=self.read_only)
+            except duckdb.IOException as e:
+                # 其他进程正持有文件锁（如一次摄取），稍后重试
+                if "lock" not in str(e).lower() or time.monotonic() >= deadline:
+                    raise
+                time.sleep(0.1)
+
+    def _busy(self) -> bool:
+        """其他线程持有租约，或有存活线程在租约之外取用过游标"""
+        ident = threading.get_ident()
+        if any(owner != ident for owner in self._leases):
+            return True
+        return any(ident_ != ident and entry.pinned and entry.thread.is_alive()
+                   for ident_, entry in self._cursors.items())
+
+    def _close_handle(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        cursors = [entry.cursor for entry in self._cursors.values()]
+        self._cursors.clear()
+        for cur in cursors:
+            cur.close()
+        if self.handle is not None:
+            self.handle.close()
+            self.handle = None
+        self._close_when_idle = False
+        # 重开时按届时的使用者决定：写入方会再次要求读写（见 require_write）
+        self.read_only = True
+
+    def require_write(self) -> None:
+        """需要写入：已以只读方式打开时，等其他线程用完游标后关闭，下次使用时以读写方式重开"""
+        if not self.read_only:
+            return
+        with self._cond:
+            if not self.read_only:
+                return
+            if self.handle is not None:
+                if self._leases.get(threading.get_ident()):
+                    raise RuntimeError(f"{self.path} is open read-only in this thread; "
+                                       "cannot reopen it read-write until the read finishes")
+                if not self._cond.wait_for(lambda: not self._busy(), timeout=UPGRADE_WAIT_SECONDS):
+                    raise RuntimeError(f"{self.path} is open read-only and still in use by other threads; "
+                                       "set storage.read_only: false to write from this process")
+                self._close_handle()
+            self.read_only = False
+
+    def thread_cursor(self, read_only: bool = True) -> _ThreadCursor:
+        thread = threading.current_thread()
+        entry = self._cursors.get(thread.ident)
+        if entry is not None and entry.thread is thread and (read_only or not self.read_only):
+            if not entry.pinned and thread.ident not in self._leases:
+                entry.pinned = True
+            return entry
+        while True:
+            if not read_only:
+                self.require_write()
+            with self._cond:
+                if self.handle is not None and self.read_only and not read_only:
+                    # 其间被其他线程以只读方式重开
+                    continue
+                if self.handle is None:
+                    self.read_only = self.read_only and read_only
+                    handle = self._connect()
+                    if self.on_open is not None:
+                        try:
+                            self.on_open(handle)
+                        except BaseException:
+                            handle.close()
+                            raise
+                    self.handle = handle
+                for ident, owner in list(self._cursors.items()):
+                    if not owner.thread.is_alive():
+                        owner.cursor.close()
+                        del self._cursors[ident]
+                entry = self._cursors[thread.ident] = _ThreadCursor(thread, self.handle.cursor())
+                entry.pinned = thread.ident not in self._leases
+                return entry
+
+    def cursor(self, read_only: bool = True) -> duckdb.DuckDBPyConnection:
+        return self.thread_cursor(read_only).cursor
+
+    @contextmanager
+    def lease(self) -> Iterator["_Database"]:
+        """标记当前线程在此期间使用句柄（可嵌套）"""
+        ident = threading.get_ident()
+        with self._cond:
+            self._leases[ident] = self._leases.get(ident, 0) + 1
+        try:
+            yield self
+        finally:
+            with self._cond:
+                if self._leases[ident] > 1:
+                    self._leases[ident] -= 1
+                else:
+                    del self._leases[ident]
+                    self._cond.notify_all()
+                    self._after_use()
+
+    def _after_use(self) -> None:
+        # 调用方持有 self._cond
+        if self.handle is None:
+            return
+        if self._close_when_idle and not self._busy():
+            self._close_handle()
+        else:
+            self._schedule_idle_check()
+
+    def _schedule_idle_check(self) -> None:
+        delay = 0.5 if self._close_when_idle else self.idle_timeout
+        if delay is None:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(delay, self._idle_check)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _idle_check(self) -> None:
+        with self._cond:
+            self._timer = None
+            if self.handle is None or self._leases:
+                # 租约结束时会重新安排
+                return
+            if self._busy():
+                # 租约之外取用游标的线程还在：稍后再查
+                self._schedule_idle_check()
+                return
+            self._close_handle()
+
+    def release(self) -> None:
+        """关闭当前线程的游标"""
+        with self._cond:
+            entry = self._cursors.pop(threading.get_ident(), None)
+            if entry is not None:
+                entry.cursor.close()
+                self._cond.notify_all()
+
+    def close(self) -> None:
+        """关闭句柄；其他线程仍在使用时，推迟到它们用完为止"""
+        with self._cond:
+            if self.handle is None:
+                self.read_only = True
+                return
+            if not self._busy():
+                self._close_handle()
+                return
+            entry = self._cursors.pop(threading.get_ident(), None)
+            if entry is not None:
+                entry.cursor.close()
+            self._close_when_idle = True
+            self._schedule_idle_check()
+
+
+_databases: Dict[str, _Database] = {}
+_lock = threading.Lock()
+
+
+def database(db_path: str, read_only: bool = False, in_memory: bool = False,
+             on_open: Optional[Callable[[duckdb.DuckDBPyConnection], None]] = None,
+             idle_timeout: Optional[float] = None,
+             lock_wait: Optional[float] = None) -> _Database:
+    """``db_path`` 在本进程内的共享句柄（首次取游标时打开）。
+
+    同一文件在一个进程内只能以一种配置打开：已有读写句柄时只读请求直接复用它；
+    已有只读句柄而需要写入时，等其他线程用完游标后以读写方式重开（见 ``_Database.require_write``）。
+    只读句柄允许多个进程同时读取，但与其他进程的写入互斥。
+    ``in_memory`` 时不打开文件，而是在 ``db_path``（如 Parquet 湖目录）名下共享一个内存库；
+    ``on_open`` 在每次打开句柄后调用一次（如为内存库建视图），出错时句柄不保留，下次使用时重试。
+    ``idle_timeout``、``lock_wait`` 为 None 时沿用已有设置。
+    """
+    path = os.path.abspath(db_path)
+    db = _databases.get(path)
+    if db is None:
+        with _lock:
+            db = _databases.get(path)
+            if db is None:
+                db = _databases[path] = _Database(path, read_only, in_memory, on_open)
+    if idle_timeout is not None:
+        db.idle_timeout = idle_timeout
+    if lock_wait is not None:
+        db.lock_wait = lock_wait
+    if not read_only:
+        db.require_write()
+    return db
+
+
+def cursor(db_path: str, read_only: bool = False, **kwargs) -> duckdb.DuckDBPyConnection:
+    """当前线程在 ``db_path`` 上的游标（其余参数同 ``database``）"""
+    return database(db_path, read_only, **kwargs).cursor(read_only)
+
+
+def statements(db_path: str, read_only: bool = False, **kwargs) -> Dict[str, Tuple[str, duckdb.Statement]]:
+    """当前线程游标上已解析语句的缓存（语句名 -> (SQL 文本, duckdb.Statement)）"""
+    return database(db_path, read_only, **kwargs).thread_cursor(read_only).statements
+
+
+@contextmanager
+def session(db_path: str, read_only: bool = False, **kwargs) -> Iterator[_Database]:
+    """在 ``db_path`` 的共享句柄上持有租约（其余参数同 ``database``）"""
+    with database(db_path, read_only, **kwargs).lease() as db:
+        yield db
+
+
+def close(db_path: Optional[str] = None) -> None:
+    """关闭 ``db_path``（缺省为全部）的共享句柄并释放文件锁；其他线程仍在使用时推迟到它们用完。
+    之后的使用会重新打开"""
+    with _lock:
+        if db_path is None:
+            closing = list(_databases.values())
+        else:
+            db = _databases.get(os.path.abspath(db_path))
+            closing = [db] if db is not None else []
+    for db in closing:
+        db.close()
+
+
+atexit.register(close)
@@ -1,18 +1,125 @@
 from __future__ import annotations
 
+import functools
+import inspect
 import os
 import threading
+import uuid
+from contextlib import contextmanager
 from dataclasses import dataclass
-from typing import Iterable, List, Dict, Any, Optional
+from datetime import date, datetime
+from pathlib import Path
+from typing import Iterable, Iterator, List, Dict, Any, Optional, Sequence, Tuple, Union
 
 import duckdb
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from ingest.names import match_key
+from ingest.tracing import current_run_id, traced
+from storage import connections
+from storage.result_cache import ResultCache
 
 
 @dataclass
 class DuckDBConfig:
     db_path: str
+    # 只读打开：允许多个进程同时读取，但不建表、不迁移，也不能写入
+    read_only: bool = False
+    # 设置时改为只读查询该目录下的 Parquet 湖（见 export_lake），不打开 db_path，也不持有文件锁；
+    # 湖中没有改动日志与摄取状态表，相应查询不可用
+    lake_dir: Optional[str] = None
+    # 查询结果缓存的内存预算（进程内按数据库文件共享，以首个 store 的设置为准），0 为不缓存
+    result_cache_mb: float = 64
+    # 设置时，共享句柄在没有查询使用后空闲这么多秒即关闭并释放文件锁（下次查询时重开），
+    # 使其他进程的摄取可以写入；None 为一直保持到 close()
+    idle_close_seconds: Optional[float] = None
+
+
+# 写入接口接受的批数据：pandas DataFrame 或 Arrow 表 / 记录批 / 记录批流（按零拷贝扫描）
+Frame = Union[pd.DataFrame, pa.Table, pa.RecordBatch, pa.RecordBatchReader]
+
+
+def _is_empty(data: Optional[Frame]) -> bool:
+    # RecordBatchReader 无法预知行数，按非空处理
+    return data is None or (hasattr(data, "__len__") and len(data) == 0)
+
+
+# 由 service_date 在写入时一次算好的周期键与标签，查询按它们分组而不再关联 date_dim：
+# 键为整数（季 = 年*10+季，月 = 年*100+月，周 = 年*100+ISO 周），标签与原先的字符串格式一致
+_PERIOD_COLUMNS = {
+    "year": ("INTEGER", "year({d})"),
+    "quarter_key": ("INTEGER", "year({d}) * 10 + quarter({d})"),
+    "month_key": ("INTEGER", "year({d}) * 100 + month({d})"),
+    "week_key": ("INTEGER", "year({d}) * 100 + week({d})"),
+    "quarter_label": ("VARCHAR", "year({d}) || '-Q' || quarter({d})"),
+    "month_label": ("VARCHAR", "strftime({d}, '%Y-%m')"),
+    "week_label": ("VARCHAR", "strftime({d}, '%Y-W%V')"),
+}
+
+
+def _period_values(date: str) -> str:
+    """按 _PERIOD_COLUMNS 顺序由日期表达式 date 计算周期列的 SELECT 片段"""
+    return ", ".join(expr.format(d=date) for _, expr in _PERIOD_COLUMNS.values())
+
+
+# service_fact 与其影子表共用的列定义
+_FACT_COLUMNS = {
+    "fact_id": "VARCHAR",
+    "volunteer_id": "VARCHAR",
+    "service_type_id": "VARCHAR",
+    "service_date": "DATE",
+    "source_row_id": "VARCHAR",
+    "ingested_at": "TIMESTAMP",
+    **{name: sql_type for name, (sql_type, _) in _PERIOD_COLUMNS.items()},
+}
+
+_SERVICE_FACT_COLUMNS = ",\n".join(
+    f"  {name} {sql_type}" + (" PRIMARY KEY" if name == "fact_id" else "") for name, sql_type in _FACT_COLUMNS.items()
+)
+
+# source_row、raw_sheet_row 与各自影子表共用的列定义
+_SOURCE_ROW_COLUMNS = """
+  source_row_id VARCHAR PRIMARY KEY,
+  spreadsheet_id VARCHAR,
+  sheet_name VARCHAR,
+  row_index INTEGER,
+  row_checksum VARCHAR
+"""
+
+_RAW_SHEET_ROW_COLUMNS = """
+  spreadsheet_id VARCHAR,
+  sheet_name VARCHAR,
+  row_index INTEGER,
+  cells JSON,
+  row_checksum VARCHAR
+"""
 
+# 各统计粒度的分组表达式：(整数键, 周期标签)，见 time_bucket
+_TIME_BUCKETS = {
+    "year": ("{f}.year", "CAST({f}.year AS VARCHAR)"),
+    "quarter": ("{f}.quarter_key", "{f}.quarter_label"),
+    "month": ("{f}.month_key", "{f}.month_label"),
+    "week": ("{f}.week_key", "{f}.week_label"),
+}
+
+
+def time_bucket(granularity: str, allowed: Iterable[str] = ("year", "quarter", "month", "week"),
+                alias: str = "f", key: bool = False) -> str:
+    """
+    service_fact 按统计粒度分组的表达式
+
+    参数:
+    - granularity: year | quarter | month | week（须在 allowed 中）
+    - alias: service_fact 在查询中的别名
+    - key: 为 True 时返回可排序的整数键，否则返回周期标签（如 2024-Q1、2024-03、2024-W05）
+    """
+    allowed = [g for g in _TIME_BUCKETS if g in set(allowed)]
+    if granularity not in allowed:
+        raise ValueError(f"granularity must be one of {'|'.join(allowed)}")
+    return _TIME_BUCKETS[granularity][0 if key else 1].format(f=alias)
 
 SCHEMA_SQL = """
 CREATE TABLE IF NOT EXISTS volunteer (
@@ -39,35 +146,496 @@ CREATE TABLE IF NOT EXISTS date_dim (
   month INTEGER
 );
 
-CREATE TABLE IF NOT EXISTS source_row (
-  source_row_id VARCHAR PRIMARY KEY,
-  spreadsheet_id VARCHAR,
-  sheet_name VARCHAR,
-  row_index INTEGER,
-  row_checksum VARCHAR
+CREATE TABLE IF NOT EXISTS source_row ({source_row_columns});
+
+CREATE TABLE IF NOT EXISTS service_fact ({service_fact_columns});
+
+-- 原始单元格暂存：每个非空行一条 JSON 数组，可在不访问 Google 的情况下重建事实
+CREATE TABLE IF NOT EXISTS raw_sheet_row ({raw_sheet_row_columns});
+
+-- 每个摄取任务最近一次运行的状态，供界面低成本读取
+CREATE TABLE IF NOT EXISTS ingest_status (
+  job VARCHAR PRIMARY KEY,
+  last_started_at TIMESTAMP,
+  last_success_at TIMESTAMP,
+  last_duration_seconds DOUBLE,
+  last_skipped BOOLEAN,
+  last_error VARCHAR,
+  consecutive_failures INTEGER,
+  next_run_at TIMESTAMP
+);
+
+-- 每次摄取运行的分阶段耗时（stages 为 ingest.tracing.Trace.stages() 的 JSON）
+CREATE TABLE IF NOT EXISTS ingest_run (
+  run_id VARCHAR PRIMARY KEY,
+  job VARCHAR,
+  started_at TIMESTAMP,
+  finished_at TIMESTAMP,
+  wall_seconds DOUBLE,
+  error VARCHAR,
+  result JSON,
+  stages JSON
+);
+
+-- 事实数据版本：每次改动 service_fact 的提交递增一次（无实际改动时不递增）
+CREATE TABLE IF NOT EXISTS data_version (
+  version BIGINT PRIMARY KEY,
+  run_id VARCHAR,
+  recorded_at TIMESTAMP,
+  facts_added INTEGER,
+  facts_removed INTEGER,
+  facts_modified INTEGER
 );
 
-CREATE TABLE IF NOT EXISTS service_fact (
-  fact_id VARCHAR PRIMARY KEY,
+-- 各数据版本中新增 / 删除 / 修改的事实（change 为 added、removed 或 modified）
+CREATE TABLE IF NOT EXISTS fact_change (
+  version BIGINT,
+  change VARCHAR,
+  fact_id VARCHAR,
+  service_date DATE,
+  volunteer_id VARCHAR,
+  service_type_id VARCHAR
+);
+
+-- 事实按 (周, 月, 同工, 服事类型) 的计数汇总；周可能跨月，因此以周在某月内的片段为最小粒度，
+-- 月 / 季 / 年由其上卷。由 refresh_fact_rollup 按数据版本增量维护
+CREATE TABLE IF NOT EXISTS fact_rollup (
+  week_key INTEGER,
+  week_label VARCHAR,
+  month_key INTEGER,
+  month_label VARCHAR,
+  quarter_key INTEGER,
+  quarter_label VARCHAR,
+  year INTEGER,
   volunteer_id VARCHAR,
   service_type_id VARCHAR,
-  service_date DATE,
-  source_row_id VARCHAR,
-  ingested_at TIMESTAMP
+  service_count BIGINT,
+  min_service_date DATE,
+  max_service_date DATE
+);
+
+-- 摄取过程的少量键值状态（如上次使用的姓名索引指纹）
+CREATE TABLE IF NOT EXISTS ingest_meta (
+  key VARCHAR PRIMARY KEY,
+  value VARCHAR
 );
+""".replace("{service_fact_columns}", _SERVICE_FACT_COLUMNS).replace(
+    "{source_row_columns}", _SOURCE_ROW_COLUMNS).replace("{raw_sheet_row_columns}", _RAW_SHEET_ROW_COLUMNS)
+
+
+# 全量加载先写入的影子表（事实、行校验和、暂存行），校验通过后在一个事务内一起替换正式表
+SHADOW_FACT_TABLE = "service_fact_next"
+SHADOW_SOURCE_ROW_TABLE = "source_row_next"
+SHADOW_RAW_ROW_TABLE = "raw_sheet_row_next"
+_SNAPSHOT_TABLES = {
+    "service_fact": (SHADOW_FACT_TABLE, _SERVICE_FACT_COLUMNS),
+    "source_row": (SHADOW_SOURCE_ROW_TABLE, _SOURCE_ROW_COLUMNS),
+    "raw_sheet_row": (SHADOW_RAW_ROW_TABLE, _RAW_SHEET_ROW_COLUMNS),
+}
+
+# 同一 service_date / volunteer_id / service_type_id 只保留 source_row_id 最小的一条；
+# {scope} 为限定检查范围的 WHERE 子句（为空时检查全表），{table} 为事实表
+_DEDUPE_FACTS_SQL = """
+DELETE FROM {table} WHERE fact_id IN (
+    SELECT fact_id FROM (
+        SELECT
+            f.fact_id,
+            ROW_NUMBER() OVER (
+                PARTITION BY f.service_date, f.volunteer_id, f.service_type_id
+                ORDER BY f.source_row_id
+            ) AS rn
+        FROM {table} f
+        {scope}
+    ) WHERE rn > 1
+)
+"""
+
+
+# 新旧两个事实集合（SQL 关系，至少含 fact_id、volunteer_id、service_type_id、
+# service_date、source_row_id）按 fact_id 对比得到的差异，参数: 版本号
+_FACT_DIFF_SQL = """
+INSERT INTO fact_change
+SELECT
+    $1,
+    CASE WHEN o.fact_id IS NULL THEN 'added' WHEN n.fact_id IS NULL THEN 'removed' ELSE 'modified' END,
+    COALESCE(n.fact_id, o.fact_id),
+    COALESCE(n.service_date, o.service_date),
+    COALESCE(n.volunteer_id, o.volunteer_id),
+    COALESCE(n.service_type_id, o.service_type_id)
+FROM {old} o
+FULL OUTER JOIN {new} n ON o.fact_id = n.fact_id
+WHERE o.fact_id IS NULL OR n.fact_id IS NULL
+   OR (o.volunteer_id, o.service_type_id, o.service_date, o.source_row_id)
+      IS DISTINCT FROM (n.volunteer_id, n.service_type_id, n.service_date, n.source_row_id)
+"""
+
+# query_changes_since 可按其汇总的维度
+_CHANGE_DIMENSIONS = {
+    "date": "service_date",
+    "month": "DATE_TRUNC('month', service_date)",
+    "volunteer": "volunteer_id",
+    "service_type": "service_type_id",
+}
+
+
+# 由事实表重算 fact_rollup 的分组；{scope} 为限定片段的 WHERE 子句
+_ROLLUP_FACTS_SQL = """
+INSERT INTO fact_rollup
+SELECT week_key, week_label, month_key, month_label, quarter_key, quarter_label, year,
+       volunteer_id, service_type_id, COUNT(*), MIN(service_date), MAX(service_date)
+FROM service_fact f
+{scope}
+GROUP BY ALL
+"""
+
+# 可选日期区间（参数 $1 起始、$2 截止，None 为不限），供以绑定参数执行的查询共用。
+# 单独的 month_key 条件让 Parquet 湖模式只读取区间内的月份分区
+_DATE_RANGE_FILTER = """
+    ($1 IS NULL OR f.month_key >= year(CAST($1 AS DATE)) * 100 + month(CAST($1 AS DATE)))
+    AND ($1 IS NULL OR f.service_date >= CAST($1 AS DATE))
+    AND ($2 IS NULL OR f.month_key <= year(CAST($2 AS DATE)) * 100 + month(CAST($2 AS DATE)))
+    AND ($2 IS NULL OR f.service_date <= CAST($2 AS DATE))
+"""
+
+# Parquet 湖：service_fact 按 year=/month= 分区（lake/service_fact/year=2024/month=3/data.parquet），
+# 以下各表整表一个文件；data_version 最后写入，其最大版本即湖中数据的版本
+_LAKE_TABLES = ("volunteer", "volunteer_alias", "service_type", "fact_rollup", "data_version")
+_LAKE_FILE = "data.parquet"
+
+# 分区列 year / month 只在路径里，文件中不重复存 year 与 month_key；
+# 湖模式的视图由路径还原这两列，因此按 month_key 过滤即可裁剪分区
+_LAKE_FACT_FILE_COLUMNS = [name for name in _FACT_COLUMNS if name not in ("year", "month_key")]
+
+
+def _sql_literal(text: str) -> str:
+    return "'" + text.replace("'", "''") + "'"
+
+
+def _write_parquet(table: pa.Table, path: Path) -> None:
+    # 先写临时文件再替换，读者（按 *.parquet 匹配）不会读到写了一半的文件
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    pq.write_table(table, tmp)
+    os.replace(tmp, path)
+
+
+def _lake_partitions(lake: Path) -> set:
+    """湖中现有的 (year, month) 分区"""
+    partitions = set()
+    for path in (lake / "service_fact").glob(f"year=*/month=*/{_LAKE_FILE}"):
+        partitions.add((int(path.parent.parent.name[5:]), int(path.parent.name[6:])))
+    return partitions
+
+
+def _lake_version(lake: Path) -> Optional[int]:
+    """湖中数据的版本；没有完整导出过时为 None"""
+    path = lake / "data_version" / _LAKE_FILE
+    if not path.exists():
+        return None
+    versions = pq.read_table(path, columns=["version"]).column("version")
+    return int(pc.max(versions).as_py() or 0)
+
+
+def _open_lake(lake_dir: str, con: duckdb.DuckDBPyConnection) -> None:
+    """在内存库中为 Parquet 湖建与 DuckDB 库同名同列的视图"""
+    lake = Path(lake_dir).resolve()
+    if _lake_version(lake) is None:
+        raise FileNotFoundError(f"no Parquet lake at {lake} (export one with DuckDBStore.export_lake)")
+    if not _lake_partitions(lake):
+        # 视图中的 glob 在每次查询时展开，但匹配不到任何文件时无法建视图；
+        # 失败的打开不会保留句柄，导出了事实之后的下一次查询会重新打开
+        raise FileNotFoundError(f"Parquet lake at {lake} has no service_fact partitions yet")
+    for name in _LAKE_TABLES:
+        con.execute(f"CREATE VIEW {name} AS SELECT * FROM read_parquet({_sql_literal(str(lake / name / _LAKE_FILE))})")
+    columns = ", ".join(
+        "CAST(year AS INTEGER) AS year" if name == "year"
+        else "CAST(year * 100 + month AS INTEGER) AS month_key" if name == "month_key"
+        else name
+        for name in _FACT_COLUMNS
+    )
+    source = (f"read_parquet({_sql_literal(str(lake / 'service_fact' / '*' / '*' / '*.parquet'))}, "
+              "hive_partitioning = true, hive_types = {'year': INTEGER, 'month': INTEGER})")
+    con.execute(f"CREATE VIEW service_fact AS SELECT {columns} FROM {source}")
+
+# 截至今天的汇总：最晚日期不晚于今天的分组直接取用，跨越今天的分组由事实表按日期重算，
+# 与原先直接查询事实表时 service_date <= CURRENT_DATE 的结果一致
+_ROLLUP_TO_DATE_CTE = """
+rollup AS (
+    SELECT week_key, week_label, month_key, month_label, quarter_key, quarter_label, year,
+           volunteer_id, service_type_id, service_count
+    FROM fact_rollup
+    WHERE max_service_date <= CURRENT_DATE
+    UNION ALL
+    SELECT f.week_key, f.week_label, f.month_key, f.month_label, f.quarter_key, f.quarter_label, f.year,
+           f.volunteer_id, f.service_type_id, COUNT(*)
+    FROM service_fact f
+    JOIN fact_rollup r USING (week_key, month_key, volunteer_id, service_type_id)
+    WHERE r.min_service_date <= CURRENT_DATE AND r.max_service_date > CURRENT_DATE
+      AND f.service_date <= CURRENT_DATE
+    GROUP BY ALL
+)
+"""
+
+
+def _snapshot_table(table: str, base: str) -> str:
+    # 表名会拼入 SQL，只允许正式表 base 及其影子表
+    if table not in (base, _SNAPSHOT_TABLES[base][0]):
+        raise ValueError(f"not a {base} table: {table!r}")
+    return table
+
+
+def _fact_table(table: str) -> str:
+    return _snapshot_table(table, "service_fact")
+
+
+# 由暂存行解析单个数据源各行的服事日期（与 ingest.transform.parse_dates 一致）：
+# 日期列为序列号时按 1899-12-30 起算；文本日期的不同取值很少，由 Python 的 parse_dates
+# 逐个解析一次后以 staging_dates（date_text -> service_date）传入，见 DuckDBStore._staged_dates。
+# 参数: spreadsheet_id, sheet_name；日期列序号以常量路径填入 {date_index}
+# （参数化的 JSON 路径无法预编译，慢一个数量级）
+_STAGED_DATES_CTE = """
+WITH raw_cells AS (
+    -- 每行 JSON 只解析一次：日期单元格保留类型，其余单元格转为文本列表
+    SELECT
+        row_index,
+        row_checksum,
+        json_type(cells -> '$[{date_index}]') AS date_type,
+        cells -> '$[{date_index}]' AS date_cell,
+        cells ->> '$[{date_index}]' AS date_text,
+        json_extract_string(cells, '$[*]') AS texts
+    FROM raw_sheet_row
+    WHERE spreadsheet_id = $1 AND sheet_name = $2
+),
+dated AS (
+    SELECT
+        $1 || ':' || $2 || ':' || row_index || ':' || row_checksum AS source_row_id,
+        $1 AS spreadsheet_id,
+        $2 AS sheet_name,
+        row_index,
+        row_checksum,
+        CASE
+            WHEN date_type IN ('UBIGINT', 'BIGINT', 'DOUBLE') THEN
+                CASE WHEN CAST(date_cell AS DOUBLE) BETWEEN 0 AND 106751
+                     THEN DATE '1899-12-30' + CAST(floor(CAST(date_cell AS DOUBLE)) AS INTEGER) END
+            WHEN date_type = 'VARCHAR' THEN CAST(t.service_date AS DATE)
+        END AS service_date,
+        texts
+    FROM raw_cells
+    LEFT JOIN staging_dates t ON date_type = 'VARCHAR' AND t.date_text = raw_cells.date_text
+)
+"""
+
+# 日期列中各不相同的文本取值。参数: spreadsheet_id, sheet_name
+_STAGED_DATE_TEXTS_SQL = """
+SELECT DISTINCT cells ->> '$[{date_index}]'
+FROM raw_sheet_row
+WHERE spreadsheet_id = $1 AND sheet_name = $2 AND json_type(cells -> '$[{date_index}]') = 'VARCHAR'
+"""
+
+# 带日期的行，列与临时表 staged_rows 一致
+_STAGED_ROWS_SQL = _STAGED_DATES_CTE + """
+SELECT source_row_id, spreadsheet_id, sheet_name, row_index, row_checksum, service_date, texts
+FROM dated
+-- pandas datetime64[ns] 可表示的日期范围，超出的行在 Python 转换中同样视为无日期
+WHERE service_date BETWEEN DATE '1677-09-22' AND DATE '2262-04-11'
+"""
+
+# 服事日期属于 $3 的暂存行
+_STAGED_ROWS_ON_DATES_SQL = _STAGED_DATES_CTE + """
+SELECT r.row_index, r.cells
+FROM raw_sheet_row r
+JOIN dated d USING (row_index)
+WHERE r.spreadsheet_id = $1 AND r.sheet_name = $2 AND list_contains($3, d.service_date)
+ORDER BY r.row_index
 """
 
+# 带日期的行按角色展开后的候选单元格。参数: spreadsheet_id, sheet_name
+_STAGED_HITS_CTE = """
+WITH hits AS (
+    SELECT
+        d.row_index,
+        d.service_date,
+        d.source_row_id,
+        r.role_order,
+        r.column_index,
+        r.service_type,
+        COALESCE(d.texts[r.column_index + 1], '') AS raw_name
+    FROM staged_rows d
+    JOIN staging_roles r
+      ON (r.valid_from_row IS NULL OR d.row_index >= r.valid_from_row)
+     AND (r.valid_until_row IS NULL OR d.row_index <= r.valid_until_row)
+    WHERE d.spreadsheet_id = $1 AND d.sheet_name = $2
+)
+"""
+
+# 姓名单元格的不同取值很少，交给 Python（ingest.names）逐个归一一次
+_STAGED_NAMES_SQL = _STAGED_HITS_CTE + "SELECT DISTINCT raw_name FROM hits"
+
+# 候选单元格展开为事实（与 ingest.transform.rows_to_facts 等价）：
+# 每个单元格只归属第一个匹配（非空且行号窗口内）的角色；staging_names 为
+# raw_name -> volunteer_id 的映射。参数: spreadsheet_id, sheet_name, fact_id 后缀
+_STAGED_FACTS_SQL = _STAGED_HITS_CTE + """,
+claimed AS (
+    SELECT h.*, n.volunteer_id,
+           ROW_NUMBER() OVER (PARTITION BY h.row_index, h.column_index ORDER BY h.role_order) AS claim
+    FROM hits h
+    JOIN staging_names n USING (raw_name)
+    WHERE n.volunteer_id <> ''
+)
+SELECT
+    strftime(service_date, '%Y-%m-%d') || ' 00:00:00:' || service_type || ':' || volunteer_id || ':'
+        || row_index || $3 AS fact_id,
+    volunteer_id,
+    service_type AS service_type_id,
+    service_date,
+    source_row_id
+FROM claimed
+WHERE claim = 1
+"""
+
+
+_result_caches: Dict[str, ResultCache] = {}
+_result_caches_lock = threading.Lock()
+
+
+def _cache_param(value: Any) -> Any:
+    if isinstance(value, (list, tuple, set, frozenset)):
+        items = sorted(value, key=repr) if isinstance(value, (set, frozenset)) else value
+        return tuple(_cache_param(v) for v in items)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _cache_param(v)) for k, v in value.items()))
+    return value
+
+
+def cached_result(fn):
+    """按 (方法, 规范化参数, 数据版本, 当天日期) 缓存查询结果，返回副本。
+
+    数据版本随每次改动事实的写入递增，写入后旧结果自然失效；查询大多以 CURRENT_DATE 截止，
+    因此日期也是键的一部分。事务中的调用（可能读到未提交数据）不走缓存。
+    """
+    signature = inspect.signature(fn)
+
+    @functools.wraps(fn)
+    def wrapper(self: "DuckDBStore", *args, **kwargs):
+        with self.session():
+            return lookup(self, *args, **kwargs)
+
+    def lookup(self: "DuckDBStore", *args, **kwargs):
+        cache = self._result_cache
+        if cache is None or self._tx_depth:
+            return fn(self, *args, **kwargs)
+        bound = signature.bind(self, *args, **kwargs)
+        bound.apply_defaults()
+        params = tuple(_cache_param(v) for v in list(bound.arguments.values())[1:])
+        key = (fn.__name__, params, self._cached_data_version(cache), date.today())
+        try:
+            hit, result = cache.get(key)
+        except TypeError:
+            # 参数不可哈希
+            return fn(self, *args, **kwargs)
+        if hit:
+            return result
+        result = fn(self, *args, **kwargs)
+        cache.put(key, result)
+        return result
+
+    return wrapper
+
 
 class DuckDBStore:
     # Class-level lock to prevent concurrent schema initialization
     _schema_lock = threading.Lock()
     _initialized_dbs = set()
     
+    @traced("store.open")
     def __init__(self, cfg: DuckDBConfig) -> None:
-        os.makedirs(os.path.dirname(cfg.db_path), exist_ok=True)
         self.cfg = cfg
-        self.con = duckdb.connect(cfg.db_path)
-        self._init_schema()
+        self._local = threading.local()
+        if cfg.lake_dir:
+            # 湖模式：视图建在以湖目录为键的共享内存库上
+            self._conn = dict(db_path=cfg.lake_dir, read_only=True, in_memory=True,
+                              on_open=functools.partial(_open_lake, cfg.lake_dir))
+            self._db_path = os.path.abspath(cfg.lake_dir)
+            self._version_files = (os.path.join(self._db_path, "data_version", _LAKE_FILE),)
+        else:
+            if not cfg.read_only:
+                os.makedirs(os.path.dirname(cfg.db_path), exist_ok=True)
+            self._conn = dict(db_path=cfg.db_path, read_only=cfg.read_only,
+                              idle_timeout=cfg.idle_close_seconds)
+            self._db_path = os.path.abspath(cfg.db_path)
+            self._version_files = (self._db_path, self._db_path + ".wal")
+        # 进程内的共享句柄，首次使用时打开
+        connections.database(**self._conn)
+        self._result_cache: Optional[ResultCache] = None
+        if cfg.result_cache_mb > 0:
+            with _result_caches_lock:
+                self._result_cache = _result_caches.setdefault(
+                    self._db_path, ResultCache(int(cfg.result_cache_mb * 1024 * 1024))
+                )
+        if not self._conn["read_only"]:
+            with self.session():
+                self._init_schema()
+
+    @property
+    def con(self) -> duckdb.DuckDBPyConnection:
+        """当前线程在共享句柄上的游标（见 storage.connections）；同一线程的所有 store 共用它。
+        在 ``session`` 之外取用时，本线程结束前句柄不会被空闲关闭"""
+        return connections.cursor(**self._conn)
+
+    @contextmanager
+    def session(self) -> Iterator["DuckDBStore"]:
+        """在此期间占用共享句柄：其他线程不会关闭它或将其重开为读写（见 storage.connections）"""
+        with connections.session(**self._conn):
+            yield self
+
+    @property
+    def _tx_depth(self) -> int:
+        return getattr(self._local, "tx_depth", 0)
+
+    @_tx_depth.setter
+    def _tx_depth(self, depth: int) -> None:
+        self._local.tx_depth = depth
+
+    def _cached_data_version(self, cache: ResultCache) -> int:
+        """当前数据版本。数据库文件及其 WAL（湖模式为湖中的 data_version 文件）的大小和修改时间
+        没变时沿用上次查到的版本，不访问 DuckDB；变了（本进程或其他进程提交了写入）才重新查询，
+        版本变化时清空旧结果"""
+        signature = []
+        for path in self._version_files:
+            try:
+                st = os.stat(path)
+                signature.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                signature.append(None)
+        signature = tuple(signature)
+        if signature != cache.signature or cache.version is None:
+            version = self.data_version()
+            if version != cache.version:
+                cache.clear()
+                cache.version = version
+            cache.signature = signature
+        return cache.version
+
+    def _execute(self, name: str, sql: str, params: Sequence[Any] = ()) -> duckdb.DuckDBPyConnection:
+        """以绑定参数执行一条固定文本的语句。语句按调用处给定的名字在每个游标上只解析一次，
+        之后的调用省去 SQL 解析，但每次执行仍会重新绑定与规划（DuckDB Python API 不保留
+        跨调用的预编译语句）；缓存按名字存放，条目数以调用处的数量为界。
+        日期、周数、策略、同工名单等取值一律作为参数传入，不拼进 SQL；
+        同名语句的文本若有变化则重新解析并替换，不会累积"""
+        statements = connections.statements(**self._conn)
+        cached = statements.get(name)
+        if cached is None or cached[0] != sql:
+            cached = statements[name] = (sql, self.con.extract_statements(sql)[0])
+        return self.con.execute(cached[1], list(params))
+
+    def cache_stats(self) -> Dict[str, int]:
+        """查询结果缓存的条目数、字节数与命中 / 未命中 / 淘汰计数"""
+        return self._result_cache.stats() if self._result_cache is not None else {}
+
+    def close(self) -> None:
+        """关闭本进程对该数据库文件的共享句柄并释放文件锁（其他线程仍在使用时推迟到它们用完；
+        其他 store 下次使用时自动重开）"""
+        connections.close(self._conn["db_path"])
 
     def _init_schema(self) -> None:
         # Use class-level lock to prevent concurrent schema initialization
@@ -83,17 +651,23 @@ class DuckDBStore:
                 # Check if tables already exist to avoid unnecessary operations
                 tables_exist = self.con.execute("""
                     SELECT COUNT(*) as count FROM information_schema.tables 
-                    WHERE table_name IN ('volunteer', 'volunteer_alias', 'service_type', 'date_dim', 'source_row', 'service_fact')
+                    WHERE table_name IN ('volunteer', 'volunteer_alias', 'service_type', 'date_dim', 'source_row', 'service_fact',
+                                         'raw_sheet_row', 'ingest_status', 'ingest_run', 'ingest_meta',
+                                         'data_version', 'fact_change', 'fact_rollup')
                 """).fetchone()[0]
                 
                 # Only create tables if they don't all exist
-                if tables_exist < 6:
+                if tables_exist < 13:
                     # Split SCHEMA_SQL into individual statements to avoid conflicts
                     statements = [stmt.strip() for stmt in SCHEMA_SQL.split(';') if stmt.strip()]
                     for statement in statements:
                         if statement:
                             self.con.execute(statement)
+                self._add_period_columns()
                 self.con.commit()
+                # 升级前的库还没有汇总表内容
+                if self.get_meta("rollup_version") is None:
+                    self.refresh_fact_rollup()
                 # Mark this database as initialized
                 self._initialized_dbs.add(db_path)
             except Exception as e:
@@ -112,60 +686,842 @@ class DuckDBStore:
                     # If tables don't exist, re-raise the original error
                     raise e
 
+    def _add_period_columns(self) -> None:
+        """为旧库的 service_fact 补上周期列并回填"""
+        existing = {r[0] for r in self.con.execute(
+            "SELECT column_name FROM information_schema.columns WHERE table_name = 'service_fact'"
+        ).fetchall()}
+        missing = [name for name in _PERIOD_COLUMNS if name not in existing]
+        if not missing:
+            return
+        for name in missing:
+            self.con.execute(f"ALTER TABLE service_fact ADD COLUMN {name} {_PERIOD_COLUMNS[name][0]}")
+        self.con.execute(
+            "UPDATE service_fact SET "
+            + ", ".join(f"{name} = {expr.format(d='service_date')}" for name, (_, expr) in _PERIOD_COLUMNS.items())
+        )
+
+    @contextmanager
+    def transaction(self) -> Iterator["DuckDBStore"]:
+        """显式事务；可嵌套，嵌套时并入最外层事务，由最外层统一提交或回滚。
+        事务内改动了事实时，提交前在同一事务内刷新 fact_rollup：读者不会看到新数据版本的事实
+        配上旧的汇总（查询结果缓存只以数据版本为键）"""
+        if self._tx_depth:
+            self._tx_depth += 1
+            try:
+                yield self
+            finally:
+                self._tx_depth -= 1
+            return
+        with self.session():
+            self.con.begin()
+            self._tx_depth = 1
+            self._local.facts_changed = False
+            try:
+                yield self
+                if self._local.facts_changed:
+                    self.refresh_fact_rollup()
+            except BaseException:
+                self._tx_depth = 0
+                self.con.rollback()
+                raise
+            self._tx_depth = 0
+            self.con.commit()
+
+    @contextmanager
+    def _scan(self, data: Frame) -> Iterator[str]:
+        """把批数据注册为仅在本次调用内存在的视图并返回视图名；
+        Arrow 数据直接按列扫描，不复制到 DuckDB"""
+        if isinstance(data, pa.RecordBatch):
+            data = pa.Table.from_batches([data])
+        name = f"scan_{uuid.uuid4().hex}"
+        self.con.register(name, data)
+        try:
+            yield name
+        finally:
+            self.con.unregister(name)
+
+    @traced("store.upsert_date_dim", rows_arg="dates")
     def upsert_date_dim(self, dates: Iterable[pd.Timestamp]) -> None:
-        # Handle pandas Series by converting to list
-        if hasattr(dates, 'empty') and dates.empty:
+        if not isinstance(dates, pd.Series):
+            dates = pd.Series(list(dates), dtype=object)
+        if dates.empty:
             return
-        if hasattr(dates, 'tolist'):
-            dates = dates.tolist()
-        if not dates:
+        dates = pd.to_datetime(dates)
+        # 年/季/月在 SQL 中由日期推导，同一日期的记录内容相同，已存在时跳过
+        with self._scan(pa.table({"date": pa.array(dates.to_numpy(dtype="datetime64[ns]"))})) as view:
+            self.con.execute(
+                f"""
+                INSERT INTO date_dim
+                SELECT DISTINCT CAST(date AS DATE), year(date), quarter(date), month(date)
+                FROM {view}
+                WHERE date IS NOT NULL
+                ON CONFLICT (date) DO NOTHING
+                """
+            )
+
+    @traced("store.insert_facts", rows_arg="facts_df")
+    def insert_facts(self, facts_df: Frame, table: str = "service_fact") -> None:
+        """按 fact_id 合并一批事实：一条集合式 INSERT ... ON CONFLICT，在同一事务内完成
+        （table 可为影子表，见 begin_fact_snapshot）"""
+        if _is_empty(facts_df):
+            return
+        if isinstance(facts_df, pa.RecordBatchReader) and table == "service_fact":
+            # 记录变更要扫描两遍，流只能读一次
+            facts_df = facts_df.read_all()
+        with self._scan(facts_df) as view, self.transaction():
+            if _fact_table(table) == "service_fact":
+                self._log_fact_changes(
+                    f"(SELECT * FROM service_fact WHERE fact_id IN (SELECT fact_id FROM {view}))", view
+                )
+            self.con.execute(
+                f"""
+                INSERT INTO {_fact_table(table)}
+                SELECT fact_id, volunteer_id, service_type_id, service_date, source_row_id, ingested_at,
+                       {_period_values("CAST(service_date AS DATE)")}
+                FROM {view}
+                ON CONFLICT (fact_id) DO UPDATE SET
+                    volunteer_id = excluded.volunteer_id,
+                    service_type_id = excluded.service_type_id,
+                    service_date = excluded.service_date,
+                    source_row_id = excluded.source_row_id,
+                    ingested_at = excluded.ingested_at,
+                    {", ".join(f"{name} = excluded.{name}" for name in _PERIOD_COLUMNS)}
+                """
+            )
+
+    @traced("store.load_source_rows")
+    def load_source_rows(self, spreadsheet_id: str, sheet_name: str, min_row_index: int = 1,
+                         max_row_index: Optional[int] = None) -> pd.DataFrame:
+        """读取上次摄取时记录的每行校验和（可只取 min_row_index 至 max_row_index 的行）"""
+        sql = """
+        SELECT source_row_id, row_index, row_checksum
+        FROM source_row
+        WHERE spreadsheet_id = ? AND sheet_name = ? AND row_index >= ?
+          AND (CAST(? AS INTEGER) IS NULL OR row_index <= ?)
+        """
+        return self.con.execute(sql, [spreadsheet_id, sheet_name, min_row_index, max_row_index, max_row_index]).df()
+
+    def max_source_row_index(self, spreadsheet_id: str, sheet_name: str) -> Optional[int]:
+        """已摄取的最大行号，尚未摄取时返回 None"""
+        sql = """
+        SELECT MAX(row_index) FROM source_row
+        WHERE spreadsheet_id = ? AND sheet_name = ?
+        """
+        return self.con.execute(sql, [spreadsheet_id, sheet_name]).fetchone()[0]
+
+    @traced("store.load_fact_dates", rows_arg="source_row_ids")
+    def load_fact_dates(self, source_row_ids: List[str]) -> set:
+        """查询指定源行已写入事实的服事日期"""
+        if not source_row_ids:
+            return set()
+        ids_df = pd.DataFrame({"source_row_id": list(source_row_ids)})
+        self.con.register("lookup_rows", ids_df)
+        try:
+            df = self.con.execute(
+                """
+                SELECT DISTINCT service_date FROM service_fact
+                WHERE source_row_id IN (SELECT source_row_id FROM lookup_rows)
+                """
+            ).df()
+        finally:
+            self.con.unregister("lookup_rows")
+        return set(pd.to_datetime(df["service_date"]))
+
+    @traced("store.replace_source_rows", rows_arg="rows_df")
+    def replace_source_rows(self, spreadsheet_id: str, sheet_name: str, rows_df: pd.DataFrame) -> None:
+        """重写该工作表的行校验和（如由暂存表重建事实后）"""
+        if rows_df is None or rows_df.empty:
+            rows_df = pd.DataFrame({"source_row_id": pd.Series([], dtype=str)})
+        # source_row_id 已包含表名、行号和校验和：相同 id 的记录内容相同，
+        # 只删除已消失的、插入新出现的（DuckDB 在同一事务内无法删除后再插入相同主键）
+        self.con.register("new_source_rows", rows_df)
+        try:
+            with self.transaction():
+                self.con.execute(
+                    """
+                    DELETE FROM source_row
+                    WHERE spreadsheet_id = ? AND sheet_name = ?
+                      AND source_row_id NOT IN (SELECT source_row_id FROM new_source_rows)
+                    """,
+                    [spreadsheet_id, sheet_name],
+                )
+                if len(rows_df.columns) > 1:
+                    self.con.execute(
+                        """
+                        INSERT INTO source_row
+                        SELECT source_row_id, spreadsheet_id, sheet_name, row_index, row_checksum
+                        FROM new_source_rows
+                        WHERE source_row_id NOT IN (SELECT source_row_id FROM source_row)
+                        """
+                    )
+        finally:
+            self.con.unregister("new_source_rows")
+
+    @traced("store.append_source_rows", rows_arg="rows_df")
+    def append_source_rows(self, rows_df: Frame, table: str = "source_row") -> None:
+        """追加一批行校验和（全量与流式摄取写入影子表，见 begin_fact_snapshot）"""
+        if _is_empty(rows_df):
             return
-        df = pd.DataFrame({"date": pd.to_datetime(list(dates)).date})
-        # Remove duplicates to avoid constraint violations
-        df = df.drop_duplicates(subset=['date'])
-        df["year"] = pd.to_datetime(df["date"]).dt.year
-        df["quarter"] = pd.to_datetime(df["date"]).dt.quarter
-        df["month"] = pd.to_datetime(df["date"]).dt.month
-        self.con.execute("CREATE TEMP TABLE tmp_date AS SELECT * FROM df").df()
+        # source_row_id 已包含表名、行号和校验和，已存在的记录无需更新
+        with self._scan(rows_df) as view:
+            self.con.execute(
+                f"""
+                INSERT INTO {_snapshot_table(table, "source_row")}
+                SELECT source_row_id, spreadsheet_id, sheet_name, row_index, row_checksum
+                FROM {view}
+                ON CONFLICT (source_row_id) DO NOTHING
+                """
+            )
+
+    @traced("store.dedupe_facts")
+    def dedupe_facts(self, table: str = "service_fact") -> None:
+        """同一 service_date / volunteer_id / service_type_id 只保留 source_row_id 最小的一条
+
+        按批写入时每批只在批内去重，跨批的重复在全部写入后统一清理。
+        """
+        with self.transaction():
+            if _fact_table(table) == "service_fact":
+                self._log_fact_changes(
+                    "service_fact",
+                    """(SELECT * FROM service_fact QUALIFY ROW_NUMBER() OVER (
+                        PARTITION BY service_date, volunteer_id, service_type_id ORDER BY source_row_id) = 1)""",
+                )
+            self.con.execute(_DEDUPE_FACTS_SQL.format(table=table, scope=""))
+
+    @traced("store.begin_fact_snapshot")
+    def begin_fact_snapshot(self, sources: List[Tuple[str, str]]) -> None:
+        """
+        新建影子事实表、行校验和表与暂存表，供全量加载写入；读者与增量摄取在替换前
+        始终读取旧的正式表，加载中途失败时正式表不受影响（见 drop_fact_snapshot）
+
+        参数:
+        - sources: 本次加载的 (spreadsheet_id, sheet_name)；其余数据源的事实、行校验和与
+          暂存行原样保留（只保留仍有对应源行的事实，孤立事实随之清除）
+        """
+        for shadow, columns in _SNAPSHOT_TABLES.values():
+            self.con.execute(f"CREATE OR REPLACE TABLE {shadow} ({columns})")
+        loaded = [[list(key) for key in sources]]
         self.con.execute(
+            f"""
+            INSERT INTO {SHADOW_FACT_TABLE} BY NAME
+            SELECT f.* FROM service_fact f
+            JOIN source_row r USING (source_row_id)
+            WHERE NOT list_contains($1, [r.spreadsheet_id, r.sheet_name])
+            """,
+            loaded,
+        )
+        for table in ("source_row", "raw_sheet_row"):
+            self.con.execute(
+                f"""
+                INSERT INTO {_SNAPSHOT_TABLES[table][0]}
+                SELECT * FROM {table} WHERE NOT list_contains($1, [spreadsheet_id, sheet_name])
+                """,
+                loaded,
+            )
+
+    @traced("store.swap_fact_snapshot")
+    def swap_fact_snapshot(self, expected_rows: Dict[Tuple[str, str], int]) -> int:
+        """
+        校验影子表后在一个事务内替换 service_fact、source_row 与 raw_sheet_row，
+        返回新快照的事实条数
+
+        参数:
+        - expected_rows: 本次加载的每个数据源应有的带日期行数
+
+        校验：各数据源的行校验和条数与加载的一致，行校验和与暂存行一致，
+        且每条事实都有对应的源行；任一不符则抛出 ValueError，旧快照保持不变。
+        """
+        with self.transaction():
+            problems = []
+            for (sid, sheet), expected in expected_rows.items():
+                rows, mismatched = self.con.execute(
+                    f"""
+                    SELECT COUNT(*), COUNT(*) FILTER (WHERE r.row_checksum IS DISTINCT FROM s.row_checksum)
+                    FROM {SHADOW_SOURCE_ROW_TABLE} s
+                    LEFT JOIN {SHADOW_RAW_ROW_TABLE} r
+                      ON r.spreadsheet_id = s.spreadsheet_id AND r.sheet_name = s.sheet_name
+                     AND r.row_index = s.row_index
+                    WHERE s.spreadsheet_id = ? AND s.sheet_name = ?
+                    """,
+                    [sid, sheet],
+                ).fetchone()
+                if rows != expected:
+                    problems.append(f"{sid}:{sheet} has {rows} source rows, expected {expected}")
+                if mismatched:
+                    problems.append(f"{sid}:{sheet} has {mismatched} source rows whose checksum differs from staging")
+            orphans = self.con.execute(
+                f"""
+                SELECT COUNT(*) FROM {SHADOW_FACT_TABLE}
+                WHERE source_row_id NOT IN (SELECT source_row_id FROM {SHADOW_SOURCE_ROW_TABLE})
+                """
+            ).fetchone()[0]
+            if orphans:
+                problems.append(f"{orphans} facts reference no source row")
+            if problems:
+                raise ValueError("fact snapshot rejected: " + "; ".join(problems))
+            self._log_fact_changes("service_fact", SHADOW_FACT_TABLE)
+            # 读者在提交前看到的始终是旧表，提交后立即看到完整的新表
+            for table, (shadow, _) in _SNAPSHOT_TABLES.items():
+                self.con.execute(f"DROP TABLE {table}")
+                self.con.execute(f"ALTER TABLE {shadow} RENAME TO {table}")
+            return self.con.execute("SELECT COUNT(*) FROM service_fact").fetchone()[0]
+
+    def drop_fact_snapshot(self) -> None:
+        """放弃未完成的影子表"""
+        for shadow, _ in _SNAPSHOT_TABLES.values():
+            self.con.execute(f"DROP TABLE IF EXISTS {shadow}")
+
+    @traced("store.stage_raw_rows", rows_arg="rows_df")
+    def stage_raw_rows(self, spreadsheet_id: str, sheet_name: str, rows_df: pd.DataFrame,
+                       min_row_index: int = 1, max_row_index: Optional[int] = None,
+                       table: str = "raw_sheet_row") -> None:
+        """用本次抓取的原始行替换暂存表中该工作表 min_row_index 至 max_row_index（默认到末尾）的行
+        （table 可为影子表，见 begin_fact_snapshot）"""
+        table = _snapshot_table(table, "raw_sheet_row")
+        with self.transaction():
+            self.con.execute(
+                f"""
+                DELETE FROM {table}
+                WHERE spreadsheet_id = ? AND sheet_name = ? AND row_index >= ?
+                  AND (CAST(? AS INTEGER) IS NULL OR row_index <= ?)
+                """,
+                [spreadsheet_id, sheet_name, min_row_index, max_row_index, max_row_index],
+            )
+            if rows_df is not None and not rows_df.empty:
+                self.con.register("staged_raw_rows", rows_df)
+                try:
+                    self.con.execute(
+                        f"""
+                        INSERT INTO {table}
+                        SELECT spreadsheet_id, sheet_name, row_index, cells, row_checksum
+                        FROM staged_raw_rows
+                        """
+                    )
+                finally:
+                    self.con.unregister("staged_raw_rows")
+
+    @contextmanager
+    def _staged_dates(self, spec: Dict[str, Any]) -> Iterator[None]:
+        """把暂存表中该数据源日期列的各个文本取值交给 spec["parse_dates"] 解析，
+        在此期间注册为 staging_dates 供 _STAGED_DATES_CTE 关联"""
+        sql = _STAGED_DATE_TEXTS_SQL.format(date_index=int(spec["date_index"]))
+        texts = [r[0] for r in self.con.execute(sql, [spec["spreadsheet_id"], spec["sheet_name"]]).fetchall()]
+        self.con.register("staging_dates", pd.DataFrame({
+            "date_text": pd.Series(texts, dtype=object),
+            "service_date": spec["parse_dates"](texts),
+        }))
+        try:
+            yield
+        finally:
+            self.con.unregister("staging_dates")
+
+    @traced("store.load_staged_rows")
+    def load_staged_rows(self, spec: Dict[str, Any], dates: Iterable[Any]) -> pd.DataFrame:
+        """
+        读取暂存表中服事日期属于 dates 的原始行（row_index, cells JSON）
+
+        单行推送时用于重新推导同日期的其他行：去重落选的事实可能需要恢复。
+        spec 见 ingest.transform.staging_spec。
+        """
+        dates = sorted({pd.Timestamp(d).date() for d in dates})
+        if not dates:
+            return pd.DataFrame({"row_index": pd.Series([], dtype="int32"), "cells": pd.Series([], dtype=str)})
+        with self._staged_dates(spec):
+            return self.con.execute(
+                _STAGED_ROWS_ON_DATES_SQL.format(date_index=int(spec["date_index"])),
+                [spec["spreadsheet_id"], spec["sheet_name"], dates],
+            ).df()
+
+    @traced("store.rebuild_facts_from_staging")
+    def rebuild_facts_from_staging(self, sources: List[Dict[str, Any]]) -> int:
+        """
+        不访问 Google，按当前配置由暂存表重新推导全部事实与行校验和
+
+        参数:
+        - sources: 每个数据源的推导参数（见 ingest.transform.staging_spec）
+
+        返回写入的事实条数。
+        """
+        for spec in sources:
+            staged = self.con.execute(
+                "SELECT COUNT(*) FROM raw_sheet_row WHERE spreadsheet_id = ? AND sheet_name = ?",
+                [spec["spreadsheet_id"], spec["sheet_name"]],
+            ).fetchone()[0]
+            if not staged:
+                # 暂存为空时重建会清空全部事实
+                raise ValueError(
+                    f"no staged rows for {spec['spreadsheet_id']}:{spec['sheet_name']}; run an ingest first"
+                )
+        with self.transaction():
+            self.con.execute(
+                """
+                CREATE OR REPLACE TEMP TABLE staged_rows (
+                    source_row_id VARCHAR, spreadsheet_id VARCHAR, sheet_name VARCHAR,
+                    row_index INTEGER, row_checksum VARCHAR, service_date DATE, texts VARCHAR[]
+                )
+                """
+            )
+            self.con.execute(
+                """
+                CREATE OR REPLACE TEMP TABLE rebuilt_facts (
+                    fact_id VARCHAR, volunteer_id VARCHAR, service_type_id VARCHAR,
+                    service_date DATE, source_row_id VARCHAR
+                )
+                """
+            )
+            for spec in sources:
+                sid, sheet = spec["spreadsheet_id"], spec["sheet_name"]
+                with self._staged_dates(spec):
+                    self.con.execute(
+                        "INSERT INTO staged_rows " + _STAGED_ROWS_SQL.format(date_index=int(spec["date_index"])),
+                        [sid, sheet],
+                    )
+                scope = spec.get("fact_id_scope")
+                self.con.register("staging_roles", spec["roles"])
+                try:
+                    raw_names = [r[0] for r in self.con.execute(_STAGED_NAMES_SQL, [sid, sheet]).fetchall()]
+                    resolve = spec["resolve_name"]
+                    self.con.register("staging_names", pd.DataFrame({
+                        "raw_name": pd.Series(raw_names, dtype=object),
+                        "volunteer_id": pd.Series([resolve(n) for n in raw_names], dtype=object),
+                    }))
+                    self.con.execute(
+                        "INSERT INTO rebuilt_facts " + _STAGED_FACTS_SQL,
+                        [sid, sheet, f":{scope}" if scope else ""],
+                    )
+                finally:
+                    self.con.unregister("staging_roles")
+                    self.con.unregister("staging_names")
+
+            # 与全量转换保持一致：同一 service_date / volunteer_id / service_type_id 只保留 source_row_id 最小的一条
+            self.con.execute(
+                """
+                DELETE FROM rebuilt_facts WHERE fact_id IN (
+                    SELECT fact_id FROM (
+                        SELECT fact_id, ROW_NUMBER() OVER (
+                            PARTITION BY service_date, volunteer_id, service_type_id
+                            ORDER BY source_row_id
+                        ) AS rn
+                        FROM rebuilt_facts
+                    ) WHERE rn > 1
+                )
+                """
+            )
+            self.con.execute(
+                """
+                INSERT INTO date_dim
+                SELECT DISTINCT service_date, year(service_date), quarter(service_date), month(service_date)
+                FROM rebuilt_facts
+                WHERE service_date NOT IN (SELECT date FROM date_dim)
+                """
+            )
+            self._log_fact_changes("service_fact", "rebuilt_facts")
+            # DuckDB 在同一事务内无法删除后再插入相同主键：先更新、再插入、最后删除
+            self.con.execute(
+                """
+                UPDATE service_fact AS f SET
+                    volunteer_id = n.volunteer_id,
+                    service_type_id = n.service_type_id,
+                    service_date = n.service_date,
+                    source_row_id = n.source_row_id,
+                    ingested_at = (now() AT TIME ZONE 'UTC')
+                FROM rebuilt_facts n
+                WHERE f.fact_id = n.fact_id
+                """
+            )
+            self.con.execute(
+                f"""
+                INSERT INTO service_fact
+                SELECT fact_id, volunteer_id, service_type_id, service_date, source_row_id, (now() AT TIME ZONE 'UTC'),
+                       {_period_values("service_date")}
+                FROM rebuilt_facts
+                WHERE fact_id NOT IN (SELECT fact_id FROM service_fact)
+                """
+            )
+            self.con.execute("DELETE FROM service_fact WHERE fact_id NOT IN (SELECT fact_id FROM rebuilt_facts)")
+
+            for spec in sources:
+                self.replace_source_rows(
+                    spec["spreadsheet_id"],
+                    spec["sheet_name"],
+                    self.con.execute(
+                        """
+                        SELECT source_row_id, spreadsheet_id, sheet_name, row_index, row_checksum
+                        FROM staged_rows WHERE spreadsheet_id = ? AND sheet_name = ?
+                        """,
+                        [spec["spreadsheet_id"], spec["sheet_name"]],
+                    ).df(),
+                )
+            written = self.con.execute("SELECT COUNT(*) FROM rebuilt_facts").fetchone()[0]
+            self.con.execute("DROP TABLE staged_rows")
+            self.con.execute("DROP TABLE rebuilt_facts")
+        return written
+
+    @traced("store.refresh_fact_rollup")
+    def refresh_fact_rollup(self) -> None:
+        """
+        把 fact_rollup 刷新到当前数据版本：只重算上次刷新后有事实变动的 (周, 月) 片段，
+        从未刷新过时全量重建；已是最新时不做任何事
+        """
+        with self.transaction():
+            version = self.data_version()
+            refreshed = self.get_meta("rollup_version")
+            if refreshed is not None and int(refreshed) == version:
+                return
+            if refreshed is None:
+                self.con.execute("DELETE FROM fact_rollup")
+                self.con.execute(_ROLLUP_FACTS_SQL.format(scope=""))
+            else:
+                week_key = _PERIOD_COLUMNS["week_key"][1].format(d="service_date")
+                month_key = _PERIOD_COLUMNS["month_key"][1].format(d="service_date")
+                self.con.execute(
+                    f"""
+                    CREATE OR REPLACE TEMP TABLE rollup_fragments AS
+                    SELECT DISTINCT {week_key} AS week_key, {month_key} AS month_key
+                    FROM fact_change WHERE version > ?
+                    """,
+                    [int(refreshed)],
+                )
+                in_fragments = """WHERE EXISTS (
+                    SELECT 1 FROM rollup_fragments c
+                    WHERE c.week_key = {t}.week_key AND c.month_key = {t}.month_key
+                )"""
+                self.con.execute("DELETE FROM fact_rollup r " + in_fragments.format(t="r"))
+                self.con.execute(_ROLLUP_FACTS_SQL.format(scope=in_fragments.format(t="f")))
+                self.con.execute("DROP TABLE rollup_fragments")
+            self.set_meta("rollup_version", str(version))
+
+    @traced("store.export_lake")
+    def export_lake(self, lake_dir: str) -> int:
+        """
+        把数据导出为 Parquet 湖：service_fact 按 year=/month= 分区，维表、fact_rollup 与
+        data_version 各一个文件。只重写湖中版本之后 fact_change 涉及的月份分区（没有事实的分区删除）；
+        湖不存在或版本对不上（如库被重建）时全量导出。导出在一个读事务中进行，各文件属于同一版本。
+        ingested_at 不算改动，未重写的分区保留上次导出时的值。返回重写或删除的分区数
+        """
+        self.refresh_fact_rollup()
+        lake = Path(lake_dir).resolve()
+        with self.transaction():
+            version = self.data_version()
+            exported = _lake_version(lake)
+            if exported == version:
+                return 0
+            if exported is None or exported > version:
+                partitions = _lake_partitions(lake) | set(
+                    self.con.execute("SELECT DISTINCT year, month_key % 100 FROM service_fact").fetchall()
+                )
+            else:
+                partitions = set(self.con.execute(
+                    "SELECT DISTINCT year(service_date), month(service_date) FROM fact_change WHERE version > ?",
+                    [exported],
+                ).fetchall())
+            columns = ", ".join(_LAKE_FACT_FILE_COLUMNS)
+            for year, month in sorted(partitions):
+                path = lake / "service_fact" / f"year={year}" / f"month={month}" / _LAKE_FILE
+                facts = self.con.execute(
+                    f"SELECT {columns} FROM service_fact WHERE month_key = ? ORDER BY service_date, fact_id",
+                    [year * 100 + month],
+                ).arrow()
+                if facts.num_rows:
+                    _write_parquet(facts, path)
+                elif path.exists():
+                    path.unlink()
+                    for empty in (path.parent, path.parent.parent):
+                        if not any(empty.iterdir()):
+                            empty.rmdir()
+            # data_version 最后写入：它标志这次导出已完整
+            for name in _LAKE_TABLES:
+                _write_parquet(self.con.execute(f"SELECT * FROM {name}").arrow(), lake / name / _LAKE_FILE)
+        return len(partitions)
+
+    def _log_fact_changes(self, old: str, new: str) -> Optional[int]:
+        """
+        把 service_fact 由 old 变为 new 的差异记为一个新的数据版本（须在写入的事务内调用，
+        与写入一同提交或回滚）；无差异时不产生版本，返回新版本号或 None
+
+        参数:
+        - old / new: 表名或带括号的子查询；只需覆盖可能变化的事实
+        """
+        version = self.data_version() + 1
+        self.con.execute(_FACT_DIFF_SQL.format(old=old, new=new), [version])
+        added, removed, modified = self.con.execute(
             """
-            INSERT OR REPLACE INTO date_dim
-            SELECT date, year, quarter, month FROM tmp_date
+            SELECT
+                COUNT(*) FILTER (WHERE change = 'added'),
+                COUNT(*) FILTER (WHERE change = 'removed'),
+                COUNT(*) FILTER (WHERE change = 'modified')
+            FROM fact_change WHERE version = ?
+            """,
+            [version],
+        ).fetchone()
+        if not (added or removed or modified):
+            return None
+        self.con.execute(
+            "INSERT INTO data_version VALUES (?, ?, (now() AT TIME ZONE 'UTC'), ?, ?, ?)",
+            [version, current_run_id(), added, removed, modified],
+        )
+        self._local.facts_changed = True
+        return version
+
+    def data_version(self) -> int:
+        """当前事实数据版本；从未记录改动时为 0"""
+        return self.con.execute("SELECT COALESCE(MAX(version), 0) FROM data_version").fetchone()[0]
+
+    def query_data_versions(self, since_version: int = 0) -> pd.DataFrame:
+        """版本号大于 since_version 的各数据版本及其改动条数"""
+        return self.con.execute(
+            "SELECT * FROM data_version WHERE version > ? ORDER BY version", [since_version]
+        ).df()
+
+    def query_changes_since(self, since_version: int, by: str = "month") -> pd.DataFrame:
+        """
+        自 since_version 之后有事实变动的日期 / 月份 / 同工 / 服事类型
+
+        参数:
+        - since_version: 调用方上次同步时的 data_version()
+        - by: date | month | volunteer | service_type
+
+        返回每个变动取值的新增、删除、修改条数；下游缓存、汇总和导出只需刷新这些切片。
+        """
+        if by not in _CHANGE_DIMENSIONS:
+            raise ValueError(f"by must be one of {'|'.join(_CHANGE_DIMENSIONS)}")
+        sql = f"""
+        SELECT
+            {_CHANGE_DIMENSIONS[by]} AS {by},
+            COUNT(*) FILTER (WHERE change = 'added') AS facts_added,
+            COUNT(*) FILTER (WHERE change = 'removed') AS facts_removed,
+            COUNT(*) FILTER (WHERE change = 'modified') AS facts_modified
+        FROM fact_change
+        WHERE version > ?
+        GROUP BY 1
+        ORDER BY 1
+        """
+        return self.con.execute(sql, [since_version]).df()
+
+    def get_meta(self, key: str) -> Optional[str]:
+        row = self.con.execute("SELECT value FROM ingest_meta WHERE key = ?", [key]).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str) -> None:
+        self.con.execute(
+            "INSERT INTO ingest_meta VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+            [key, value],
+        )
+
+    @traced("store.sync_volunteers")
+    def sync_volunteers(self, aliases: Dict[str, str]) -> None:
+        """
+        volunteer 表与事实中出现的 volunteer_id 对齐，volunteer_alias 与配置的别名对齐
+
+        参数:
+        - aliases: 别名 -> volunteer_id（见 ingest.names.AliasIndex.aliases）
+        """
+        ids = [r[0] for r in self.con.execute("SELECT DISTINCT volunteer_id FROM service_fact").fetchall()]
+        volunteers_df = pd.DataFrame({
+            "volunteer_id": pd.Series(ids, dtype=object),
+            "normalized_name": pd.Series([match_key(v) for v in ids], dtype=object),
+        })
+        aliases_df = pd.DataFrame({
+            "alias": pd.Series(list(aliases), dtype=object),
+            "volunteer_id": pd.Series(list(aliases.values()), dtype=object),
+        })
+        self.con.register("current_volunteers", volunteers_df)
+        self.con.register("current_aliases", aliases_df)
+        try:
+            # 先删除已消失的，再插入或更新（DuckDB 在同一事务内无法删除后再插入相同主键）
+            with self.transaction():
+                self.con.execute(
+                    "DELETE FROM volunteer WHERE volunteer_id NOT IN (SELECT volunteer_id FROM current_volunteers)"
+                )
+                self.con.execute(
+                    """
+                    INSERT INTO volunteer
+                    SELECT volunteer_id, volunteer_id, normalized_name FROM current_volunteers
+                    ON CONFLICT (volunteer_id) DO UPDATE SET normalized_name = excluded.normalized_name
+                    """
+                )
+                self.con.execute("DELETE FROM volunteer_alias WHERE alias NOT IN (SELECT alias FROM current_aliases)")
+                self.con.execute(
+                    """
+                    INSERT INTO volunteer_alias
+                    SELECT alias, volunteer_id FROM current_aliases
+                    ON CONFLICT (alias) DO UPDATE SET volunteer_id = excluded.volunteer_id
+                    """
+                )
+        finally:
+            self.con.unregister("current_volunteers")
+            self.con.unregister("current_aliases")
+
+    @traced("store.apply_row_delta", rows_arg="facts_df")
+    def apply_row_delta(self,
+                        stale_source_row_ids: List[str],
+                        new_rows_df: pd.DataFrame,
+                        facts_df: pd.DataFrame) -> None:
+        """
+        增量摄取：删除已变更/删除行的事实，写入新增/变更行的事实
+
+        参数:
+        - stale_source_row_ids: 上次摄取中已不存在的 source_row_id（变更或删除的行）
+        - new_rows_df: 新增或变更行的 source_row 记录
+        - facts_df: 仅由新增或变更行生成的事实
+        """
+        has_facts = facts_df is not None and not facts_df.empty
+        with self.transaction():
+            # 改动前可能受影响的事实：被更新的、来自过期行的、与新事实同键（去重）的
+            scope = []
+            if has_facts:
+                self.con.register("delta_facts", facts_df)
+                scope.append("fact_id IN (SELECT fact_id FROM delta_facts)")
+                scope.append(
+                    """EXISTS (
+                        SELECT 1 FROM delta_facts n
+                        WHERE n.service_date = f.service_date
+                          AND n.volunteer_id = f.volunteer_id
+                          AND n.service_type_id = f.service_type_id
+                    )"""
+                )
+            if stale_source_row_ids:
+                self.con.register("stale_rows", pd.DataFrame({"source_row_id": list(stale_source_row_ids)}))
+                scope.append("source_row_id IN (SELECT source_row_id FROM stale_rows)")
+            if scope:
+                self.con.execute(
+                    "CREATE OR REPLACE TEMP TABLE delta_before AS SELECT * FROM service_fact f WHERE "
+                    + " OR ".join(scope)
+                )
+            if has_facts:
+                # DuckDB 在同一事务内无法删除后再插入相同主键，
+                # 因此已存在的 fact_id 走 UPDATE，新 fact_id 走 INSERT
+                self.con.execute(
+                    """
+                    UPDATE service_fact AS f SET
+                        volunteer_id = n.volunteer_id,
+                        service_type_id = n.service_type_id,
+                        service_date = n.service_date,
+                        source_row_id = n.source_row_id,
+                        ingested_at = n.ingested_at
+                    FROM delta_facts n
+                    WHERE f.fact_id = n.fact_id
+                    """
+                )
+                self.con.execute(
+                    f"""
+                    INSERT INTO service_fact
+                    SELECT fact_id, volunteer_id, service_type_id, service_date, source_row_id, ingested_at,
+                           {_period_values("CAST(service_date AS DATE)")}
+                    FROM delta_facts
+                    WHERE fact_id NOT IN (SELECT fact_id FROM service_fact)
+                    """
+                )
+            if stale_source_row_ids:
+                self.con.execute(
+                    "DELETE FROM service_fact WHERE source_row_id IN (SELECT source_row_id FROM stale_rows)"
+                )
+                self.con.execute(
+                    "DELETE FROM source_row WHERE source_row_id IN (SELECT source_row_id FROM stale_rows)"
+                )
+                self.con.unregister("stale_rows")
+            if new_rows_df is not None and not new_rows_df.empty:
+                self.con.register("new_source_rows", new_rows_df)
+                self.con.execute(
+                    """
+                    INSERT OR REPLACE INTO source_row
+                    SELECT source_row_id, spreadsheet_id, sheet_name, row_index, row_checksum
+                    FROM new_source_rows
+                    """
+                )
+                self.con.unregister("new_source_rows")
+            if has_facts:
+                # 与全量转换保持一致：仅检查本次涉及的键
+                self.con.execute(
+                    _DEDUPE_FACTS_SQL.format(
+                        table="service_fact",
+                        scope="""WHERE EXISTS (
+                            SELECT 1 FROM delta_facts n
+                            WHERE n.service_date = f.service_date
+                              AND n.volunteer_id = f.volunteer_id
+                              AND n.service_type_id = f.service_type_id
+                        )"""
+                    )
+                )
+            if scope:
+                self._log_fact_changes(
+                    "delta_before",
+                    "(SELECT * FROM service_fact WHERE fact_id IN (SELECT fact_id FROM delta_before)"
+                    + (" OR fact_id IN (SELECT fact_id FROM delta_facts))" if has_facts else ")"),
+                )
+                self.con.execute("DROP TABLE delta_before")
+            if has_facts:
+                self.con.unregister("delta_facts")
+
+    def record_ingest_run(self, job: str, started_at: datetime, finished_at: datetime,
+                          skipped: bool = False, error: Optional[str] = None) -> None:
+        """记录一次摄取运行（时间均为 UTC）；失败时保留上次成功的时间与耗时并累计连续失败次数"""
+        self.con.execute(
             """
+            INSERT INTO ingest_status
+            VALUES ($1, $2, CASE WHEN $5 IS NULL THEN $6 END, CASE WHEN $5 IS NULL THEN $3 END,
+                    CASE WHEN $5 IS NULL THEN $4 END, $5, CASE WHEN $5 IS NULL THEN 0 ELSE 1 END, NULL)
+            ON CONFLICT (job) DO UPDATE SET
+                last_started_at = excluded.last_started_at,
+                last_success_at = COALESCE(excluded.last_success_at, ingest_status.last_success_at),
+                last_duration_seconds = COALESCE(excluded.last_duration_seconds, ingest_status.last_duration_seconds),
+                last_skipped = COALESCE(excluded.last_skipped, ingest_status.last_skipped),
+                last_error = excluded.last_error,
+                consecutive_failures = CASE WHEN $5 IS NULL THEN 0 ELSE ingest_status.consecutive_failures + 1 END
+            """,
+            [job, started_at, (finished_at - started_at).total_seconds(), skipped, error, finished_at],
         )
 
-    def insert_facts(self, facts_df: pd.DataFrame) -> None:
-        if facts_df is None or facts_df.empty:
-            return
-        self.con.execute("CREATE TEMP TABLE tmp_facts AS SELECT * FROM facts_df").df()
+    def set_next_ingest_run(self, job: str, next_run_at: datetime) -> None:
+        """定时任务记录下一次计划运行时间（UTC）"""
         self.con.execute(
             """
-            INSERT OR REPLACE INTO service_fact
-            SELECT fact_id, volunteer_id, service_type_id, service_date, source_row_id, ingested_at
-            FROM tmp_facts
+            INSERT INTO ingest_status (job, consecutive_failures, next_run_at) VALUES (?, 0, ?)
+            ON CONFLICT (job) DO UPDATE SET next_run_at = excluded.next_run_at
+            """,
+            [job, next_run_at],
+        )
+
+    def record_run_trace(self, run: Dict[str, Any]) -> None:
+        """保存一次运行的分阶段耗时（run 的字段与 ingest_run 表一致，result / stages 为 JSON 文本）"""
+        self.con.execute(
             """
+            INSERT OR REPLACE INTO ingest_run
+            VALUES ($run_id, $job, $started_at, $finished_at, $wall_seconds, $error, $result, $stages)
+            """,
+            run,
         )
 
+    def query_ingest_runs(self, job: str = "ingest", limit: int = 20) -> pd.DataFrame:
+        """最近若干次运行（新的在前）"""
+        return self.con.execute(
+            "SELECT * FROM ingest_run WHERE job = ? ORDER BY started_at DESC LIMIT ?", [job, limit]
+        ).df()
+
+    def query_ingest_status(self, job: str = "ingest") -> Optional[Dict[str, Any]]:
+        """读取摄取任务状态，尚未运行过时返回 None"""
+        with self.session():
+            df = self.con.execute("SELECT * FROM ingest_status WHERE job = ?", [job]).df()
+        if df.empty:
+            return None
+        return df.iloc[0].to_dict()
+
+    @cached_result
     def query_aggregation(self, granularity: str) -> pd.DataFrame:
-        if granularity not in {"year", "quarter", "month"}:
-            raise ValueError("granularity must be one of year|quarter|month")
-        group_expr = {
-            "year": "CAST(d.year AS VARCHAR)",
-            "quarter": "d.year || '-Q' || CAST(d.quarter AS VARCHAR)",
-            "month": "d.year || '-' || LPAD(CAST(d.month AS VARCHAR), 2, '0')",
-        }[granularity]
+        group_expr = time_bucket(granularity, ("year", "quarter", "month"), alias="r")
         sql = f"""
+        WITH {_ROLLUP_TO_DATE_CTE}
         SELECT
           {group_expr} AS period,
-          COUNT(*) AS service_count
-        FROM service_fact f
-        JOIN date_dim d ON f.service_date = d.date
-        WHERE f.service_date <= CURRENT_DATE
+          CAST(SUM(r.service_count) AS BIGINT) AS service_count
+        FROM rollup r
         GROUP BY 1
         ORDER BY 1
         """
         return self.con.execute(sql).df()
 
+    @cached_result
     def query_distinct_volunteers(self) -> pd.DataFrame:
         sql = """
         SELECT DISTINCT volunteer_id AS volunteer
@@ -175,60 +1531,54 @@ class DuckDBStore:
         """
         return self.con.execute(sql).df()
 
+    @cached_result
+    def query_distinct_service_types(self) -> pd.DataFrame:
+        sql = """
+        SELECT DISTINCT service_type_id
+        FROM service_fact
+        ORDER BY service_type_id
+        """
+        return self.con.execute(sql).df()
+
+    @cached_result
     def query_participants_table(self, granularity: str) -> pd.DataFrame:
-        if granularity not in {"year", "quarter", "month"}:
-            raise ValueError("granularity must be one of year|quarter|month")
-        group_expr = {
-            "year": "CAST(d.year AS VARCHAR)",
-            "quarter": "d.year || '-Q' || CAST(d.quarter AS VARCHAR)",
-            "month": "d.year || '-' || LPAD(CAST(d.month AS VARCHAR), 2, '0')",
-        }[granularity]
+        group_expr = time_bucket(granularity, ("year", "quarter", "month"), alias="r")
         sql = f"""
-        SELECT {group_expr} AS period, volunteer_id AS volunteer, COUNT(*) AS cnt
-        FROM service_fact f
-        JOIN date_dim d ON f.service_date = d.date
-        WHERE f.service_date <= CURRENT_DATE
+        WITH {_ROLLUP_TO_DATE_CTE}
+        SELECT {group_expr} AS period, volunteer_id AS volunteer, CAST(SUM(r.service_count) AS BIGINT) AS cnt
+        FROM rollup r
         GROUP BY 1,2
         ORDER BY 1,2
         """
         return self.con.execute(sql).df()
 
+    @cached_result
     def query_volunteer_trend(self, volunteer: str, granularity: str) -> pd.DataFrame:
-        if granularity not in {"year", "quarter", "month"}:
-            raise ValueError("granularity must be one of year|quarter|month")
-        group_expr = {
-            "year": "CAST(d.year AS VARCHAR)",
-            "quarter": "d.year || '-Q' || CAST(d.quarter AS VARCHAR)",
-            "month": "d.year || '-' || LPAD(CAST(d.month AS VARCHAR), 2, '0')",
-        }[granularity]
+        group_expr = time_bucket(granularity, ("year", "quarter", "month"), alias="r")
         sql = f"""
-        SELECT {group_expr} AS period, COUNT(*) AS service_count
-        FROM service_fact f
-        JOIN date_dim d ON f.service_date = d.date
-        WHERE f.volunteer_id = ? AND f.service_date <= CURRENT_DATE
+        WITH {_ROLLUP_TO_DATE_CTE}
+        SELECT {group_expr} AS period, CAST(SUM(r.service_count) AS BIGINT) AS service_count
+        FROM rollup r
+        WHERE r.volunteer_id = ?
         GROUP BY 1
         ORDER BY 1
         """
         return self.con.execute(sql, [volunteer]).df()
 
+    @cached_result
     def query_volunteer_service_types(self, volunteer: str, granularity: str) -> pd.DataFrame:
-        if granularity not in {"year", "quarter", "month"}:
-            raise ValueError("granularity must be one of year|quarter|month")
-        group_expr = {
-            "year": "CAST(d.year AS VARCHAR)",
-            "quarter": "d.year || '-Q' || CAST(d.quarter AS VARCHAR)",
-            "month": "d.year || '-' || LPAD(CAST(d.month AS VARCHAR), 2, '0')",
-        }[granularity]
+        group_expr = time_bucket(granularity, ("year", "quarter", "month"), alias="r")
         sql = f"""
-        SELECT {group_expr} AS period, service_type_id, COUNT(*) AS service_count
-        FROM service_fact f
-        JOIN date_dim d ON f.service_date = d.date
-        WHERE f.volunteer_id = ? AND f.service_date <= CURRENT_DATE
+        WITH {_ROLLUP_TO_DATE_CTE}
+        SELECT {group_expr} AS period, service_type_id, CAST(SUM(r.service_count) AS BIGINT) AS service_count
+        FROM rollup r
+        WHERE r.volunteer_id = ?
         GROUP BY 1,2
         ORDER BY 1,2
         """
         return self.con.execute(sql, [volunteer]).df()
 
+    @cached_result
     def query_raw_data(self) -> pd.DataFrame:
         """查询原始数据，包含所有服事记录"""
         sql = """
@@ -239,19 +1589,19 @@ class DuckDBStore:
             f.service_date,
             f.source_row_id,
             f.ingested_at,
-            d.year,
-            d.quarter,
-            d.month
+            f.year,
+            f.quarter_key % 10 AS quarter,
+            f.month_key % 100 AS month
         FROM service_fact f
-        JOIN date_dim d ON f.service_date = d.date
         WHERE f.service_date <= CURRENT_DATE
         ORDER BY f.service_date DESC, f.volunteer_id, f.service_type_id
         """
         return self.con.execute(sql).df()
 
+    @cached_result
     def query_volunteer_stats_recent_weeks(self, weeks: int = 4) -> pd.DataFrame:
         """查询最近N周的同工事工统计（截止到当前日期）"""
-        sql = f"""
+        sql = """
         SELECT 
             f.volunteer_id,
             COUNT(*) as total_services,
@@ -260,14 +1610,14 @@ class DuckDBStore:
             MAX(f.service_date) as last_service_date,
             STRING_AGG(DISTINCT f.service_type_id, ', ' ORDER BY f.service_type_id) as service_types
         FROM service_fact f
-        JOIN date_dim d ON f.service_date = d.date
-        WHERE f.service_date >= CURRENT_DATE - INTERVAL {weeks} WEEKS
+        WHERE f.service_date >= CURRENT_DATE - to_weeks(CAST($1 AS INTEGER))
           AND f.service_date <= CURRENT_DATE
         GROUP BY f.volunteer_id
         ORDER BY total_services DESC, f.volunteer_id
         """
-        return self.con.execute(sql).df()
+        return self._execute("volunteer_stats_recent_weeks", sql, [weeks]).df()
 
+    @cached_result
     def query_volunteer_stats_recent_quarter(self) -> pd.DataFrame:
         """查询最近一季度(3个月)的同工事工统计（截止到当前日期）"""
         sql = """
@@ -279,7 +1629,6 @@ class DuckDBStore:
             MAX(f.service_date) as last_service_date,
             STRING_AGG(DISTINCT f.service_type_id, ', ' ORDER BY f.service_type_id) as service_types
         FROM service_fact f
-        JOIN date_dim d ON f.service_date = d.date
         WHERE f.service_date >= CURRENT_DATE - INTERVAL 3 MONTHS
           AND f.service_date <= CURRENT_DATE
         GROUP BY f.volunteer_id
@@ -291,51 +1640,35 @@ class DuckDBStore:
 
 
 
+    @cached_result
     def query_volunteer_count_trend(self, granularity: str = "month") -> pd.DataFrame:
         """查询同工总人数趋势"""
-        if granularity not in {"year", "quarter", "month", "week"}:
-            raise ValueError("granularity must be one of year|quarter|month|week")
-        
-        group_expr = {
-            "year": "CAST(d.year AS VARCHAR)",
-            "quarter": "d.year || '-Q' || CAST(d.quarter AS VARCHAR)",
-            "month": "d.year || '-' || LPAD(CAST(d.month AS VARCHAR), 2, '0')",
-            "week": "STRFTIME('%Y-W%V', f.service_date)"
-        }[granularity]
+        group_expr = time_bucket(granularity, ("year", "quarter", "month", "week"), alias="r")
         
         sql = f"""
+        WITH {_ROLLUP_TO_DATE_CTE}
         SELECT 
             {group_expr} AS period,
-            COUNT(DISTINCT f.volunteer_id) as volunteer_count,
-            COUNT(*) as total_services
-        FROM service_fact f
-        JOIN date_dim d ON f.service_date = d.date
-        WHERE f.service_date <= CURRENT_DATE
+            COUNT(DISTINCT r.volunteer_id) as volunteer_count,
+            CAST(SUM(r.service_count) AS BIGINT) as total_services
+        FROM rollup r
         GROUP BY 1
         ORDER BY 1
         """
         return self.con.execute(sql).df()
 
+    @cached_result
     def query_cumulative_participation(self, granularity: str = "month") -> pd.DataFrame:
         """查询累计参与次数趋势"""
-        if granularity not in {"year", "quarter", "month", "week"}:
-            raise ValueError("granularity must be one of year|quarter|month|week")
-        
-        group_expr = {
-            "year": "CAST(d.year AS VARCHAR)",
-            "quarter": "d.year || '-Q' || CAST(d.quarter AS VARCHAR)",
-            "month": "d.year || '-' || LPAD(CAST(d.month AS VARCHAR), 2, '0')",
-            "week": "STRFTIME('%Y-W%V', f.service_date)"
-        }[granularity]
+        group_expr = time_bucket(granularity, ("year", "quarter", "month", "week"), alias="r")
         
         sql = f"""
-        WITH period_services AS (
+        WITH {_ROLLUP_TO_DATE_CTE},
+        period_services AS (
             SELECT 
                 {group_expr} AS period,
-                COUNT(*) as period_services
-            FROM service_fact f
-            JOIN date_dim d ON f.service_date = d.date
-            WHERE f.service_date <= CURRENT_DATE
+                CAST(SUM(r.service_count) AS BIGINT) as period_services
+            FROM rollup r
             GROUP BY 1
         )
         SELECT 
@@ -347,16 +1680,10 @@ class DuckDBStore:
         """
         return self.con.execute(sql).df()
 
+    @cached_result
     def query_volunteer_join_leave_analysis(self, granularity: str = "month") -> pd.DataFrame:
         """查询同工新增/离开分析"""
-        if granularity not in {"year", "quarter", "month"}:
-            raise ValueError("granularity must be one of year|quarter|month")
-        
-        group_expr = {
-            "year": "CAST(d.year AS VARCHAR)",
-            "quarter": "d.year || '-Q' || CAST(d.quarter AS VARCHAR)",
-            "month": "d.year || '-' || LPAD(CAST(d.month AS VARCHAR), 2, '0')"
-        }[granularity]
+        group_expr = time_bucket(granularity, ("year", "quarter", "month"))
         
         sql = f"""
         WITH volunteer_periods AS (
@@ -366,7 +1693,6 @@ class DuckDBStore:
                 MIN(f.service_date) as first_service_in_period,
                 MAX(f.service_date) as last_service_in_period
             FROM service_fact f
-            JOIN date_dim d ON f.service_date = d.date
             WHERE f.service_date <= CURRENT_DATE
             GROUP BY f.volunteer_id, {group_expr}
         ),
@@ -400,15 +1726,16 @@ class DuckDBStore:
 
 
 
+    @cached_result
     def query_period_comparison_stats(self, weeks: int = 4) -> pd.DataFrame:
         """查询不同时期的同工事工环比变化"""
-        sql = f"""
+        sql = """
         WITH current_period AS (
             SELECT 
                 volunteer_id,
                 COUNT(*) as current_services
             FROM service_fact
-            WHERE service_date >= CURRENT_DATE - INTERVAL {weeks} WEEKS
+            WHERE service_date >= CURRENT_DATE - to_weeks(CAST($1 AS INTEGER))
               AND service_date <= CURRENT_DATE
             GROUP BY volunteer_id
         ),
@@ -417,8 +1744,8 @@ class DuckDBStore:
                 volunteer_id,
                 COUNT(*) as previous_services
             FROM service_fact
-            WHERE service_date >= CURRENT_DATE - INTERVAL {weeks * 2} WEEKS
-              AND service_date < CURRENT_DATE - INTERVAL {weeks} WEEKS
+            WHERE service_date >= CURRENT_DATE - to_weeks(CAST($1 AS INTEGER) * 2)
+              AND service_date < CURRENT_DATE - to_weeks(CAST($1 AS INTEGER))
             GROUP BY volunteer_id
         )
         SELECT 
@@ -437,11 +1764,12 @@ class DuckDBStore:
         WHERE COALESCE(cp.current_services, 0) > 0 OR COALESCE(pp.previous_services, 0) > 0
         ORDER BY change_amount DESC
         """
-        return self.con.execute(sql).df()
+        return self._execute("period_comparison_stats", sql, [weeks]).df()
 
+    @cached_result
     def query_service_transitions_for_sankey(self, months: int = 6) -> pd.DataFrame:
         """查询同工在不同事工类型之间的转换数据（用于桑基图）"""
-        sql = f"""
+        sql = """
         WITH volunteer_service_periods AS (
             SELECT 
                 f.volunteer_id,
@@ -449,7 +1777,7 @@ class DuckDBStore:
                 DATE_TRUNC('month', f.service_date) as service_month,
                 COUNT(*) as services_in_month
             FROM service_fact f
-            WHERE f.service_date >= CURRENT_DATE - INTERVAL {months} MONTHS
+            WHERE f.service_date >= CURRENT_DATE - to_months(CAST($1 AS INTEGER))
               AND f.service_date <= CURRENT_DATE
             GROUP BY f.volunteer_id, f.service_type_id, service_month
             HAVING COUNT(*) >= 1  -- 至少参与1次
@@ -488,11 +1816,12 @@ class DuckDBStore:
         GROUP BY from_service, to_service
         ORDER BY transition_count DESC
         """
-        return self.con.execute(sql).df()
+        return self._execute("service_transitions_for_sankey", sql, [months]).df()
 
+    @cached_result
     def query_volunteer_journey_sankey(self, time_periods: int = 6) -> pd.DataFrame:
         """查询同工参与度的演变历程（用于桑基图）"""
-        sql = f"""
+        sql = """
         WITH period_activity AS (
             SELECT 
                 f.volunteer_id,
@@ -506,7 +1835,7 @@ class DuckDBStore:
                     ELSE '超高参与度'
                 END as activity_level
             FROM service_fact f
-            WHERE f.service_date >= CURRENT_DATE - INTERVAL {time_periods} MONTHS
+            WHERE f.service_date >= CURRENT_DATE - to_months(CAST($1 AS INTEGER))
               AND f.service_date <= CURRENT_DATE
             GROUP BY f.volunteer_id, period
         ),
@@ -532,8 +1861,9 @@ class DuckDBStore:
         GROUP BY from_level, to_level
         ORDER BY transition_count DESC
         """
-        return self.con.execute(sql).df()
+        return self._execute("volunteer_journey_sankey", sql, [time_periods]).df()
 
+    @cached_result
     def query_seasonal_service_flow(self) -> pd.DataFrame:
         """查询季节性事工流动模式（用于桑基图）"""
         sql = """
@@ -541,19 +1871,18 @@ class DuckDBStore:
             SELECT 
                 f.volunteer_id,
                 f.service_type_id,
-                CASE d.quarter
+                CASE f.quarter_key % 10
                     WHEN 1 THEN '第一季度 (1-3月)'
                     WHEN 2 THEN '第二季度 (4-6月)'
                     WHEN 3 THEN '第三季度 (7-9月)'
                     WHEN 4 THEN '第四季度 (10-12月)'
                 END as season,
-                d.quarter,
+                f.quarter_key % 10 AS quarter,
                 COUNT(*) as service_count
             FROM service_fact f
-            JOIN date_dim d ON f.service_date = d.date
             WHERE f.service_date >= CURRENT_DATE - INTERVAL 2 YEARS
               AND f.service_date <= CURRENT_DATE
-            GROUP BY f.volunteer_id, f.service_type_id, d.quarter
+            GROUP BY f.volunteer_id, f.service_type_id, f.quarter_key % 10
         ),
         dominant_seasonal_service AS (
             SELECT 
@@ -590,6 +1919,7 @@ class DuckDBStore:
         """
         return self.con.execute(sql).df()
 
+    @cached_result
     def query_monthly_ministry_flow(self, 
                                     start_date: Optional[str] = None,
                                     end_date: Optional[str] = None,
@@ -607,31 +1937,6 @@ class DuckDBStore:
         - include_inactive: 是否包含"未参与"状态
         """
         
-        # 日期条件
-        date_filter = ""
-        if start_date:
-            date_filter += f" AND f.service_date >= '{start_date}'"
-        if end_date:
-            date_filter += f" AND f.service_date <= '{end_date}'"
-        
-        # 主事工判定SQL
-        if strategy == 'most_frequent':
-            main_ministry_logic = """
-                -- 最高频策略：选择每月次数最多的事工
-                ROW_NUMBER() OVER (
-                    PARTITION BY volunteer_id, year_month 
-                    ORDER BY service_count DESC, service_type_id
-                ) as rn
-            """
-        else:  # most_recent
-            main_ministry_logic = """
-                -- 最近一次策略：选择每月最后一次的事工
-                ROW_NUMBER() OVER (
-                    PARTITION BY volunteer_id, year_month 
-                    ORDER BY last_service_date DESC, service_type_id
-                ) as rn
-            """
-        
         sql = f"""
         WITH monthly_services AS (
             -- 统计每个同工每月在各事工的参与情况
@@ -644,7 +1949,7 @@ class DuckDBStore:
                 MAX(f.service_date) as last_service_date
             FROM service_fact f
             JOIN volunteer v ON f.volunteer_id = v.volunteer_id
-            WHERE 1=1 {date_filter}
+            WHERE {_DATE_RANGE_FILTER}
             GROUP BY f.volunteer_id, v.display_name, DATE_TRUNC('month', f.service_date), f.service_type_id
         ),
         main_ministry AS (
@@ -655,7 +1960,13 @@ class DuckDBStore:
                 year_month,
                 service_type_id,
                 service_count,
-                {main_ministry_logic}
+                -- 主事工判定：$4 为最高频策略（每月次数最多），否则为最近一次策略（每月最后一次）
+                ROW_NUMBER() OVER (
+                    PARTITION BY volunteer_id, year_month
+                    ORDER BY CASE WHEN $4 THEN service_count END DESC,
+                             CASE WHEN NOT $4 THEN last_service_date END DESC,
+                             service_type_id
+                ) as rn
             FROM monthly_services
         ),
         volunteer_monthly AS (
@@ -672,8 +1983,8 @@ class DuckDBStore:
         all_months AS (
             -- 生成完整的月份序列
             SELECT DISTINCT DATE_TRUNC('month', service_date) as year_month
-            FROM service_fact
-            WHERE 1=1 {date_filter}
+            FROM service_fact f
+            WHERE {_DATE_RANGE_FILTER}
             ORDER BY year_month
         ),
         volunteer_full AS (
@@ -720,13 +2031,14 @@ class DuckDBStore:
             COUNT(DISTINCT volunteer_id) as flow_count,
             STRING_AGG(DISTINCT volunteer_name, ', ' ORDER BY volunteer_name) as volunteers_list
         FROM transitions
-        {"WHERE from_ministry != '未参与' OR to_ministry != '未参与'" if not include_inactive else ""}
+        WHERE $3 OR from_ministry != '未参与' OR to_ministry != '未参与'
         GROUP BY source, target, from_month, to_month, from_ministry, to_ministry
         HAVING COUNT(DISTINCT volunteer_id) > 0
         ORDER BY from_month, flow_count DESC
         """
         
-        df = self.con.execute(sql).df()
+        df = self._execute("monthly_ministry_flow", sql, [start_date or None, end_date or None, bool(include_inactive),
+                                                       strategy == 'most_frequent']).df()
         
         # 如果需要限制Top-K事工
         if top_k_ministries and not df.empty:
@@ -756,6 +2068,7 @@ class DuckDBStore:
         
         return df
 
+    @cached_result
     def query_ministry_specific_flow(self, 
                                      ministry_id: str,
                                      start_date: Optional[str] = None,
@@ -783,6 +2096,7 @@ class DuckDBStore:
         
         return ministry_flow
 
+    @cached_result
     def query_volunteer_ministry_path(self, 
                                       volunteer_id: str,
                                       start_date: Optional[str] = None,
@@ -796,13 +2110,6 @@ class DuckDBStore:
         - end_date: 结束日期
         """
         
-        # 日期条件
-        date_filter = ""
-        if start_date:
-            date_filter += f" AND f.service_date >= '{start_date}'"
-        if end_date:
-            date_filter += f" AND f.service_date <= '{end_date}'"
-        
         sql = f"""
         WITH monthly_services AS (
             -- 统计指定同工每月在各事工的参与情况
@@ -815,7 +2122,7 @@ class DuckDBStore:
                 MAX(f.service_date) as last_service_date
             FROM service_fact f
             JOIN volunteer v ON f.volunteer_id = v.volunteer_id
-            WHERE f.volunteer_id = '{volunteer_id}' {date_filter}
+            WHERE f.volunteer_id = $3 AND {_DATE_RANGE_FILTER}
             GROUP BY f.volunteer_id, v.display_name, DATE_TRUNC('month', f.service_date), f.service_type_id
         ),
         main_ministry AS (
@@ -861,8 +2168,86 @@ class DuckDBStore:
         ORDER BY year_month
         """
         
-        return self.con.execute(sql).df()
+        return self._execute("volunteer_ministry_path", sql, [start_date or None, end_date or None, volunteer_id]).df()
+
+    @cached_result
+    def query_volunteer_ministry_flow(self,
+                                      start_date: Optional[str] = None,
+                                      end_date: Optional[str] = None,
+                                      volunteers: Optional[List[str]] = None) -> pd.DataFrame:
+        """
+        查询同工相邻月份间的主事工转换（每人每次转换一行，用于同工流动桑基图）
+        
+        参数:
+        - start_date: 开始日期 (YYYY-MM-DD格式)
+        - end_date: 结束日期 (YYYY-MM-DD格式)
+        - volunteers: 只统计这些同工，None 或空表示所有同工（作为列表参数绑定）
+        """
+        sql = f"""
+        WITH monthly_services AS (
+            -- 统计每个同工每月在各事工的参与情况
+            SELECT 
+                f.volunteer_id,
+                f.volunteer_id as volunteer_name,  -- 直接使用volunteer_id作为显示名称
+                DATE_TRUNC('month', f.service_date) as year_month,
+                f.service_type_id as ministry,
+                COUNT(*) as service_count
+            FROM service_fact f
+            WHERE {_DATE_RANGE_FILTER}
+              AND ($3 IS NULL OR list_contains(CAST($3 AS VARCHAR[]), f.volunteer_id))
+            GROUP BY f.volunteer_id, DATE_TRUNC('month', f.service_date), f.service_type_id
+        ),
+        main_ministry AS (
+            -- 确定每个同工每月的主事工（参与次数最多的）
+            SELECT 
+                volunteer_id,
+                volunteer_name,
+                year_month,
+                ministry,
+                service_count,
+                ROW_NUMBER() OVER (
+                    PARTITION BY volunteer_id, year_month 
+                    ORDER BY service_count DESC, ministry
+                ) as rn
+            FROM monthly_services
+        ),
+        volunteer_monthly AS (
+            -- 获取每个同工每月的主事工
+            SELECT 
+                volunteer_id,
+                volunteer_name,
+                year_month,
+                ministry as main_ministry
+            FROM main_ministry
+            WHERE rn = 1
+        ),
+        flow_transitions AS (
+            -- 计算相邻月份间的转换
+            SELECT 
+                curr.volunteer_name,
+                STRFTIME(curr.year_month, '%Y-%m') as from_month,
+                STRFTIME(next.year_month, '%Y-%m') as to_month,
+                curr.main_ministry as from_ministry,
+                next.main_ministry as to_ministry,
+                1 as flow_intensity
+            FROM volunteer_monthly curr
+            JOIN volunteer_monthly next 
+                ON curr.volunteer_id = next.volunteer_id
+                AND next.year_month = DATE_TRUNC('month', curr.year_month + INTERVAL '1 month')
+        )
+        SELECT 
+            volunteer_name,
+            from_month,
+            to_month,
+            from_ministry,
+            to_ministry,
+            flow_intensity
+        FROM flow_transitions
+        ORDER BY volunteer_name, from_month
+        """
+        return self._execute("volunteer_ministry_flow", sql, [start_date or None, end_date or None, list(volunteers) if volunteers else None]).df()
 
+    @cached_result
     def query_experience_progression_sankey(self) -> pd.DataFrame:
         """查询同工经验积累和进阶路径（用于桑基图）"""
         sql = """
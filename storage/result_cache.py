@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+import pandas as pd
+
+
+def result_nbytes(result: Any) -> int:
+    """结果占用的内存字节数（DataFrame 含字符串等对象列的实际大小）"""
+    if isinstance(result, pd.DataFrame):
+        return int(result.memory_usage(index=True, deep=True).sum())
+    if isinstance(result, pd.Series):
+        return int(result.memory_usage(index=True, deep=True))
+    return 256
+
+
+def _copy(result: Any) -> Any:
+    # 调用方常就地修改返回的 DataFrame，缓存里的那份不能被改动
+    if isinstance(result, (pd.DataFrame, pd.Series)):
+        return result.copy()
+    if isinstance(result, (dict, list)):
+        return type(result)(result)
+    return result
+
+
+class ResultCache:
+    """按字节预算做 LRU 淘汰的查询结果缓存。
+
+    键由调用方给出（方法、规范化参数、数据版本等）；存取都返回副本。超过预算时从最久未用的
+    条目开始淘汰，单个超过预算的结果不缓存。
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Hashable, Tuple[Any, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # 数据版本的校验状态，由 DuckDBStore 维护
+        self.signature: Optional[tuple] = None
+        self.version: Optional[int] = None
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return True, _copy(entry[0])
+
+    def put(self, key: Hashable, result: Any) -> None:
+        size = result_nbytes(result)
+        if size > self.max_bytes:
+            return
+        result = _copy(result)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[1]
+            self._entries[key] = (result, size)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.nbytes -= evicted
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.nbytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
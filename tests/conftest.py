@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import re
+import shutil
+import sys
+from datetime import date
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import pytest
+import yaml
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import ingest.config  # noqa: E402
+from ingest import sheets_client  # noqa: E402
+from ingest.transform import column_letter_to_index  # noqa: E402
+from storage import connections  # noqa: E402
+from storage.duckdb_store import DuckDBConfig, DuckDBStore  # noqa: E402
+
+
+SHEETS_EPOCH = date(1899, 12, 30)
+DB_PATH = "data/ministry.duckdb"
+
+_A1 = re.compile(r"^'((?:[^']|'')*)'!([A-Z]+)(\d*):([A-Z]+)(\d*)$")
+
+
+def serial(day: date) -> int:
+    return (day - SHEETS_EPOCH).days
+
+
+def roster_row(day: date, **roles: str) -> List[Any]:
+    """A sheet row from column A: the date as a serial number and names by
+    column letter, e.g. ``roster_row(d, Q="张三", T="李四")``."""
+    row: List[Any] = [serial(day)]
+    for letter, name in roles.items():
+        idx = column_letter_to_index(letter)
+        row.extend([""] * (idx + 1 - len(row)))
+        row[idx] = name
+    return row
+
+
+class _Request:
+    def __init__(self, result: dict) -> None:
+        self.result = result
+
+    def execute(self, http=None) -> dict:
+        return self.result
+
+
+class FakeSheetsService:
+    """Just enough of ``build("sheets", "v4")`` for ``SheetsClient``: values
+    are served from ``tabs`` (tab name -> rows from column A, row 1 first)."""
+
+    def __init__(self, spreadsheet_id: str, tabs: Dict[str, List[List[Any]]]) -> None:
+        self.spreadsheet_id = spreadsheet_id
+        self.tabs = tabs
+        self.requests = 0
+
+    def spreadsheets(self) -> "FakeSheetsService":
+        return self
+
+    def values(self) -> "FakeSheetsService":
+        return self
+
+    def _rows(self, spreadsheet_id: str, range_a1: str) -> List[List[Any]]:
+        assert spreadsheet_id == self.spreadsheet_id
+        m = _A1.match(range_a1)
+        assert m, f"unquoted or unsupported range {range_a1!r}"
+        name, first_col, top, last_col, bottom = m.groups()
+        rows = self.tabs[name.replace("''", "'")]
+        first, last = column_letter_to_index(first_col), column_letter_to_index(last_col)
+        top_i = int(top) if top else 1
+        bottom_i = int(bottom) if bottom else len(rows)
+        out = []
+        for row in rows[top_i - 1:bottom_i]:
+            cells = list(row[first:last + 1])
+            while cells and cells[-1] in ("", None):
+                cells.pop()
+            out.append(cells)
+        while out and not out[-1]:
+            out.pop()
+        return out
+
+    def get(self, spreadsheetId: str, range: Optional[str] = None, fields: Optional[str] = None) -> _Request:
+        self.requests += 1
+        if range is not None:
+            return _Request({"values": self._rows(spreadsheetId, range)})
+        return _Request({"sheets": [
+            {"properties": {"title": name, "gridProperties": {"rowCount": len(rows)}}}
+            for name, rows in self.tabs.items()
+        ]})
+
+    def batchGet(self, spreadsheetId: str, ranges: List[str], **options) -> _Request:
+        self.requests += 1
+        return _Request({"valueRanges": [{"range": a1, "values": self._rows(spreadsheetId, a1)} for a1 in ranges]})
+
+
+class _Credentials:
+    valid = True
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """A scratch directory holding a copy of configs/config.yaml; the data/
+    paths of the config resolve inside it."""
+    (tmp_path / "configs").mkdir()
+    shutil.copy(ROOT / "configs" / "config.yaml", tmp_path / "configs" / "config.yaml")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(ingest.config, "_config_cache", (None, None))
+    yield tmp_path
+    connections.close()
+
+
+def edit_config(edit: Callable[[dict], None]) -> None:
+    """Apply ``edit`` to the scratch configs/config.yaml (see ``workdir``)."""
+    path = Path("configs/config.yaml")
+    cfg = yaml.safe_load(path.read_text(encoding="utf-8"))
+    edit(cfg)
+    path.write_text(yaml.safe_dump(cfg, allow_unicode=True), encoding="utf-8")
+    ingest.config._config_cache = (None, None)
+
+
+@pytest.fixture
+def sheet(workdir, monkeypatch) -> List[List[Any]]:
+    """Rows of the configured tab (edit the list in place); the header row is
+    row 1. Every Sheets request of the process is served from it."""
+    cfg = ingest.config.load_config()
+    rows: List[List[Any]] = [["日期"] + [""] * 15 + ["音控", "导播", "摄影", "ProPresenter播放", "ProPresenter更新"]]
+    client = sheets_client.SheetsClient(credentials=_Credentials())
+    client.service = FakeSheetsService(cfg["spreadsheet_id"], {cfg["sheet_name"]: rows})
+    monkeypatch.setattr(sheets_client, "_client", client)
+    return rows
+
+
+def load_facts(db_path: str = DB_PATH):
+    """service_fact without the load timestamp, in a stable order."""
+    store = DuckDBStore(DuckDBConfig(db_path, result_cache_mb=0))
+    with store.session():
+        return store.con.execute(
+            "SELECT fact_id, service_date, service_type_id, volunteer_id, source_row_id "
+            "FROM service_fact ORDER BY fact_id"
+        ).df()
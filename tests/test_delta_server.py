@@ -0,0 +1,126 @@
+import http.client
+import json
+import threading
+from datetime import date
+from http.server import HTTPServer
+
+import pytest
+
+from conftest import load_facts, roster_row
+from ingest.config import load_config
+from jobs import delta_server
+from jobs.delta_server import DeltaHandler
+from jobs.ingest_job import run_ingest
+
+
+TOKEN = "secret"
+SUNDAY = date(2025, 3, 2)
+
+
+@pytest.fixture
+def sheet(sheet):
+    sheet.extend([
+        roster_row(SUNDAY, Q="张三", T="李四"),
+        roster_row(SUNDAY, Q="张三", U="王五"),
+        roster_row(date(2025, 3, 9), Q="赵六", R="Tom"),
+    ])
+    run_ingest("full")
+    return sheet
+
+
+@pytest.fixture
+def server(sheet, monkeypatch):
+    monkeypatch.setattr(DeltaHandler, "token", TOKEN)
+    httpd = HTTPServer(("127.0.0.1", 0), DeltaHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd.server_address
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def request(address, body, headers=None):
+    conn = http.client.HTTPConnection(*address, timeout=10)
+    try:
+        conn.request("POST", "/rows", body=body, headers=headers or {})
+        response = conn.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        conn.close()
+
+
+def push(address, row, values):
+    body = json.dumps({"sheet_name": load_config()["sheet_name"], "row": row, "values": values})
+    return request(address, body.encode("utf-8"), {"X-Ingest-Token": TOKEN})
+
+
+def assert_matches_full_load():
+    pushed = load_facts()
+    run_ingest("full", force=True)
+    assert pushed.equals(load_facts())
+
+
+def test_push_applies_edit(server, sheet):
+    sheet[3] = roster_row(date(2025, 3, 9), Q="钱七", R="Tom")
+    status, body = push(server, 4, sheet[3])
+    assert status == 200 and body["applied"][0]["facts_written"] > 0
+    volunteers = set(load_facts()["volunteer_id"])
+    assert "钱七" in volunteers and "赵六" not in volunteers
+    assert_matches_full_load()
+
+
+def test_push_retracts_emptied_row(server, sheet):
+    sheet[3] = []
+    status, body = push(server, 4, [])
+    assert status == 200 and body["applied"][0]["rows_removed"] == 1
+    facts = load_facts()
+    assert not facts["source_row_id"].str.contains(":4:").any()
+    assert {"赵六", "Tom"}.isdisjoint(facts["volunteer_id"])
+    assert_matches_full_load()
+
+
+def test_retract_resurrects_duplicate_on_same_date(server, sheet):
+    # Rows 2 and 3 both put 张三 on 音控 that Sunday; row 2's fact is kept
+    before = load_facts()
+    kept = before[before["volunteer_id"] == "张三"]
+    assert len(kept) == 1 and ":2:" in kept["source_row_id"].iloc[0]
+
+    sheet[1] = []
+    assert push(server, 2, [])[0] == 200
+    after = load_facts()
+    revived = after[after["volunteer_id"] == "张三"]
+    assert len(revived) == 1 and ":3:" in revived["source_row_id"].iloc[0]
+    assert "李四" not in set(after["volunteer_id"])
+    assert_matches_full_load()
+
+
+def test_push_requires_token(server, sheet):
+    before = load_facts()
+    body = json.dumps({"sheet_name": load_config()["sheet_name"], "row": 4, "values": []}).encode("utf-8")
+    assert request(server, body)[0] == 401
+    assert request(server, body, {"X-Ingest-Token": "wrong"})[0] == 401
+    assert load_facts().equals(before)
+
+
+@pytest.mark.parametrize("length", ["abc", "-1", "1e3", "٣"])
+def test_invalid_content_length(server, length):
+    conn = http.client.HTTPConnection(*server, timeout=10)
+    try:
+        conn.putrequest("POST", "/rows")
+        conn.putheader("X-Ingest-Token", TOKEN)
+        conn.putheader("Content-Length", length.encode("utf-8"))
+        conn.endheaders()
+        response = conn.getresponse()
+        assert response.status == 400
+    finally:
+        conn.close()
+
+
+def test_oversized_body(server):
+    status, _ = request(server, b"[]", {"X-Ingest-Token": TOKEN, "Content-Length": str(delta_server.MAX_BODY_BYTES + 1)})
+    assert status == 413
+
+
+def test_serve_refuses_public_host_without_token():
+    with pytest.raises(ValueError, match="without a token"):
+        delta_server.serve("0.0.0.0", 0)
@@ -0,0 +1,190 @@
+from datetime import date, timedelta
+
+import pytest
+
+from conftest import DB_PATH, edit_config, load_facts, roster_row
+from ingest import transform
+from jobs import ingest_job
+from jobs.ingest_job import run_ingest
+from storage.duckdb_store import DuckDBConfig, DuckDBStore
+
+
+NAMES = ["张三", "李四", "王五", "赵六", "Tom", ""]
+
+
+def fill(sheet, n_rows=90):
+    """``n_rows`` Sunday rows after the header, crossing the row-70 column
+    change; every fourth row repeats the previous date."""
+    day = date(2024, 1, 7)
+    for i in range(n_rows):
+        if i % 4 != 3:
+            day += timedelta(days=7)
+        pick = lambda k: NAMES[(i * 7 + k) % len(NAMES)]  # noqa: E731
+        sheet.append(roster_row(day, Q=pick(0), R=pick(1), S=pick(2), T=pick(3), U=pick(4)))
+
+
+def data_version():
+    store = DuckDBStore(DuckDBConfig(DB_PATH, result_cache_mb=0))
+    with store.session():
+        return store.data_version()
+
+
+def last_loaded_at():
+    store = DuckDBStore(DuckDBConfig(DB_PATH, result_cache_mb=0))
+    with store.session():
+        return store.con.execute("SELECT MAX(ingested_at) FROM service_fact").fetchone()[0]
+
+
+def test_unchanged_sheet_is_skipped(sheet):
+    fill(sheet)
+    first = run_ingest()
+    assert not first.skipped and first.facts_written > 0
+    version = data_version()
+
+    second = run_ingest()
+    assert second.skipped
+    assert data_version() == version
+
+
+def test_force_reloads_unchanged_sheet(sheet, capsys):
+    fill(sheet)
+    run_ingest("full")
+    facts = load_facts()
+    loaded_at = last_loaded_at()
+
+    ingest_job.main(["--mode", "full", "--force"])
+    assert "skipped=False" in capsys.readouterr().out
+    assert last_loaded_at() > loaded_at
+    # Same content: the facts and the data version stay as they were
+    assert load_facts().equals(facts)
+    assert data_version() == 1
+
+
+def test_incremental_matches_full_load(sheet):
+    fill(sheet)
+    run_ingest("incremental")
+    sheet[5][16] = "新人"               # rename
+    sheet[9] = []                      # emptied row
+    del sheet[20]                      # deleted row shifts everything below
+    sheet[30] = list(sheet[29])        # duplicate of the row above
+    sheet.append(roster_row(date(2026, 1, 4), Q="张三", S="李四"))
+    sheet.append(roster_row(date(2026, 1, 4), Q="张三"))
+
+    result = run_ingest("incremental")
+    assert not result.skipped and result.rows_changed > 0
+    incremental = load_facts()
+
+    run_ingest("full", force=True)
+    assert incremental.equals(load_facts())
+
+
+def test_rejected_snapshot_keeps_previous_facts(sheet, monkeypatch):
+    fill(sheet)
+    run_ingest("full")
+    before = load_facts()
+    sheet[5][16] = "新人"
+
+    staging = transform.rows_to_staging
+
+    def corrupt(values, row_numbers=None, cfg=None, checksums=None):
+        df = staging(values, row_numbers=row_numbers, cfg=cfg, checksums=checksums)
+        df.loc[df.index[-1], "row_checksum"] = "0" * 40
+        return df
+
+    monkeypatch.setattr(transform, "rows_to_staging", corrupt)
+    with pytest.raises(ValueError, match="checksum differs from staging"):
+        run_ingest("full")
+    assert load_facts().equals(before)
+
+    # The rejected payload was not cached, so the next run loads it
+    monkeypatch.setattr(transform, "rows_to_staging", staging)
+    result = run_ingest("full")
+    assert not result.skipped
+    assert "新人" in set(load_facts()["volunteer_id"])
+
+
+def test_role_window_change_rederives_incrementally(sheet):
+    fill(sheet)
+    run_ingest("incremental")
+
+    def move_window(cfg):
+        for role in cfg["columns"]["roles"]:
+            if role.get("valid_until_row") == 69:
+                role["valid_until_row"] = 49
+            if role.get("valid_from_row") == 70:
+                role["valid_from_row"] = 50
+
+    edit_config(move_window)
+    result = run_ingest("incremental")
+    assert not result.skipped
+    incremental = load_facts()
+    # The new config is remembered: the next refresh is a skip
+    assert run_ingest("incremental").skipped
+
+    run_ingest("full", force=True)
+    assert incremental.equals(load_facts())
+
+
+TEXT_DATES = ["Jan 7, 2024", "14 Jan 2024", "2024-01-21", "01/28/2024", " 2024/2/4 ", "Sunday, February 11, 2024"]
+
+
+def test_first_ingest_keeps_text_dates(sheet):
+    for i, text in enumerate(TEXT_DATES):
+        sheet.append([text] + [""] * 15 + [NAMES[i % 4], "", "", "Tom"])
+    run_ingest()
+    facts = load_facts()
+    assert len(facts) == 2 * len(TEXT_DATES)
+    assert facts["service_date"].nunique() == len(TEXT_DATES)
+
+
+def test_alias_change_keeps_text_dates(sheet):
+    for i, text in enumerate(TEXT_DATES):
+        sheet.append([text] + [""] * 15 + [NAMES[i % 4], "", "", "Tom"])
+    run_ingest()
+    edit_config(lambda cfg: cfg.update(volunteer_aliases={"张三": ["Tom"]}))
+    assert not run_ingest().skipped
+    rebuilt = load_facts()
+    assert "Tom" not in set(rebuilt["volunteer_id"])
+    assert rebuilt["service_date"].nunique() == len(TEXT_DATES)
+
+    run_ingest("full", force=True)
+    assert rebuilt.equals(load_facts())
+
+
+def load_rows():
+    store = DuckDBStore(DuckDBConfig(DB_PATH, result_cache_mb=0))
+    with store.session():
+        return [store.con.execute(f"SELECT * FROM {table} ORDER BY ALL").df()
+                for table in ("source_row", "raw_sheet_row")]
+
+
+def test_failed_stream_keeps_previous_load(sheet, monkeypatch):
+    fill(sheet)
+    run_ingest("incremental")
+    facts, rows = load_facts(), load_rows()
+    edit_config(lambda cfg: cfg["ingest"].update(block_size=20))
+    sheet[5][16] = "新人"
+    del sheet[30]
+
+    batches = ingest_job.iter_fact_batches
+
+    def failing(blocks, cfg=None):
+        for i, batch in enumerate(batches(blocks, cfg=cfg)):
+            if i == 2:
+                raise ConnectionError("fetch failed")
+            yield batch
+
+    monkeypatch.setattr(ingest_job, "iter_fact_batches", failing)
+    with pytest.raises(ConnectionError):
+        run_ingest("stream")
+    assert load_facts().equals(facts)
+    assert all(a.equals(b) for a, b in zip(load_rows(), rows))
+
+    # The incremental baseline is intact: the next run matches a full load
+    monkeypatch.setattr(ingest_job, "iter_fact_batches", batches)
+    run_ingest("incremental")
+    incremental = load_facts()
+    run_ingest("stream")
+    assert incremental.equals(load_facts())
+    run_ingest("full", force=True)
+    assert incremental.equals(load_facts())